@@ -1,5 +1,6 @@
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings
+import os
 
 
 class GCPConfig(BaseSettings):
@@ -11,7 +12,29 @@ class GCPConfig(BaseSettings):
         "https://embedding-service-214571216460.northamerica-south1.run.app"
     )
     EMBED_TEXT_ENDPOINT: str = "/embed-text"
-    EMBEDDING_SERVICE_IDTOKEN: SecretStr = ""
+    EMBED_QUERY_ENDPOINT: str = "/embed-query"
+    EMBED_TEXT_STREAM_ENDPOINT: str = "/embed-text/stream"
+    # Seconds before the expiration of the ID token of the embedding service when a new one is generated
+    ID_TOKEN_REFRESH_MARGIN: int = 300
+    # Seconds to wait for each read of a response of the embedding service, and to open a connection
+    EMBEDDING_SERVICE_TIMEOUT: float = 300.0
+    EMBEDDING_SERVICE_CONNECT_TIMEOUT: float = 10.0
+    # Retries of a request to the embedding service that failed because of the network or a 429/5xx
+    # response of Cloud Run (ex. while a new instance starts)
+    EMBEDDING_SERVICE_MAX_RETRIES: int = 3
+    # Max seconds to wait before a retry, even if the Retry-After header of the response asks for more
+    EMBEDDING_SERVICE_MAX_RETRY_AFTER: float = 30.0
+    # Max number of open connections to the embedding service, kept alive between requests
+    EMBEDDING_SERVICE_MAX_CONNECTIONS: int = 20
+    # Use HTTP/2 with the embedding service when the h2 package is installed
+    EMBEDDING_SERVICE_HTTP2: bool = True
+    # After this number of consecutive failed requests, the requests to the embedding service fail
+    # without being sent for EMBEDDING_SERVICE_CIRCUIT_RESET_SECONDS
+    EMBEDDING_SERVICE_CIRCUIT_FAILURES: int = 5
+    EMBEDDING_SERVICE_CIRCUIT_RESET_SECONDS: float = 30.0
+    # Format of the vectors returned by the embedding service: "float32" or "float16" for
+    # base64 packed vectors, "float" for lists of floats
+    EMBEDDING_VECTOR_DTYPE: str = "float32"
     BQ_DATASET: str = "energy_expert"
     BQ_CHAT_SESSIONS_TABLE: str = "chat_sessions"
     BQ_USERS_TABLE: str = "users"
@@ -21,6 +44,11 @@ class GCPConfig(BaseSettings):
     BQ_PROMPTS_PK: str = "prompt_id"
     BQ_LLMS_PK: str = "llm_version_id"
     BQ_CHAT_SESSIONS_PK: str = "chat_session_id"
+    # Number of files uploaded or downloaded at the same time by the bulk GCS transfers
+    GCS_TRANSFER_WORKERS: int = 8
+    # Size in bytes of each chunk of the resumable uploads and ranged downloads of the bulk GCS
+    # transfers. Must be a multiple of 256 KB
+    GCS_TRANSFER_CHUNK_SIZE: int = 32 * 1024 * 1024
 
 
 class QdrantConfig(BaseSettings):
@@ -35,6 +63,35 @@ class QdrantConfig(BaseSettings):
     DOCUMENTS_RETRIEVED_LIMIT: int = 5
     CHUNK_OVERLAP: int = 100
     EMBEDDING_MODEL_NAME: str = "sentence-transformers/LaBSE"
+    # Number of points sent to Qdrant on each upsert request
+    UPSERT_BATCH_SIZE: int = 64
+    # Number of threads sending batches of points to Qdrant at the same time
+    UPSERT_PARALLEL_WORKERS: int = 4
+    # Number of times a failed batch is retried, with exponential backoff between retries
+    UPSERT_MAX_RETRIES: int = 3
+    # Cache the results of the semantic search in the memory of the process
+    QUERY_CACHE_ENABLED: bool = True
+    # Number of searches kept in the cache, the least recently used are evicted
+    QUERY_CACHE_MAX_ENTRIES: int = 1024
+    # Seconds a search is cached. It bounds how outdated the results are when another process
+    # updates the collection
+    QUERY_CACHE_TTL_SECONDS: float = 3600.0
+    # Reuse the results of a cached query whose vector is similar enough to the new query. Disabled
+    # by default: queries that only differ in an entity, a year or an article number
+    # (ex. "artículo 12" and "artículo 13") can have very similar vectors but need other documents
+    QUERY_CACHE_SIMILARITY_ENABLED: bool = False
+    # Minimum cosine similarity between the vectors of two queries to reuse the results. Check it
+    # against such pairs of queries of the corpus before enabling the similarity level
+    QUERY_CACHE_SIMILARITY_THRESHOLD: float = 0.97
+    # How the scores of a chunk retrieved by several windows of a long query are merged:
+    # "rrf" (reciprocal rank fusion) or "max" (highest similarity)
+    RESULTS_FUSION: str = "rrf"
+    # Constant k of the reciprocal rank fusion, score = sum(1 / (k + rank))
+    RRF_K: int = 60
+    # Maximum number of tokens of the retrieved text passed to the LLM as context
+    CONTEXT_TOKEN_BUDGET: int = 3000
+    # Average characters per token used to estimate the tokens of a text without a tokenizer
+    CHARS_PER_TOKEN: float = 4.0
 
 
 class LLMConfig(BaseSettings):
@@ -43,3 +100,30 @@ class LLMConfig(BaseSettings):
     API_KEY: SecretStr = ""
     MODEL: str = "gemini-2.0-flash"
     TEMPERATURE: float = 0.05
+
+
+class IngestionConfig(BaseSettings):
+    # Number of processes parsing documents at the same time in batch mode
+    PARSE_WORKERS: int = os.cpu_count() or 1
+    # Max number of documents being embedded and indexed at the same time in batch mode
+    EMBEDDING_CONCURRENCY: int = 4
+    # File where batch mode stores the status of each document, used to resume an interrupted batch
+    BATCH_STATE_FILE: str = "batch_ingestion_state.json"
+    # Number of processes converting the pages of a single PDF to markdown. 1 disables the
+    # page-parallel parsing
+    PDF_PAGE_WORKERS: int = os.cpu_count() or 1
+    # PDFs with fewer pages are parsed in the current process, starting the pool costs more
+    PDF_PARALLEL_MIN_PAGES: int = 32
+    # Number of consecutive pages converted by each task of the pool
+    PDF_PAGES_PER_TASK: int = 8
+    # Max number of characters of markdown sent on each request to the embedding service when the
+    # pages of a document are streamed. A longer section is cut at a blank line, and its chunks
+    # near the cut differ from those of the whole document
+    STREAM_BLOCK_CHARS: int = 50000
+    # Number of blocks of markdown parsed ahead while the previous ones are embedded and indexed
+    STREAM_PREFETCH_BLOCKS: int = 2
+    # Reuse the markdown of the documents already parsed (with the same content and parser version)
+    PARSE_CACHE_ENABLED: bool = True
+    # Where the parsed documents are stored. Either a local directory or a gcs prefix
+    # (ex: 'gs://bucket_name/parse_cache/')
+    PARSE_CACHE_LOCATION: str = "parse_cache"
@@ -1,18 +1,24 @@
 from google.cloud.iam_credentials_v1 import IAMCredentialsClient
-import sys
+from threading import Event, Lock, Thread
+from loguru import logger
 from functools import lru_cache
+import base64
+import json
+import time
+import sys
 
 sys.path.append("..")
 
 from rag_llm_energy_expert.config import QdrantConfig, GCPConfig, LLMConfig
 from rag_llm_energy_expert.utils.gcp.secret_manager import get_secret
+from rag_llm_energy_expert.utils.lazy_init import lazy_singleton
 
 gcp_config = GCPConfig()
 llm_config = LLMConfig()
 qdrant_config = QdrantConfig()
 
 
-@lru_cache()
+@lazy_singleton
 def get_qdrant_config() -> QdrantConfig:
     """
     Get the qdrant client with secret information
@@ -54,18 +60,157 @@ def generate_id_token(audience: str) -> str:
     return response_token.token
 
 
-@lru_cache()
-def get_gcp_config() -> GCPConfig:
+def token_expiry(token: str) -> float:
+    """
+    Read the expiration time of a JWT (as the ID tokens), without verifying its signature
+
+    Args:
+        token: str -> JWT
+
+    Return:
+        float -> Unix time when the token expires
+    """
+    payload = token.split(".")[1]
+
+    # The segments of a JWT are base64url encoded without padding
+    claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+
+    return float(claims["exp"])
+
+
+class IDTokenProvider:
     """
-    Get the GCP client with secret info
+    Provide the ID token of an audience, cached until its expiration. Once the first token is
+    requested, a background thread generates a new one ID_TOKEN_REFRESH_MARGIN seconds before the
+    current one expires, so the requests never wait for IAM nor use an expired token.
     """
-    embedding_service_audience = gcp_config.EMBEDDING_SERVICE_URL
-    embedding_service_id_token = generate_id_token(embedding_service_audience)
 
-    return GCPConfig(EMBEDDING_SERVICE_IDTOKEN=embedding_service_id_token)
+    def __init__(
+        self,
+        audience: str,
+        refresh_margin: int = gcp_config.ID_TOKEN_REFRESH_MARGIN,
+    ):
+        if not isinstance(audience, str) or audience == "":
+            raise ValueError("audience must be a not null string")
+
+        if not isinstance(refresh_margin, int) or refresh_margin < 0:
+            raise ValueError(
+                "refresh_margin must be an integer greater or equal than 0"
+            )
+
+        self.audience = audience
+        self.refresh_margin = refresh_margin
+
+        self._token = None
+        self._expiry = 0.0
+        self._lock = Lock()
+        self._stop = Event()
+        self._refresh_thread = None
+
+    def refresh(self) -> None:
+        # Generate a new token and store it with its expiration time
+        token = generate_id_token(self.audience)
+
+        # The token is replaced before the expiry, so a valid expiry always comes with its token
+        self._token = token
+        self._expiry = token_expiry(token)
+
+        logger.info(
+            f"ID token generated for {self.audience}, valid for {self._expiry - time.time():.0f}s"
+        )
+
+    def token(self) -> str:
+        """
+        Get a valid ID token. It only generates the token when there is no valid one, which only
+        happens on the first call or if the background refresh failed until the token expired
+
+        Args:
+            None
+
+        Return:
+            str -> ID Token
+        """
+        if time.time() >= self._expiry:
+            # Only one of the threads waiting for the token generates it
+            with self._lock:
+                if time.time() >= self._expiry:
+                    self.refresh()
+
+        if self._refresh_thread is None:
+            with self._lock:
+                if self._refresh_thread is None:
+                    self._refresh_thread = Thread(
+                        target=self._refresh_loop, daemon=True
+                    )
+                    self._refresh_thread.start()
+
+        return self._token
+
+    def _refresh_loop(self) -> None:
+        # Runs in the background thread until stop is called
+        retry_delay = 1.0
+
+        while not self._stop.is_set():
+            wait_seconds = self._expiry - self.refresh_margin - time.time()
+
+            if wait_seconds > 0 and self._stop.wait(wait_seconds):
+                return
+
+            try:
+                self.refresh()
+                retry_delay = 1.0
+
+            except Exception as e:
+                # The current token may still be valid, try again later
+                logger.warning(f"The ID token could not be refreshed: {e}")
+
+                if self._stop.wait(retry_delay):
+                    return
+
+                retry_delay = min(retry_delay * 2, 60.0)
+
+    def stop(self) -> None:
+        # Stop the background refresh
+        self._stop.set()
 
 
 @lru_cache()
+def get_id_token_provider(audience: str) -> IDTokenProvider:
+    """
+    Get the ID token provider of an audience, shared by all the modules of the process
+
+    Args:
+        audience: str -> Indicates who will receive or verify the token
+
+    Return:
+        IDTokenProvider instance
+    """
+    return IDTokenProvider(audience)
+
+
+def get_embedding_service_token() -> str:
+    """
+    Get a valid ID token to authenticate the requests to the embedding service
+
+    Args:
+        None
+
+    Return:
+        str -> ID Token
+    """
+    return get_id_token_provider(gcp_config.EMBEDDING_SERVICE_URL).token()
+
+
+@lazy_singleton
+def get_gcp_config() -> GCPConfig:
+    """
+    Get the GCP config. The ID token of the embedding service is not part of it, as it expires,
+    use get_embedding_service_token instead
+    """
+    return GCPConfig()
+
+
+@lazy_singleton
 def get_llm_config() -> LLMConfig:
     """
     Get the LLMConfig with secret info
@@ -8,19 +8,23 @@ import sys
 sys.path.append("../..")
 
 from rag_llm_energy_expert.credentials import get_llm_config
-from rag_llm_energy_expert.config import GCPConfig, QdrantConfig
+from rag_llm_energy_expert.config import GCPConfig, QdrantConfig, LLMConfig
+from rag_llm_energy_expert.search.context_builder import estimate_tokens
 from rag_llm_energy_expert.search.searchers import semantic_search
+from rag_llm_energy_expert.utils.lazy_init import lazy_singleton
 
 
-# Initialize the config classes
+# Initialize the config classes. The api key of the LLM is only requested by get_genai_client
 qdrant_config = QdrantConfig()
-llm_config = get_llm_config()
+llm_config = LLMConfig()
 gcp_config = GCPConfig()
 
-# Initialize the GenAi client
-genai_client = genai.Client(
-    api_key=llm_config.API_KEY.get_secret_value(),
-)
+
+@lazy_singleton
+def get_genai_client() -> genai.Client:
+    # GenAI client, created on its first use
+    return genai.Client(api_key=get_llm_config().API_KEY.get_secret_value())
+
 
 # Create the system prompt that all the chat sessions will have
 main_system_prompt = (
@@ -55,7 +59,7 @@ def create_chat_session(
     logger.info("Creating a new chat session...")
 
     # Create a new chat session
-    chat_session = genai_client.chats.create(
+    chat_session = get_genai_client().chats.create(
         model=model,
         config=types.GenerateContentConfig(
             temperature=temperature,
@@ -76,6 +80,7 @@ def generate_response(
     collection_name: str = qdrant_config.COLLECTION_NAME
     + qdrant_config.COLLECTION_VERSION,
     documents_limit: int = qdrant_config.DOCUMENTS_RETRIEVED_LIMIT,
+    context_token_budget: int = qdrant_config.CONTEXT_TOKEN_BUDGET,
     system_prompt: str = main_system_prompt,
 ) -> str:
     """
@@ -90,6 +95,8 @@ def generate_response(
         embedding_model_name (str): The name of the embedding model to use for semantic search.
         collection_name (str): The name of the Qdrant collection to search in.
         documents_limit (int): The maximum number of documents to retrieve from Qdrant.
+        context_token_budget (int): The maximum number of tokens of the context passed to the LLM.
+            The most relevant chunks are kept, each one with the title of its document.
 
     Returns:
         str: The generated response from the LLM.
@@ -104,8 +111,12 @@ def generate_response(
         collection_name=collection_name,
         chunk_overlap=chunk_overlap,
         embedding_model_name=embedding_model_name,
+        token_budget=context_token_budget,
+    )
+    logger.info(
+        f"Context retrieved successfully (~{estimate_tokens(context)} of "
+        f"{context_token_budget} tokens)."
     )
-    logger.info("Context retrieved successfully.")
     chat_config = types.GenerateContentConfig(
         temperature=temperature,
         system_instruction=f"{system_prompt}\n\nContext: {context}",
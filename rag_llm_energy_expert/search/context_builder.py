@@ -0,0 +1,106 @@
+from qdrant_client import models
+from typing import Union
+import math
+import sys
+
+sys.path.append("../../..")
+
+from rag_llm_energy_expert.config import QdrantConfig
+
+qdrant_config = QdrantConfig()
+
+
+def estimate_tokens(
+    text: str, chars_per_token: float = qdrant_config.CHARS_PER_TOKEN
+) -> int:
+    """
+    Estimate the number of tokens of a text from its length, without loading a tokenizer
+
+    Args:
+        text: str -> Text to measure
+        chars_per_token: float -> Average number of characters per token
+
+    Return:
+        int -> Estimated number of tokens
+    """
+    return math.ceil(len(text) / chars_per_token)
+
+
+def chunk_source(payload: dict) -> str:
+    """
+    Describe where a chunk comes from, with the metadata stored in its payload
+
+    Args:
+        payload: dict -> Payload of the point, with the keys "text" and "metadata"
+
+    Return:
+        str -> Title of the document. Ex: "Ley de la Industria Electrica". Empty if the chunk has no title
+    """
+    metadata = payload.get("metadata") or dict()
+
+    return str(metadata["title"]) if metadata.get("title") else ""
+
+
+def format_chunk(payload: dict, with_sources: bool) -> str:
+    # Text of a chunk as it is shown to the LLM
+    source = chunk_source(payload) if with_sources else ""
+
+    if source == "":
+        return payload["text"]
+
+    return f"[Source: {source}]\n{payload['text']}"
+
+
+def build_context(
+    points: list[models.ScoredPoint],
+    token_budget: Union[int, None] = qdrant_config.CONTEXT_TOKEN_BUDGET,
+    with_sources: bool = True,
+) -> dict:
+    """
+    Pack the chunks with the highest scores into the context passed to the LLM, without exceeding
+    a budget of tokens. The tokens of each chunk are estimated with estimate_tokens, including its
+    source and the separator between chunks
+
+    Args:
+        points: list[models.ScoredPoint] -> Points retrieved by the search, ex. by fuse_query_results
+        token_budget: Union[int, None] -> Maximum number of tokens of the context. The chunks that
+                                          don't fit are skipped. None for no limit
+        with_sources: bool -> If True, each chunk starts with the title of its document, so the LLM can cite it
+
+    Return:
+        dict -> "text" of the context, estimated "tokens" used, number of "chunks" packed and of
+                "skipped_chunks" that didn't fit
+    """
+    if token_budget is not None and (
+        not isinstance(token_budget, int) or token_budget < 1
+    ):
+        raise ValueError(
+            "token_budget must be None or an integer greater or equal than 1"
+        )
+
+    separator = "\n\n"
+    separator_tokens = estimate_tokens(separator)
+
+    chunks = list()
+    used_tokens = 0
+    skipped_chunks = 0
+
+    # sorted() is stable, so the points with the same score keep their order
+    for point in sorted(points, key=lambda point: -point.score):
+        chunk = format_chunk(point.payload, with_sources)
+        tokens = estimate_tokens(chunk) + (separator_tokens if chunks else 0)
+
+        # A smaller chunk with a lower score may still fit
+        if token_budget is not None and used_tokens + tokens > token_budget:
+            skipped_chunks += 1
+            continue
+
+        chunks.append(chunk)
+        used_tokens += tokens
+
+    return {
+        "text": separator.join(chunks),
+        "tokens": used_tokens,
+        "chunks": len(chunks),
+        "skipped_chunks": skipped_chunks,
+    }
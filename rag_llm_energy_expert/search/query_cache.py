@@ -0,0 +1,320 @@
+from qdrant_client import models
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Union
+from loguru import logger
+import numpy as np
+import unicodedata
+import time
+import sys
+
+sys.path.append("../../..")
+
+from rag_llm_energy_expert.config import QdrantConfig
+from rag_llm_energy_expert.utils.lazy_init import lazy_singleton
+from rag_llm_energy_expert.utils.vector_db.qdrant import collection_update_callbacks
+
+qdrant_config = QdrantConfig()
+
+# Characters ignored at the start and the end of a query. Ex: "¿Qué es la CFE?" -> "qué es la cfe"
+QUERY_PUNCTUATION = " ¿?¡!.,;:\"'"
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a query before using it as a cache key, so queries that only differ in case,
+    whitespaces, the unicode representation of their characters or the surrounding punctuation
+    share the same entry
+
+    Args:
+        query: str -> User's query
+
+    Return:
+        str -> Normalized query
+    """
+    query = unicodedata.normalize("NFKC", " ".join(query.split()))
+
+    return query.strip(QUERY_PUNCTUATION).casefold()
+
+
+def query_vector(search_queries: list[models.QueryRequest]) -> np.ndarray:
+    """
+    Return a single unit vector for the query, the mean of the vectors of its windows
+
+    Args:
+        search_queries: list[models.QueryRequest] -> QueryRequests generated by process_query
+
+    Return:
+        np.ndarray -> Unit vector of the query
+    """
+    vectors = np.asarray(
+        [request.query for request in search_queries], dtype=np.float32
+    )
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    vector = vectors.mean(axis=0)
+
+    return vector / np.linalg.norm(vector)
+
+
+class QueryCache:
+    """
+    Cache of the results of the semantic search, with two levels:
+        - exact: keyed by the normalized query and the parameters of the search, it skips the
+          embedding service and Qdrant
+        - similar: a query whose vector has a cosine similarity of at least similarity_threshold
+          with a cached query of the same search parameters reuses its results. It skips Qdrant.
+          Optional (similarity_threshold=None disables it), as queries that only differ in an
+          entity, a year or an article number may reach the threshold
+    The entries expire after ttl_seconds, and the least recently used ones are evicted after
+    max_entries. The entries of a collection are removed when its points change in this process.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        similarity_threshold: Union[float, None],
+    ):
+        if not isinstance(max_entries, int) or max_entries < 1:
+            raise ValueError("max_entries must be an integer greater or equal than 1")
+
+        if not isinstance(ttl_seconds, (int, float)) or ttl_seconds <= 0:
+            raise ValueError("ttl_seconds must be a number greater than 0")
+
+        if similarity_threshold is not None and not 0 < similarity_threshold <= 1:
+            raise ValueError("similarity_threshold must be None or between 0 and 1")
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        # key -> {"result", "vector", "expires_at"}
+        self._entries: OrderedDict[tuple, dict] = OrderedDict()
+        self._lock = Lock()
+
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(
+        query: str,
+        collection_name: str,
+        documents_limit: int,
+        embedding_model_name: Union[str, None],
+        chunk_overlap: Union[int, None],
+        token_budget: Union[int, None] = None,
+    ) -> tuple:
+        """
+        Return the exact key of a search. Its first element is the normalized query, the rest
+        are the parameters that a similar query must share
+
+        Args:
+            query: str -> User's query
+            collection_name: str -> Name of the vector DB collection
+            documents_limit: int -> Limit of documents retrieved by the search
+            embedding_model_name: Union[str, None] -> Name of the embedding model
+            chunk_overlap: Union[int, None] -> Number of tokens to overlap the chunks
+            token_budget: Union[int, None] -> Maximum number of tokens of the context retrieved
+
+        Return:
+            tuple -> Key of the search
+        """
+        return (
+            normalize_query(query),
+            collection_name,
+            documents_limit,
+            embedding_model_name,
+            chunk_overlap,
+            token_budget,
+        )
+
+    def _live_entry(self, key: tuple, now: float) -> Union[dict, None]:
+        # Must be called with the lock acquired
+        entry = self._entries.get(key)
+
+        if entry is not None and entry["expires_at"] <= now:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+
+        return entry
+
+    def get(self, key: tuple) -> Any:
+        """
+        Return the results of a search with the same key, without counting a miss, as the
+        similar level may still find them
+
+        Args:
+            key: tuple -> Key returned by QueryCache.key
+
+        Return:
+            Any -> Cached results, None if they are not in the cache
+        """
+        with self._lock:
+            entry = self._live_entry(key, time.monotonic())
+
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+
+            return entry["result"]
+
+    def get_similar(self, key: tuple, vector: np.ndarray) -> Any:
+        """
+        Return the results of the most similar cached query with the same search parameters,
+        if its similarity reaches the threshold. The query is also cached under its exact key
+
+        Args:
+            key: tuple -> Key returned by QueryCache.key
+            vector: np.ndarray -> Unit vector of the query, returned by query_vector
+
+        Return:
+            Any -> Cached results, None if there is no similar query
+        """
+        with self._lock:
+            if self.similarity_threshold is None:
+                self.misses += 1
+                return None
+
+            now = time.monotonic()
+            candidates = list()
+
+            # Only the queries with the same collection, limit, model, overlap and budget
+            for candidate_key in list(self._entries.keys()):
+                if candidate_key[1:] != key[1:]:
+                    continue
+
+                entry = self._live_entry(candidate_key, now)
+
+                if entry is not None:
+                    candidates.append((candidate_key, entry))
+
+            if len(candidates) == 0:
+                self.misses += 1
+                return None
+
+            similarities = (
+                np.stack([entry["vector"] for _, entry in candidates]) @ vector
+            )
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            best_key, best_entry = candidates[best]
+            self._entries.move_to_end(best_key)
+            self.similar_hits += 1
+
+            logger.info(
+                f"Reusing the results of a similar query (similarity {similarities[best]:.3f})"
+            )
+
+            self._store(key, vector, best_entry["result"], best_entry["expires_at"])
+
+            return best_entry["result"]
+
+    def _store(self, key: tuple, vector: np.ndarray, result: Any, expires_at: float):
+        # Must be called with the lock acquired
+        self._entries[key] = {
+            "result": result,
+            "vector": vector,
+            "expires_at": expires_at,
+        }
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key: tuple, vector: np.ndarray, result: Any) -> None:
+        """
+        Cache the results of a search
+
+        Args:
+            key: tuple -> Key returned by QueryCache.key
+            vector: np.ndarray -> Unit vector of the query, returned by query_vector
+            result: Any -> Results of the search
+
+        Return:
+            None
+        """
+        with self._lock:
+            self._store(key, vector, result, time.monotonic() + self.ttl_seconds)
+
+    def invalidate(self, collection_name: Union[str, None] = None) -> int:
+        """
+        Remove the cached results of a collection, ex. after some of its documents were ingested again
+
+        Args:
+            collection_name: Union[str, None] -> Name of the collection, None to remove all the entries
+
+        Return:
+            int -> Number of entries removed
+        """
+        with self._lock:
+            keys = [
+                key
+                for key in self._entries.keys()
+                if collection_name is None or key[1] == collection_name
+            ]
+
+            for key in keys:
+                del self._entries[key]
+
+            self.invalidations += len(keys)
+
+        if len(keys) > 0:
+            logger.info(
+                f"{len(keys)} cached searches removed"
+                + (f" from the collection {collection_name}" if collection_name else "")
+            )
+
+        return len(keys)
+
+    def stats(self) -> dict:
+        """
+        Return the metrics of the cache
+
+        Return:
+            dict -> Number of entries, hits of each level, misses, hit rate, and entries evicted,
+                    expired and invalidated
+        """
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            hits = self.exact_hits + self.similar_hits
+
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups > 0 else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+@lazy_singleton
+def get_query_cache() -> QueryCache:
+    # Cache shared by the sync and the async searches of the process
+    return QueryCache(
+        max_entries=qdrant_config.QUERY_CACHE_MAX_ENTRIES,
+        ttl_seconds=qdrant_config.QUERY_CACHE_TTL_SECONDS,
+        similarity_threshold=qdrant_config.QUERY_CACHE_SIMILARITY_THRESHOLD
+        if qdrant_config.QUERY_CACHE_SIMILARITY_ENABLED
+        else None,
+    )
+
+
+# The searches of a collection are outdated when its points are upserted or deleted
+collection_update_callbacks.append(
+    lambda collection_name: get_query_cache().invalidate(collection_name)
+)
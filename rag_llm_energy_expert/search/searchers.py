@@ -1,20 +1,72 @@
-from qdrant_client import QdrantClient
-
+from loguru import logger
+from typing import Any, Union
 import sys
 
 sys.path.append("../../../..")
 
+from rag_llm_energy_expert.config import QdrantConfig
+from rag_llm_energy_expert.search.query_cache import (
+    QueryCache,
+    get_query_cache,
+    query_vector,
+)
 from rag_llm_energy_expert.search.searchers_auxiliars import (
+    async_process_query,
     process_query,
     process_query_results,
 )
-from rag_llm_energy_expert.credentials import get_qdrant_config
+from rag_llm_energy_expert.utils.vector_db.qdrant import (
+    get_async_client as get_async_qdrant_client,
+    get_client as get_qdrant_client,
+)
 
-qdrant_config = get_qdrant_config()
+qdrant_config = QdrantConfig()
 
-qdrant_client = QdrantClient(
-    url=qdrant_config.URL, api_key=qdrant_config.API_KEY.get_secret_value()
-)
+
+def cached_search(
+    query: str,
+    embedding_model_name: str,
+    chunk_overlap: int,
+    collection_name: str,
+    documents_limit: int,
+    token_budget: Union[int, None],
+    use_cache: bool,
+) -> tuple[Union[QueryCache, None], Union[tuple, None], Any]:
+    """
+    Look for the results of the search in the exact level of the query cache
+
+    Args:
+        query: str -> User's query
+        embedding_model_name: str -> Name of the embedding model
+        chunk_overlap: int -> Number of tokens to overlap the chunks
+        collection_name: str -> Name of the vector DB collection
+        documents_limit: int -> Limit of documents retrieved by the search
+        token_budget: Union[int, None] -> Maximum number of tokens of the context retrieved
+        use_cache: bool -> If False, the cache is not used
+
+    Return:
+        tuple[Union[QueryCache, None], Union[tuple, None], Any] -> The cache, the key of the search
+                                                                   and the cached results, None when
+                                                                   the cache is not used or missed
+    """
+    if not use_cache or not isinstance(query, str):
+        return None, None, None
+
+    cache = get_query_cache()
+    key = cache.key(
+        query,
+        collection_name,
+        documents_limit,
+        embedding_model_name,
+        chunk_overlap,
+        token_budget,
+    )
+    cached_results = cache.get(key)
+
+    if cached_results is not None:
+        logger.info("Search results retrieved from the cache")
+
+    return cache, key, cached_results
 
 
 def semantic_search(
@@ -23,7 +75,9 @@ def semantic_search(
     chunk_overlap: int,
     collection_name: str,
     documents_limit: int,
-):
+    token_budget: Union[int, None] = qdrant_config.CONTEXT_TOKEN_BUDGET,
+    use_cache: bool = qdrant_config.QUERY_CACHE_ENABLED,
+) -> str:
     """
     Generate the necessary steps to do the semantic search of the user's query, and retrieve the
     documents with the most relevant information.
@@ -35,10 +89,26 @@ def semantic_search(
                                      embedding model that the documents were embedded in the vector DB
         chunk_overlap: Union[int, None] -> Number of tokens to overlap the chunks
         collection_name: str -> Name of the vector DB collection where the documents will be retrieved
+        token_budget: Union[int, None] -> Maximum number of tokens of the text retrieved, the chunks with
+                                          the highest scores are kept. None for no limit
+        use_cache: bool -> Reuse the results of the same or a similar query, see QueryCache
 
     Return:
         str -> All the document's text
     """
+    cache, key, cached_results = cached_search(
+        query,
+        embedding_model_name,
+        chunk_overlap,
+        collection_name,
+        documents_limit,
+        token_budget,
+        use_cache,
+    )
+
+    if cached_results is not None:
+        return cached_results
+
     # Get a list of vector queries
     # Already has error handlers
     search_queries = process_query(
@@ -48,14 +118,96 @@ def semantic_search(
         documents_limit=documents_limit,
     )
 
+    if cache is not None:
+        vector = query_vector(search_queries)
+        cached_results = cache.get_similar(key, vector)
+
+        if cached_results is not None:
+            return cached_results
+
     # Do semantic search
-    results = qdrant_client.query_batch_points(
+    results = get_qdrant_client().query_batch_points(
         collection_name=collection_name,
         requests=search_queries,
     )
 
     # Get a list of results from the query batch
     # Already has error handlers
-    data_retrieved = process_query_results(results=results)
+    data_retrieved = process_query_results(results=results, token_budget=token_budget)
+
+    if cache is not None:
+        cache.put(key, vector, data_retrieved)
+
+    return data_retrieved
+
+
+async def async_semantic_search(
+    query: str,
+    embedding_model_name: str,
+    chunk_overlap: int,
+    collection_name: str,
+    documents_limit: int,
+    token_budget: Union[int, None] = qdrant_config.CONTEXT_TOKEN_BUDGET,
+    use_cache: bool = qdrant_config.QUERY_CACHE_ENABLED,
+) -> str:
+    """
+    Asynchronous version of semantic_search. The embedding request and the vector search are
+    awaited, so a single event loop can serve the searches of many users at the same time
+
+    Args:
+        query: str -> User's query
+        documents_limit: Union[int, None] -> Limit of documents retrieved by the search
+        embedding_model_name: Union[str, None] -> Name of the embedding model to generate the embeddings. Must match with the
+                                     embedding model that the documents were embedded in the vector DB
+        chunk_overlap: Union[int, None] -> Number of tokens to overlap the chunks
+        collection_name: str -> Name of the vector DB collection where the documents will be retrieved
+        token_budget: Union[int, None] -> Maximum number of tokens of the text retrieved, the chunks with
+                                          the highest scores are kept. None for no limit
+        use_cache: bool -> Reuse the results of the same or a similar query, see QueryCache
+
+    Return:
+        str -> All the document's text
+    """
+    # The cache is shared with the sync searches, its lookups don't do any I/O
+    cache, key, cached_results = cached_search(
+        query,
+        embedding_model_name,
+        chunk_overlap,
+        collection_name,
+        documents_limit,
+        token_budget,
+        use_cache,
+    )
+
+    if cached_results is not None:
+        return cached_results
+
+    # Get a list of vector queries
+    # Already has error handlers
+    search_queries = await async_process_query(
+        query=query,
+        embedding_model_name=embedding_model_name,
+        chunk_overlap=chunk_overlap,
+        documents_limit=documents_limit,
+    )
+
+    if cache is not None:
+        vector = query_vector(search_queries)
+        cached_results = cache.get_similar(key, vector)
+
+        if cached_results is not None:
+            return cached_results
+
+    # Do semantic search
+    results = await get_async_qdrant_client().query_batch_points(
+        collection_name=collection_name,
+        requests=search_queries,
+    )
+
+    # Processing the results doesn't do any I/O
+    data_retrieved = process_query_results(results=results, token_budget=token_budget)
+
+    if cache is not None:
+        cache.put(key, vector, data_retrieved)
 
     return data_retrieved
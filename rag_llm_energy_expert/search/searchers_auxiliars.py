@@ -1,41 +1,46 @@
 from loguru import logger
 from qdrant_client import models
 from typing import Union
-import requests
-
+import httpx
 import sys
 
 sys.path.append("../../../..")
 
+from rag_llm_energy_expert.config import QdrantConfig
 from rag_llm_energy_expert.credentials import get_gcp_config
+from rag_llm_energy_expert.search.context_builder import build_context
+from rag_llm_energy_expert.utils.embedding_service.client import (
+    get_async_embedding_service_client,
+    get_embedding_service_client,
+)
+from rag_llm_energy_expert.utils.embedding_service.vector_encoding import (
+    decode_vectors,
+)
 
 
 gcp_config = get_gcp_config()
+qdrant_config = QdrantConfig()
 
 
-def process_query(
+def query_payload(
     query: str,
-    documents_limit: int,
     embedding_model_name: Union[str, None],
     chunk_overlap: Union[int, None],
-) -> list[models.QueryRequest]:
+    documents_limit: int,
+) -> dict:
     """
-    Process the user's query before making a search on the vector DB.
-    In case the query is too long, it splits the text and for each chunk generated, return
-    a models.QueryRequest object.
+    Validate the parameters of the search and create the body of the request to the query
+    endpoint of the embedding service
 
     Args:
         query: str -> User's query
-        documents_limit: Union[int, None] -> Limit of documents retrieved by the search
-        embedding_model_name: Union[str, None] -> Name of the embedding model to generate the embeddings. Must match with the
-                                     embedding model that the documents were embedded in the vector DB
+        embedding_model_name: Union[str, None] -> Name of the embedding model to generate the embeddings
         chunk_overlap: Union[int, None] -> Number of tokens to overlap the chunks
+        documents_limit: int -> Limit of documents retrieved by the search
 
     Return:
-        search_queries: list[models.QueryRequest] -> List of QueryRequests ready for vector search
+        dict -> Body of the request to the embedding service
     """
-    logger.info("Preprocessing query...")
-
     # Error handlers for query
     if not isinstance(query, str) or query == "":
         raise ValueError("The parameter 'query' must be a non empty string")
@@ -55,29 +60,28 @@ def process_query(
     elif isinstance(chunk_overlap, int) and chunk_overlap < 0:
         raise ValueError("'chunk_overlap' must be greater or equal than 1")
 
-    # Use the embedding service deployed on CloudRun to generate the embeddings
-    payload = {
-        "text": query,
+    # Use the query endpoint of the embedding service deployed on CloudRun, it skips the
+    # markdown chunking and only splits the query if it exceeds the model max_seq_length
+    return {
+        "query": query,
         "embedding_model_name": embedding_model_name,
         "chunk_overlap": chunk_overlap,
     }
 
-    # Generating the token to authenticate the request to the embedding service
-    token = gcp_config.EMBEDDING_SERVICE_IDTOKEN.get_secret_value()
-    headers = {"Authorization": f"Bearer {token}"}
 
-    full_text_embedding_url = (
-        gcp_config.EMBEDDING_SERVICE_URL + gcp_config.EMBED_TEXT_ENDPOINT
-    )
+def query_requests(
+    response: httpx.Response, documents_limit: int
+) -> list[models.QueryRequest]:
+    """
+    Create a QueryRequest for each vector returned by the query endpoint of the embedding service
 
-    try:
-        logger.info("Generating embeddings...")
-        response = requests.post(
-            url=full_text_embedding_url, json=payload, headers=headers
-        )
-    except Exception as e:
-        raise ValueError(f"There was an error using the embedding service: {e}")
+    Args:
+        response: httpx.Response -> Response of the embedding service
+        documents_limit: int -> Limit of documents retrieved by each QueryRequest
 
+    Return:
+        list[models.QueryRequest] -> List of QueryRequests ready for vector search
+    """
     if response.status_code != 200:
         raise ValueError(
             f"Bad request to the embedding service: Status code: {response.status_code}. "
@@ -85,17 +89,17 @@ def process_query(
         )
 
     logger.info("Embeddings generated successfully")
-    # Get the list of chunks generated
-    embeddings = response.json()["chunks"]
-
-    # For each chunk generated, get its vector
-    vectors = [chunk["vector"] for chunk in embeddings]
+    # Get the list of vectors generated, one per window of the query
+    response_data = response.json()
+    vectors = decode_vectors(
+        response_data["vectors"], response_data.get("vector_encoding", "float")
+    )
 
     # Prepare the vectors obtained to be used in the vector DB
     logger.info("Preparing embeddings for vector search")
     search_queries = [
         models.QueryRequest(
-            query=vector,
+            query=vector.tolist(),
             with_payload=True,
             with_vector=False,
             limit=documents_limit,
@@ -107,26 +111,154 @@ def process_query(
     return search_queries
 
 
-def process_query_results(results: list[models.models.QueryResponse]) -> str:
+def process_query(
+    query: str,
+    documents_limit: int,
+    embedding_model_name: Union[str, None],
+    chunk_overlap: Union[int, None],
+) -> list[models.QueryRequest]:
+    """
+    Process the user's query before making a search on the vector DB.
+    In case the query is too long, it splits the text and for each chunk generated, return
+    a models.QueryRequest object.
+
+    Args:
+        query: str -> User's query
+        documents_limit: Union[int, None] -> Limit of documents retrieved by the search
+        embedding_model_name: Union[str, None] -> Name of the embedding model to generate the embeddings. Must match with the
+                                     embedding model that the documents were embedded in the vector DB
+        chunk_overlap: Union[int, None] -> Number of tokens to overlap the chunks
+
+    Return:
+        search_queries: list[models.QueryRequest] -> List of QueryRequests ready for vector search
+    """
+    logger.info("Preprocessing query...")
+
+    payload = query_payload(query, embedding_model_name, chunk_overlap, documents_limit)
+
+    # The shared client reuses the connection of the previous queries, and retries the
+    # responses of Cloud Run while a new instance starts
+    try:
+        logger.info("Generating embeddings...")
+        response = get_embedding_service_client().post(
+            gcp_config.EMBED_QUERY_ENDPOINT, payload
+        )
+    except Exception as e:
+        raise ValueError(f"There was an error using the embedding service: {e}")
+
+    return query_requests(response, documents_limit)
+
+
+async def async_process_query(
+    query: str,
+    documents_limit: int,
+    embedding_model_name: Union[str, None],
+    chunk_overlap: Union[int, None],
+) -> list[models.QueryRequest]:
     """
-    Return the query responses for each QueryRequest generated
+    Asynchronous version of process_query: the event loop serves other queries while the
+    embeddings are generated
+
+    Args:
+        query: str -> User's query
+        documents_limit: Union[int, None] -> Limit of documents retrieved by the search
+        embedding_model_name: Union[str, None] -> Name of the embedding model to generate the embeddings. Must match with the
+                                     embedding model that the documents were embedded in the vector DB
+        chunk_overlap: Union[int, None] -> Number of tokens to overlap the chunks
+
+    Return:
+        search_queries: list[models.QueryRequest] -> List of QueryRequests ready for vector search
+    """
+    logger.info("Preprocessing query...")
+
+    payload = query_payload(query, embedding_model_name, chunk_overlap, documents_limit)
+
+    try:
+        logger.info("Generating embeddings...")
+        response = await get_async_embedding_service_client().post(
+            gcp_config.EMBED_QUERY_ENDPOINT, payload
+        )
+    except Exception as e:
+        raise ValueError(f"There was an error using the embedding service: {e}")
+
+    return query_requests(response, documents_limit)
+
+
+def fuse_query_results(
+    results: list[models.models.QueryResponse],
+    fusion: str = qdrant_config.RESULTS_FUSION,
+    rrf_k: int = qdrant_config.RRF_K,
+) -> list[models.ScoredPoint]:
+    """
+    Merge the responses of the QueryRequests of a query. A point retrieved by several windows
+    of the query is kept once, with its scores merged
+
+    Args:
+        results: list[models.models.QueryResponse] -> List of QueryResponses obtained after the semantic search
+        fusion: str -> "rrf" to sum 1 / (rrf_k + rank) of each response where the point appears, so the
+                       points retrieved by several windows go first, or "max" to keep its highest score
+        rrf_k: int -> Constant of the reciprocal rank fusion, a larger value gives less weight to the rank
+
+    Return:
+        list[models.ScoredPoint] -> Unique points sorted by their merged score, which replaces their score
+    """
+    if fusion not in ("rrf", "max"):
+        raise ValueError("fusion must be one of: 'rrf', 'max'")
+
+    if not isinstance(rrf_k, int) or rrf_k < 0:
+        raise ValueError("rrf_k must be an integer greater or equal than 0")
+
+    points = dict()
+    scores = dict()
+
+    for query_response in results:
+        for rank, point in enumerate(query_response.points, start=1):
+            point_id = str(point.id)
+            points.setdefault(point_id, point)
+
+            if fusion == "rrf":
+                scores[point_id] = scores.get(point_id, 0.0) + 1 / (rrf_k + rank)
+            else:
+                scores[point_id] = max(scores.get(point_id, point.score), point.score)
+
+    # The first occurrence of each point is kept, sorted() is stable for equal scores
+    return [
+        points[point_id].model_copy(update={"score": scores[point_id]})
+        for point_id in sorted(points, key=lambda point_id: -scores[point_id])
+    ]
+
+
+def process_query_results(
+    results: list[models.models.QueryResponse],
+    fusion: str = qdrant_config.RESULTS_FUSION,
+    token_budget: Union[int, None] = qdrant_config.CONTEXT_TOKEN_BUDGET,
+    with_sources: bool = True,
+) -> str:
+    """
+    Return the context for the LLM with the points retrieved by the QueryRequests of a query,
+    without duplicates, from the most to the least relevant, and within a budget of tokens
 
     Args:
         results: list[models.models.QueryResponse] -> List of QueryResponses obtained after the semantic search
+        fusion: str -> How the scores of a point retrieved several times are merged, see fuse_query_results
+        token_budget: Union[int, None] -> Maximum number of tokens of the context, see build_context.
+                                          None for no limit
+        with_sources: bool -> If True, each chunk starts with the title of its document
 
     Returns:
         str -> String with all the text of the documents retrieved
     """
     logger.info("Processing query results...")
-    full_text = ""
 
-    for query_response in results:
-        # Get a list of points for each QueryResponse
-        query_response_points = query_response.points
+    points = fuse_query_results(results, fusion=fusion)
+    retrieved = sum(len(query_response.points) for query_response in results)
 
-        # Extract the text of each point
-        for point in query_response_points:
-            full_text += point.payload["text"] + "\n\n"
+    context = build_context(
+        points, token_budget=token_budget, with_sources=with_sources
+    )
 
-    logger.info("Query results processed")
-    return full_text
+    logger.info(
+        f"Query results processed: {context['chunks']} of {len(points)} unique points "
+        f"({retrieved} retrieved), ~{context['tokens']} tokens"
+    )
+    return context["text"]
@@ -1,42 +1,305 @@
-from fastapi import FastAPI, HTTPException
-from models import EmbeddingRequest, EmbeddingResponse, Chunk, Payload
+from fastapi import FastAPI, HTTPException, Header, Response
+from fastapi.responses import StreamingResponse
+from models import (
+    EmbeddingRequest,
+    EmbeddingResponse,
+    Chunk,
+    Payload,
+    QueryEmbeddingRequest,
+    QueryEmbeddingResponse,
+    BatchQueryEmbeddingRequest,
+    BatchQueryEmbeddingResponse,
+)
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Iterator, Union
 from loguru import logger
+import json
+import time
 
 import sys
 
 sys.path.append("..")
 
-from embedding_pipeline import text_embedder
+from config import EmbeddingsConfig
+from embedding_pipeline import (
+    text_embedder,
+    text_embedder_stream,
+    query_embedder,
+    micro_batcher,
+)
+from embedding_cache import embedding_cache
+from model_registry import embedding_version, model_registry
+from splitter_cache import splitter_cache
+from vector_encoding import negotiate_vector_encoding, encode_vectors
+from worker_pool import WorkerPool, PoolOverloadedError, PoolTimeoutError
 
-app = FastAPI()
+embeddings_config = EmbeddingsConfig()
 
+worker_pool = WorkerPool(
+    max_workers=embeddings_config.WORKER_POOL_SIZE,
+    max_queued=embeddings_config.MAX_QUEUED_REQUESTS,
+    queue_timeout_seconds=embeddings_config.QUEUE_TIMEOUT_SECONDS,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the models before receiving requests, so no request pays the loading time
+    for embedding_model_name in embeddings_config.PRELOAD_MODELS:
+        model_registry.get(embedding_model_name)
+
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def run_in_pool(
+    func: Callable, timings: dict[str, float], **kwargs
+) -> tuple[Any, str]:
+    """
+    Run func in the worker pool, converting the pool and func errors into HTTP errors
+
+    Args:
+        func: Callable -> Function to run in the worker pool
+        timings: dict[str, float] -> Dictionary where func stores the seconds spent on each stage.
+                                    The time waiting for a worker is stored as 'queue'
+        **kwargs -> Arguments of func
+
+    Return:
+        tuple[Any, str] -> Value returned by func and the value of the Server-Timing header
+    """
+    request_start = time.perf_counter()
+
+    def timed_func():
+        timings["queue"] = time.perf_counter() - request_start
+        return func(timings=timings, **kwargs)
 
-@app.post("/embed-text", response_model=EmbeddingResponse)
-def generate_embeddings(request: EmbeddingRequest):
     try:
-        raw_chunks = text_embedder(
-            text=request.text,
-            chunk_overlap=request.chunk_overlap,
-            embedding_model_name=request.embedding_model_name,
-            metadata=request.metadata,
+        result = await worker_pool.run(timed_func)
+
+    except PoolOverloadedError as e:
+        logger.warning(e)
+        raise HTTPException(
+            status_code=429, detail=str(e), headers={"Retry-After": "1"}
         )
 
-        list_of_chunks = [
-            Chunk(
-                vector_id=chunk["id"],
-                vector=chunk["vector"],
-                payload=Payload(
-                    text=chunk["payload"]["text"],
-                    metadata=chunk["payload"]["metadata"],
-                ),
-            )
-            for chunk in raw_chunks
-        ]
+    except PoolTimeoutError as e:
+        logger.warning(e)
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "1"}
+        )
 
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=500, detail=str(e))
 
-    response = EmbeddingResponse(chunks=list_of_chunks)
+    timings["total"] = time.perf_counter() - request_start
+
+    server_timing = ", ".join(
+        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+    )
+    logger.info(f"{func.__name__} timings: {server_timing}")
+
+    return result, server_timing
+
+
+def build_embedding_response(
+    request: EmbeddingRequest, vector_encoding: str, timings: dict[str, float]
+) -> EmbeddingResponse:
+    raw_chunks = text_embedder(
+        text=request.text,
+        chunk_overlap=request.chunk_overlap,
+        embedding_model_name=request.embedding_model_name,
+        metadata=request.metadata,
+        timings=timings,
+    )
+    version = embedding_version(request.embedding_model_name)
+
+    list_of_chunks = [
+        Chunk(
+            vector_id=chunk["id"],
+            vector=vector,
+            payload=Payload(
+                text=chunk["payload"]["text"],
+                metadata=chunk["payload"]["metadata"],
+            ),
+            embedding_version=version,
+        )
+        for chunk, vector in zip(
+            raw_chunks,
+            encode_vectors([chunk["vector"] for chunk in raw_chunks], vector_encoding),
+        )
+    ]
+
+    return EmbeddingResponse(chunks=list_of_chunks, vector_encoding=vector_encoding)
+
+
+def build_query_embedding_response(
+    queries: list[str],
+    request: Union[QueryEmbeddingRequest, BatchQueryEmbeddingRequest],
+    vector_encoding: str,
+    timings: dict[str, float],
+) -> list[list[Union[list[float], str]]]:
+    vectors = query_embedder(
+        queries=queries,
+        chunk_overlap=request.chunk_overlap,
+        embedding_model_name=request.embedding_model_name,
+        truncate=request.truncate,
+        timings=timings,
+    )
+
+    return [encode_vectors(query_vectors, vector_encoding) for query_vectors in vectors]
+
+
+def next_stream_lines(
+    chunks_batches: Iterator[list[dict]], vector_encoding: str, version: str
+) -> Union[str, None]:
+    # Embed the next batch of chunks, returns None when there are no more chunks
+    raw_chunks = next(chunks_batches, None)
+
+    if raw_chunks is None:
+        return None
+
+    vectors = encode_vectors([chunk["vector"] for chunk in raw_chunks], vector_encoding)
+
+    lines = [
+        Chunk(
+            vector_id=chunk["id"],
+            vector=vector,
+            payload=Payload(
+                text=chunk["payload"]["text"],
+                metadata=chunk["payload"]["metadata"],
+            ),
+            embedding_version=version,
+        ).model_dump_json()
+        + "\n"
+        for chunk, vector in zip(raw_chunks, vectors)
+    ]
+
+    return "".join(lines)
+
+
+@app.post("/embed-text", response_model=EmbeddingResponse)
+async def generate_embeddings(
+    request: EmbeddingRequest,
+    response: Response,
+    accept: Union[str, None] = Header(default=None),
+):
+    embedding_response, server_timing = await run_in_pool(
+        build_embedding_response,
+        timings=dict(),
+        request=request,
+        vector_encoding=negotiate_vector_encoding(accept),
+    )
+
+    response.headers["Server-Timing"] = server_timing
+
+    return embedding_response
+
+
+@app.post("/embed-text/stream")
+async def generate_embeddings_stream(
+    request: EmbeddingRequest, accept: Union[str, None] = Header(default=None)
+):
+    """
+    Same as /embed-text, but the chunks are returned as NDJSON (one Chunk per line) while
+    they are embedded. If an error happens after the stream started, the last line is
+    {"error": "error message"}.
+    """
+    vector_encoding = negotiate_vector_encoding(accept)
+
+    # The stream is admitted once, its batches only wait for a free worker
+    try:
+        worker_pool.check_capacity()
+    except PoolOverloadedError as e:
+        logger.warning(e)
+        raise HTTPException(
+            status_code=429, detail=str(e), headers={"Retry-After": "1"}
+        )
+
+    chunks_batches = text_embedder_stream(
+        text=request.text,
+        chunk_overlap=request.chunk_overlap,
+        embedding_model_name=request.embedding_model_name,
+        metadata=request.metadata,
+    )
+
+    version = embedding_version(request.embedding_model_name)
+
+    async def stream_chunks() -> AsyncIterator[str]:
+        try:
+            while True:
+                lines = await worker_pool.execute(
+                    next_stream_lines, chunks_batches, vector_encoding, version
+                )
+
+                if lines is None:
+                    break
+
+                yield lines
+
+        except Exception as e:
+            logger.error(e)
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(
+        stream_chunks(),
+        media_type="application/x-ndjson",
+        headers={"X-Vector-Encoding": vector_encoding},
+    )
+
+
+@app.post("/embed-query", response_model=QueryEmbeddingResponse)
+async def generate_query_embeddings(
+    request: QueryEmbeddingRequest,
+    response: Response,
+    accept: Union[str, None] = Header(default=None),
+):
+    vector_encoding = negotiate_vector_encoding(accept)
+
+    vectors, server_timing = await run_in_pool(
+        build_query_embedding_response,
+        timings=dict(),
+        queries=[request.query],
+        request=request,
+        vector_encoding=vector_encoding,
+    )
+
+    response.headers["Server-Timing"] = server_timing
+
+    return QueryEmbeddingResponse(vectors=vectors[0], vector_encoding=vector_encoding)
+
+
+@app.post("/embed-queries", response_model=BatchQueryEmbeddingResponse)
+async def generate_batch_query_embeddings(
+    request: BatchQueryEmbeddingRequest,
+    response: Response,
+    accept: Union[str, None] = Header(default=None),
+):
+    vector_encoding = negotiate_vector_encoding(accept)
+
+    vectors, server_timing = await run_in_pool(
+        build_query_embedding_response,
+        timings=dict(),
+        queries=request.queries,
+        request=request,
+        vector_encoding=vector_encoding,
+    )
+
+    response.headers["Server-Timing"] = server_timing
+
+    return BatchQueryEmbeddingResponse(vectors=vectors, vector_encoding=vector_encoding)
+
 
-    return response
+@app.get("/stats")
+async def get_stats():
+    return {
+        "worker_pool": worker_pool.stats(),
+        "model_registry": model_registry.stats(),
+        "splitter_cache": splitter_cache.stats(),
+        "micro_batcher": micro_batcher.stats(),
+        "embedding_cache": (
+            embedding_cache.stats() if embedding_cache is not None else None
+        ),
+    }
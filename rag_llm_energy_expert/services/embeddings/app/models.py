@@ -21,16 +21,18 @@ class Chunk(BaseModel):
     vector_id: str = Field(
         description="uuid string representing the id of the vector created."
     )
-    vector: list[float] = Field(
-        description="vector representing the text of the chunk."
+    vector: Union[list[float], str] = Field(
+        description="vector representing the text of the chunk. A base64 string of the packed vector when"
+        " the request accepts the application/x-embeddings+json media type."
     )
     payload: Payload
+    embedding_version: Optional[Union[str, None]] = Field(
+        default=None,
+        description="Model and backend that generated the vector. Ex: 'sentence-transformers/LaBSE:onnx-int8'.",
+    )
 
 
-class EmbeddingRequest(BaseModel):
-    text: str = Field(
-        description="String with the whole text to be embedded", min_length=1
-    )
+class EmbeddingParameters(BaseModel):
     embedding_model_name: Optional[Union[str, None]] = Field(
         default=embeddings_config.EMBEDDING_MODEL,
         min_length=1,
@@ -39,10 +41,6 @@ class EmbeddingRequest(BaseModel):
     chunk_overlap: Optional[Union[int, None]] = Field(
         default=embeddings_config.CHUNK_OVERLAP, ge=0
     )
-    metadata: Optional[Union[dict[str, str], None]] = Field(
-        default=None,
-        description="Data associated to the text. Ex: {'title':'title_name', 'date':'9999-12-23'}.",
-    )
 
     @field_validator("embedding_model_name", mode="after")
     @classmethod
@@ -59,5 +57,55 @@ class EmbeddingRequest(BaseModel):
         return value
 
 
+class EmbeddingRequest(EmbeddingParameters):
+    text: str = Field(
+        description="String with the whole text to be embedded", min_length=1
+    )
+    metadata: Optional[Union[dict[str, str], None]] = Field(
+        default=None,
+        description="Data associated to the text. Ex: {'title':'title_name', 'date':'9999-12-23'}.",
+    )
+
+
+class QueryEmbeddingRequest(EmbeddingParameters):
+    query: str = Field(description="Search query to be embedded", min_length=1)
+    truncate: bool = Field(
+        default=False,
+        description="If True, a query longer than the model max_seq_length is truncated instead of split in windows.",
+    )
+
+
+class BatchQueryEmbeddingRequest(EmbeddingParameters):
+    queries: list[str] = Field(
+        description="List of search queries to be embedded", min_length=1
+    )
+    truncate: bool = Field(
+        default=False,
+        description="If True, a query longer than the model max_seq_length is truncated instead of split in windows.",
+    )
+
+
+VECTOR_ENCODING_FIELD = Field(
+    default="float",
+    description="'float' when the vectors are lists of floats, or the dtype ('float32', 'float16')"
+    " of the little-endian base64 packed vectors.",
+)
+
+
 class EmbeddingResponse(BaseModel):
     chunks: list[Chunk]
+    vector_encoding: str = VECTOR_ENCODING_FIELD
+
+
+class QueryEmbeddingResponse(BaseModel):
+    vectors: list[Union[list[float], str]] = Field(
+        description="Vectors of the query, one per window when the query exceeds the model max_seq_length."
+    )
+    vector_encoding: str = VECTOR_ENCODING_FIELD
+
+
+class BatchQueryEmbeddingResponse(BaseModel):
+    vectors: list[list[Union[list[float], str]]] = Field(
+        description="For each query, in the same order as the request, the vectors of its windows."
+    )
+    vector_encoding: str = VECTOR_ENCODING_FIELD
@@ -0,0 +1,178 @@
+from sentence_transformers import SentenceTransformer
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from threading import Lock, Thread
+from typing import Callable
+from loguru import logger
+import numpy as np
+import queue
+import time
+
+
+@dataclass
+class PendingEncode:
+    embedding_model: SentenceTransformer
+    texts: list[str]
+    future: Future = field(default_factory=Future)
+
+
+class MicroBatcher:
+    """
+    Coalesce the texts of concurrent requests into a single encode call.
+
+    A worker thread waits for the first pending request, then keeps collecting requests
+    for up to window_ms or until max_batch_size texts are gathered. The texts of each
+    embedding model are encoded together and the vectors are sent back to each caller.
+    If the encode of a batch fails, each request is encoded on its own, so only the requests
+    that still fail get the error.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[SentenceTransformer, list[str]], np.ndarray],
+        window_ms: float,
+        max_batch_size: int,
+    ):
+        if not isinstance(window_ms, (int, float)) or window_ms < 0:
+            raise ValueError("window_ms must be a number greater or equal than 0")
+
+        if not isinstance(max_batch_size, int) or max_batch_size < 1:
+            raise ValueError(
+                "max_batch_size must be an integer greater or equal than 1"
+            )
+
+        self.encode_fn = encode_fn
+        self.window_seconds = window_ms / 1000
+        self.max_batch_size = max_batch_size
+
+        self._queue: queue.Queue[PendingEncode] = queue.Queue()
+        self._worker: Thread = None
+        self._lock = Lock()
+
+        self.requests = 0
+        self.batches = 0
+        self.encoded_texts = 0
+        self.max_observed_batch_size = 0
+        self.last_batch_size = 0
+
+    def encode(
+        self, embedding_model: SentenceTransformer, texts: list[str]
+    ) -> np.ndarray:
+        """
+        Encode texts, sharing the model call with the other requests received in the same window
+
+        Args:
+            embedding_model: SentenceTransformer -> Model used to encode the texts
+            texts: list[str] -> Texts to encode
+
+        Return:
+            np.ndarray -> Vectors of the texts, in the same order
+        """
+        if len(texts) == 0:
+            return self.encode_fn(embedding_model, texts)
+
+        self._start_worker()
+
+        pending = PendingEncode(embedding_model=embedding_model, texts=texts)
+        self._queue.put(pending)
+
+        return pending.future.result()
+
+    def stats(self) -> dict:
+        """
+        Return the metrics of the batcher
+
+        Return:
+            dict -> Queue depth, number of batches and sizes of the batches encoded
+        """
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "window_ms": self.window_seconds * 1000,
+                "max_batch_size": self.max_batch_size,
+                "requests": self.requests,
+                "batches": self.batches,
+                "encoded_texts": self.encoded_texts,
+                "mean_batch_size": (
+                    round(self.encoded_texts / self.batches, 2)
+                    if self.batches > 0
+                    else 0.0
+                ),
+                "max_observed_batch_size": self.max_observed_batch_size,
+                "last_batch_size": self.last_batch_size,
+            }
+
+    def _start_worker(self) -> None:
+        with self._lock:
+            if self._worker is None:
+                self._worker = Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            batch_size = len(batch[0].texts)
+            deadline = time.monotonic() + self.window_seconds
+
+            while batch_size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+                batch.append(pending)
+                batch_size += len(pending.texts)
+
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: list[PendingEncode]) -> None:
+        # Group the requests by model, each model is called only once
+        models_batches: dict[int, list[PendingEncode]] = dict()
+
+        for pending in batch:
+            models_batches.setdefault(id(pending.embedding_model), []).append(pending)
+
+        for model_batch in models_batches.values():
+            self._encode_model_batch(model_batch)
+
+    def _encode_model_batch(self, model_batch: list[PendingEncode]) -> None:
+        # Encode the requests of the same model with a single call and scatter the vectors back
+        texts = [text for pending in model_batch for text in pending.texts]
+
+        try:
+            vectors = self.encode_fn(model_batch[0].embedding_model, texts)
+        except Exception as e:
+            if len(model_batch) == 1:
+                logger.error(f"Error encoding a batch of {len(texts)} texts: {e}")
+                model_batch[0].future.set_exception(e)
+                return
+
+            # The texts of a single request (ex. a malformed one) must not fail the others,
+            # so each request is encoded on its own and only the ones that still fail get the error
+            logger.warning(
+                f"Error encoding a batch of {len(model_batch)} requests, "
+                f"encoding each request on its own: {e}"
+            )
+
+            for pending in model_batch:
+                self._encode_model_batch([pending])
+
+            return
+
+        # Scatter the vectors back to each request
+        position = 0
+        for pending in model_batch:
+            pending.future.set_result(vectors[position : position + len(pending.texts)])
+            position += len(pending.texts)
+
+        with self._lock:
+            self.requests += len(model_batch)
+            self.batches += 1
+            self.encoded_texts += len(texts)
+            self.last_batch_size = len(texts)
+            self.max_observed_batch_size = max(self.max_observed_batch_size, len(texts))
@@ -1,6 +1,52 @@
 from pydantic_settings import BaseSettings
+import os
 
 
 class EmbeddingsConfig(BaseSettings):
     CHUNK_OVERLAP: int = 100
     EMBEDDING_MODEL: str = "sentence-transformers/LaBSE"
+    # Models loaded when the service starts, so the first requests don't pay the loading time
+    PRELOAD_MODELS: list[str] = ["sentence-transformers/LaBSE"]
+    # Max number of different models resident in memory at the same time
+    MAX_LOADED_MODELS: int = 2
+    # Max memory (MB) used by the weights of the resident models
+    MAX_MODELS_MEMORY_MB: int = 3072
+    # Max number of tokenizers and text splitters cached by chunk_text
+    SPLITTER_CACHE_SIZE: int = 16
+    # Coalesce the texts of concurrent requests into a single encode call
+    MICRO_BATCHING_ENABLED: bool = True
+    # Max time (ms) a request waits for other requests to join its batch
+    MICRO_BATCHING_WINDOW_MS: float = 10
+    # Max number of texts gathered before encoding a batch
+    MICRO_BATCHING_MAX_BATCH_SIZE: int = 64
+    # Number of chunks embedded and sent at a time by the streaming endpoint
+    STREAM_BATCH_SIZE: int = 32
+    # Number of threads running the chunking, tokenization and encode of the requests
+    WORKER_POOL_SIZE: int = os.cpu_count() or 1
+    # Max number of requests waiting for a free worker, the next ones receive a 429 error
+    MAX_QUEUED_REQUESTS: int = 32
+    # Max seconds a request waits for a free worker before receiving a 503 error
+    QUEUE_TIMEOUT_SECONDS: float = 30
+    # Backend of the embedding cache: "memory" (LRU in the worker), "sqlite" (local file) or "none"
+    EMBEDDING_CACHE_BACKEND: str = "memory"
+    # Max number of vectors kept by the memory backend
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 20000
+    # Path of the database used by the sqlite backend
+    EMBEDDING_CACHE_PATH: str = "embedding_cache.sqlite3"
+    # Inference backend of each model: "torch", "onnx" or "onnx-int8" (ONNX Runtime with int8 dynamic
+    # quantization). The models that are not listed use "torch"
+    MODEL_BACKENDS: dict[str, str] = {}
+    # Directory where onnx_export.py saves the ONNX models, one subdirectory per model. A relative
+    # path is relative to the directory of the service, whatever the working directory is
+    ONNX_MODELS_DIR: str = "onnx_models"
+    # Instruction set targeted by the int8 quantization: "arm64", "avx2", "avx512" or "avx512_vnni"
+    ONNX_QUANTIZATION_CONFIG: str = "avx2"
+    # Min cosine similarity between the ONNX and PyTorch vectors accepted by onnx_export.py
+    ONNX_MIN_COSINE_SIMILARITY: float = 0.98
+    # Sort the texts of each encode call by number of tokens and encode them in batches of similar
+    # length, so short chunks are not padded to the length of the longest one
+    LENGTH_BUCKETING_ENABLED: bool = True
+    # Max number of tokens (number of texts x tokens of the longest text) of each forward pass
+    ENCODE_TOKEN_BUDGET: int = 8192
+    # Max number of texts of each forward pass
+    ENCODE_MAX_BATCH_SIZE: int = 128
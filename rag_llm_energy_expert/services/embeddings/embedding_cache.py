@@ -0,0 +1,298 @@
+from sentence_transformers import SentenceTransformer
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Union
+from loguru import logger
+import numpy as np
+import unicodedata
+import hashlib
+import sqlite3
+
+from config import EmbeddingsConfig
+
+embeddings_config = EmbeddingsConfig()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text before hashing it, so texts that only differ in whitespaces or in the
+    unicode representation of their characters share the same cache entry
+
+    Args:
+        text: str -> Text to normalize
+
+    Return:
+        str -> Normalized text
+    """
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+
+def text_hash(text: str) -> str:
+    """
+    Return the sha256 of the normalized text
+
+    Args:
+        text: str -> Text to hash
+
+    Return:
+        str -> Hex digest of the normalized text
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCacheBackend(ABC):
+    """
+    Storage of the embedding cache. The vectors are keyed by (embedding_model_name, text_hash).
+    New backends (ex. a store shared by several instances) must implement all these methods,
+    otherwise they can't be instantiated.
+    """
+
+    @abstractmethod
+    def get_many(
+        self, keys: list[tuple[str, str]]
+    ) -> dict[tuple[str, str], np.ndarray]:
+        pass
+
+    @abstractmethod
+    def set_many(self, items: dict[tuple[str, str], np.ndarray]) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+    @abstractmethod
+    def size(self) -> int:
+        pass
+
+
+class InMemoryEmbeddingCache(EmbeddingCacheBackend):
+    """
+    LRU cache stored in the memory of the worker
+    """
+
+    def __init__(self, max_entries: int):
+        if not isinstance(max_entries, int) or max_entries < 1:
+            raise ValueError("max_entries must be an integer greater or equal than 1")
+
+        self.max_entries = max_entries
+        self._vectors: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self._lock = Lock()
+
+    def get_many(
+        self, keys: list[tuple[str, str]]
+    ) -> dict[tuple[str, str], np.ndarray]:
+        found = dict()
+
+        with self._lock:
+            for key in keys:
+                vector = self._vectors.get(key)
+
+                if vector is not None:
+                    self._vectors.move_to_end(key)
+                    found[key] = vector
+
+        return found
+
+    def set_many(self, items: dict[tuple[str, str], np.ndarray]) -> None:
+        with self._lock:
+            for key, vector in items.items():
+                self._vectors[key] = vector
+                self._vectors.move_to_end(key)
+
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors.clear()
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._vectors)
+
+
+class SQLiteEmbeddingCache(EmbeddingCacheBackend):
+    """
+    Cache stored in a local SQLite file, so the vectors survive the restarts of the service
+    """
+
+    def __init__(self, path: str):
+        if not isinstance(path, str) or path == "":
+            raise ValueError("path must be a not null string")
+
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = Lock()
+
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                create table if not exists embeddings (
+                    embedding_model_name text not null,
+                    text_hash text not null,
+                    vector blob not null,
+                    primary key (embedding_model_name, text_hash)
+                )
+                """
+            )
+
+    def get_many(
+        self, keys: list[tuple[str, str]]
+    ) -> dict[tuple[str, str], np.ndarray]:
+        found = dict()
+
+        with self._lock:
+            for key in keys:
+                row = self._connection.execute(
+                    "select vector from embeddings where embedding_model_name = ? and text_hash = ?",
+                    key,
+                ).fetchone()
+
+                if row is not None:
+                    found[key] = np.frombuffer(row[0], dtype=np.float32)
+
+        return found
+
+    def set_many(self, items: dict[tuple[str, str], np.ndarray]) -> None:
+        rows = [
+            (model_name, hash_value, np.asarray(vector, dtype=np.float32).tobytes())
+            for (model_name, hash_value), vector in items.items()
+        ]
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "insert or replace into embeddings values (?, ?, ?)", rows
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("delete from embeddings")
+
+    def size(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "select count(*) from embeddings"
+            ).fetchone()[0]
+
+
+class EmbeddingCache:
+    """
+    Embed texts only once: the vectors are stored by (embedding_model_name, hash of the normalized text),
+    and only the texts that are not in the backend are sent to the model.
+    """
+
+    def __init__(self, backend: EmbeddingCacheBackend):
+        if not isinstance(backend, EmbeddingCacheBackend):
+            raise TypeError("backend must be an EmbeddingCacheBackend instance")
+
+        self.backend = backend
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def encode(
+        self,
+        embedding_model: SentenceTransformer,
+        embedding_model_name: str,
+        texts: list[str],
+        encode_fn: Callable[[SentenceTransformer, list[str]], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Get the vectors of the texts from the cache, encoding only the missing ones
+
+        Args:
+            embedding_model: SentenceTransformer -> Model used to encode the missing texts
+            embedding_model_name: str -> Name of the model, part of the cache key
+            texts: list[str] -> Texts to embed
+            encode_fn: Callable -> Function used to encode the missing texts
+
+        Return:
+            np.ndarray -> Matrix with one vector per text, in the same order as texts
+        """
+        if len(texts) == 0:
+            return encode_fn(embedding_model, texts)
+
+        keys = [(embedding_model_name, text_hash(text)) for text in texts]
+
+        vectors = self.backend.get_many(list(set(keys)))
+
+        # Texts repeated in the request are only encoded once
+        missing = dict()
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+
+        if len(missing) > 0:
+            missing_vectors = encode_fn(embedding_model, list(missing.values()))
+
+            # The rows are copied, a view would keep the whole matrix of the batch in memory
+            # while any of its vectors is cached
+            new_vectors = {
+                key: np.array(vector, copy=True)
+                for key, vector in zip(missing.keys(), missing_vectors)
+            }
+
+            self.backend.set_many(new_vectors)
+            vectors.update(new_vectors)
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        return np.stack([vectors[key] for key in keys])
+
+    def stats(self) -> dict:
+        """
+        Return the metrics of the cache
+
+        Return:
+            dict -> Backend, number of entries, hits, misses and hit rate
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+
+            return {
+                "backend": type(self.backend).__name__,
+                "entries": self.backend.size(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 4) if requests > 0 else 0.0,
+            }
+
+
+def create_embedding_cache(
+    backend_name: str = embeddings_config.EMBEDDING_CACHE_BACKEND,
+) -> Union[EmbeddingCache, None]:
+    """
+    Create the embedding cache configured for the service
+
+    Args:
+        backend_name: str -> "memory", "sqlite" or "none"
+
+    Return:
+        Union[EmbeddingCache, None] -> None if the cache is disabled
+    """
+    if backend_name == "none":
+        return None
+
+    if backend_name == "memory":
+        backend = InMemoryEmbeddingCache(
+            max_entries=embeddings_config.EMBEDDING_CACHE_MAX_ENTRIES
+        )
+    elif backend_name == "sqlite":
+        backend = SQLiteEmbeddingCache(path=embeddings_config.EMBEDDING_CACHE_PATH)
+    else:
+        raise ValueError(
+            "EMBEDDING_CACHE_BACKEND must be one of: 'memory', 'sqlite', 'none'"
+        )
+
+    logger.info(f"Embedding cache initialized with the {backend_name} backend")
+
+    return EmbeddingCache(backend=backend)
+
+
+embedding_cache = create_embedding_cache()
@@ -1,9 +1,171 @@
-from langchain_text_splitters import MarkdownHeaderTextSplitter, MarkdownTextSplitter
-from transformers import AutoTokenizer
 from sentence_transformers import SentenceTransformer
+import numpy as np
 import uuid
+import time
 from loguru import logger
-from typing import Union
+from typing import Iterator, Union
+
+from batcher import MicroBatcher
+from config import EmbeddingsConfig
+from embedding_cache import embedding_cache
+from model_registry import model_registry, get_model_backend
+from splitter_cache import splitter_cache
+
+embeddings_config = EmbeddingsConfig()
+
+
+def length_buckets(
+    lengths: list[int], token_budget: int, max_batch_size: int
+) -> list[list[int]]:
+    """
+    Group the positions of the texts in batches of similar number of tokens. The size of each
+    batch adapts to its longest text: short texts are encoded in big batches and long texts in
+    small ones, so every batch pads up to token_budget tokens at most.
+
+    Args:
+        lengths: list[int] -> Number of tokens of each text
+        token_budget: int -> Max number of texts x tokens of the longest text of a batch
+        max_batch_size: int -> Max number of texts of a batch
+
+    Return:
+        list[list[int]] -> Positions of the texts of each batch
+    """
+    buckets = list()
+    bucket = list()
+
+    # The texts are visited from the shortest to the longest, so the text being added is
+    # always the longest of its batch
+    for position in np.argsort(lengths, kind="stable").tolist():
+        if len(bucket) > 0 and (
+            len(bucket) >= max_batch_size
+            or (len(bucket) + 1) * lengths[position] > token_budget
+        ):
+            buckets.append(bucket)
+            bucket = list()
+
+        bucket.append(position)
+
+    if len(bucket) > 0:
+        buckets.append(bucket)
+
+    return buckets
+
+
+def encode_length_bucketed(
+    embedding_model: SentenceTransformer,
+    texts: list[str],
+    token_budget: int = embeddings_config.ENCODE_TOKEN_BUDGET,
+    max_batch_size: int = embeddings_config.ENCODE_MAX_BATCH_SIZE,
+) -> np.ndarray:
+    """
+    Encode the texts in batches of similar number of tokens, restoring the original order of the texts
+
+    Args:
+        embedding_model: SentenceTransformer -> SentenceTransformer instance that will be used to embed the texts
+        texts: list[str] -> Texts to embed
+        token_budget: int -> Max number of texts x tokens of the longest text of a batch
+        max_batch_size: int -> Max number of texts of a batch
+
+    Return:
+        np.ndarray -> Matrix with one vector per text, in the same order as texts
+    """
+    if len(texts) <= 1:
+        return embedding_model.encode(texts)
+
+    token_ids = embedding_model.tokenizer(
+        texts,
+        add_special_tokens=True,
+        truncation=True,
+        max_length=embedding_model.max_seq_length,
+    )["input_ids"]
+
+    lengths = [len(ids) for ids in token_ids]
+
+    vectors = [None] * len(texts)
+
+    for bucket in length_buckets(lengths, token_budget, max_batch_size):
+        bucket_vectors = embedding_model.encode(
+            [texts[position] for position in bucket], batch_size=len(bucket)
+        )
+
+        for position, vector in zip(bucket, bucket_vectors):
+            vectors[position] = vector
+
+    return np.stack(vectors)
+
+
+def encode_batch(embedding_model: SentenceTransformer, texts: list[str]) -> np.ndarray:
+    """
+    Run the embedding model over a list of texts
+
+    Args:
+        embedding_model: SentenceTransformer -> SentenceTransformer instance that will be used to embed the texts
+        texts: list[str] -> Texts to embed
+
+    Return:
+        np.ndarray -> Matrix with one vector per text
+    """
+    if embeddings_config.LENGTH_BUCKETING_ENABLED:
+        return encode_length_bucketed(embedding_model, texts)
+
+    return embedding_model.encode(texts)
+
+
+micro_batcher = MicroBatcher(
+    encode_fn=encode_batch,
+    window_ms=embeddings_config.MICRO_BATCHING_WINDOW_MS,
+    max_batch_size=embeddings_config.MICRO_BATCHING_MAX_BATCH_SIZE,
+)
+
+
+def encode_texts(embedding_model: SentenceTransformer, texts: list[str]) -> np.ndarray:
+    """
+    Embed texts, through the micro batcher when it is enabled, so the texts of concurrent
+    requests share the same model call
+
+    Args:
+        embedding_model: SentenceTransformer -> SentenceTransformer instance that will be used to embed the texts
+        texts: list[str] -> Texts to embed
+
+    Return:
+        np.ndarray -> Matrix with one vector per text
+    """
+    if embeddings_config.MICRO_BATCHING_ENABLED:
+        return micro_batcher.encode(embedding_model, texts)
+
+    return encode_batch(embedding_model, texts)
+
+
+def cached_encode_texts(
+    embedding_model: SentenceTransformer, embedding_model_name: str, texts: list[str]
+) -> np.ndarray:
+    """
+    Embed texts, getting from the embedding cache the vectors of the texts already embedded
+    with the same model. Only the missing texts are sent to the model.
+
+    Args:
+        embedding_model: SentenceTransformer -> SentenceTransformer instance that will be used to embed the texts
+        embedding_model_name: str -> Name of the embedding model, part of the cache key
+        texts: list[str] -> Texts to embed
+
+    Return:
+        np.ndarray -> Matrix with one vector per text
+    """
+    if embedding_cache is None:
+        return encode_texts(embedding_model, texts)
+
+    # The vectors of the ONNX backends differ slightly from the PyTorch ones, so they are
+    # cached separately
+    backend = get_model_backend(embedding_model_name)
+    if backend != "torch":
+        embedding_model_name = f"{embedding_model_name}#{backend}"
+
+    return embedding_cache.encode(
+        embedding_model=embedding_model,
+        embedding_model_name=embedding_model_name,
+        texts=texts,
+        encode_fn=encode_texts,
+    )
 
 
 def chunk_text(
@@ -45,28 +207,10 @@ def chunk_text(
             "The parameter 'chunk_overlap' must be an integer greater or equal to 0"
         )
 
-    # Generation of a tokenizer based on the embedding model selected
-    logger.info("Generating the tokenizer...")
-    tokenizer = AutoTokenizer.from_pretrained(embedding_model_name)
-
-    # Initialize the MarkdownHeaderTextSplitter instance.
-    logger.info("Initializing the MarkdownHeaderTextSplitter instance...")
-    headers_to_split_on = [
-        ("##", 2),
-        ("###", 3),
-        ("####", 4),
-        ("#####", 5),
-        ("######", 6),
-    ]
-    markdown_header_splitter = MarkdownHeaderTextSplitter(
-        headers_to_split_on, strip_headers=False
-    )
-
-    # initialize_the MarkdownTextSplitter instance.
-    logger.info("Initializing the MarkdownTextSplitter instance...")
-    markdown_text_splitter = MarkdownTextSplitter.from_huggingface_tokenizer(
-        tokenizer=tokenizer,
-        chunk_size=embedding_model.max_seq_length,
+    # The tokenizer and the splitters are built once per (model, max_seq_length, chunk_overlap)
+    markdown_header_splitter, markdown_text_splitter = splitter_cache.get(
+        embedding_model_name=embedding_model_name,
+        max_seq_length=embedding_model.max_seq_length,
         chunk_overlap=chunk_overlap,
     )
 
@@ -94,6 +238,7 @@ def embed_chunks(
     chunks: list[str],
     embedding_model: SentenceTransformer,
     metadata: Union[dict[str, str], None] = None,
+    embedding_model_name: Union[str, None] = None,
 ) -> list[dict]:
     """
     Embed string chunks into vectors based on the embedding model used
@@ -103,6 +248,8 @@ def embed_chunks(
                             chunk size limit
         metadata: Union[dict[str, str], None] -> Dictionary of metadata to be inserted to each chunk
         embedding_model: SentenceTransformer -> SentenceTransformer instance that will be used to embed the text
+        embedding_model_name: Union[str, None] -> Name of the embedding model. If provided, the vectors of the chunks
+                                                already embedded are taken from the embedding cache
 
     Return:
         list[dict] -> List of dictionaries, each dictionary is a chunk, the structure of the dictionary is:
@@ -126,15 +273,21 @@ def embed_chunks(
     if not isinstance(embedding_model, SentenceTransformer):
         raise TypeError("'embedding_model' must be a SentenceTransformer instance")
 
-    # Embedding the chunk text using batch embedding
-    chunks_embedded = embedding_model.encode(chunks)
+    # Embedding the chunk text using batch embedding, only the chunks that are not cached
+    # reach the model
+    if embedding_model_name is None:
+        chunks_embedded = encode_texts(embedding_model, chunks)
+    else:
+        chunks_embedded = cached_encode_texts(
+            embedding_model, embedding_model_name, chunks
+        )
 
     # Create a list of dictionaries, which each dictionary is a chunk with all the necessary to be
     # indexed into a vector DB
     final_chunks = [
         {
             "id": str(uuid.uuid4()),
-            "vector": chunks_embedded[i].tolist(),
+            "vector": chunks_embedded[i],
             "payload": {
                 "text": chunk_text,
                 "metadata": metadata,
@@ -153,6 +306,7 @@ def text_embedder(
     chunk_overlap: str,
     embedding_model_name: str,
     metadata: Union[dict[str, str], None] = None,
+    timings: Union[dict[str, float], None] = None,
 ) -> list[dict]:
     """
     Function that combines the chunking and embedding of text,
@@ -162,6 +316,8 @@ def text_embedder(
         chunk_overlap: int -> Number of tokens to overlap between chunks.
         embedding_model_name: str -> Name of the embedding model to use. Must be available in sentence transformers
         metadata: Union[dict[str, str], None] -> Dictionary of metadata to be inserted to each chunk
+        timings: Union[dict[str, float], None] -> If provided, the seconds spent on each stage
+                                                ('chunk', 'embed') are stored in it
 
     Return:
         list[dict] -> List of dictionaries, each dictionary is a chunk, the structure of the dictionary is:
@@ -178,28 +334,191 @@ def text_embedder(
             "The parameter 'embedding_model_name' must be a not null string"
         )
 
-    # Initialize the model
-    logger.info(f"Loading the embedding model: {embedding_model_name}")
-    try:
-        model = SentenceTransformer(embedding_model_name, trust_remote_code=True)
-    except Exception as e:
-        raise ValueError(
-            f"Error loading the embedding model from sentence transformers: {e}"
-        )
+    if timings is None:
+        timings = dict()
+
+    # Get the model from the registry, it is only loaded the first time it is requested
+    model = model_registry.get(embedding_model_name)
 
     # Chunking the text based on the max tokens supported by the model
+    stage_start = time.perf_counter()
     text_chunked = chunk_text(
         text=text,
         embedding_model=model,
         embedding_model_name=embedding_model_name,
         chunk_overlap=chunk_overlap,
     )
+    timings["chunk"] = time.perf_counter() - stage_start
 
     # Embedding the text based on the embedding model
+    stage_start = time.perf_counter()
     text_embedded = embed_chunks(
         chunks=text_chunked,
         embedding_model=model,
         metadata=metadata,
+        embedding_model_name=embedding_model_name,
     )
+    timings["embed"] = time.perf_counter() - stage_start
 
     return text_embedded
+
+
+def text_embedder_stream(
+    text: str,
+    chunk_overlap: int,
+    embedding_model_name: str,
+    metadata: Union[dict[str, str], None] = None,
+    batch_size: int = embeddings_config.STREAM_BATCH_SIZE,
+) -> Iterator[list[dict]]:
+    """
+    Same as text_embedder, but the chunks are embedded and yielded in batches, so the
+    caller can send them before the whole text is embedded.
+
+    Args:
+        text: str -> Text to be chunked by the markdown headers.
+        chunk_overlap: int -> Number of tokens to overlap between chunks.
+        embedding_model_name: str -> Name of the embedding model to use. Must be available in sentence transformers
+        metadata: Union[dict[str, str], None] -> Dictionary of metadata to be inserted to each chunk
+        batch_size: int -> Number of chunks embedded and yielded at a time
+
+    Return:
+        Iterator[list[dict]] -> Batches of chunks with the same structure returned by text_embedder
+    """
+    if not isinstance(embedding_model_name, str) or embedding_model_name == "":
+        raise TypeError(
+            "The parameter 'embedding_model_name' must be a not null string"
+        )
+
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise ValueError("'batch_size' must be an integer greater or equal than 1")
+
+    model = model_registry.get(embedding_model_name)
+
+    text_chunked = chunk_text(
+        text=text,
+        embedding_model=model,
+        embedding_model_name=embedding_model_name,
+        chunk_overlap=chunk_overlap,
+    )
+
+    for start in range(0, len(text_chunked), batch_size):
+        yield embed_chunks(
+            chunks=text_chunked[start : start + batch_size],
+            embedding_model=model,
+            metadata=metadata,
+            embedding_model_name=embedding_model_name,
+        )
+
+
+def split_query(
+    query: str,
+    embedding_model: SentenceTransformer,
+    chunk_overlap: int,
+    truncate: bool = False,
+) -> list[str]:
+    """
+    Split a query in windows of tokens only when it exceeds the max_seq_length of the model.
+    Unlike chunk_text, the query is not split by markdown headers.
+
+    Args:
+        query: str -> User's query
+        embedding_model: SentenceTransformer -> SentenceTransformer instance whose tokenizer will be used
+        chunk_overlap: int -> Number of tokens to overlap between windows
+        truncate: bool -> If True, the query is not split, the model truncates it to its max_seq_length
+
+    Return:
+        list[str] -> List of texts to embed, a single entry when the query fits in the model
+    """
+    if not isinstance(query, str) or query == "":
+        raise TypeError("The parameter 'query' must be a not null string")
+
+    if (not isinstance(chunk_overlap, int)) | (chunk_overlap < 0):
+        raise ValueError(
+            "The parameter 'chunk_overlap' must be an integer greater or equal to 0"
+        )
+
+    tokenizer = embedding_model.tokenizer
+
+    # Tokens left for the text after the special tokens added by the tokenizer ([CLS], [SEP])
+    window_size = embedding_model.max_seq_length - tokenizer.num_special_tokens_to_add()
+
+    if truncate:
+        return [query]
+
+    # The length in characters is not a bound of the tokens: the WordPiece / SentencePiece
+    # tokenizers may split a single character (ex. an emoji, CJK or a rare symbol) in several tokens
+    token_ids = tokenizer(query, add_special_tokens=False)["input_ids"]
+
+    if len(token_ids) <= window_size:
+        return [query]
+
+    stride = max(window_size - chunk_overlap, 1)
+
+    windows = list()
+
+    for start in range(0, len(token_ids), stride):
+        windows.append(tokenizer.decode(token_ids[start : start + window_size]))
+
+        if start + window_size >= len(token_ids):
+            break
+
+    return windows
+
+
+def query_embedder(
+    queries: list[str],
+    chunk_overlap: int,
+    embedding_model_name: str,
+    truncate: bool = False,
+    timings: Union[dict[str, float], None] = None,
+) -> list[np.ndarray]:
+    """
+    Embed search queries without the markdown chunking and payload generation of text_embedder.
+    All the queries are embedded with a single call to the model.
+
+    Args:
+        queries: list[str] -> List of queries to embed
+        chunk_overlap: int -> Number of tokens to overlap between windows of a long query
+        embedding_model_name: str -> Name of the embedding model to use. Must be available in sentence transformers
+        truncate: bool -> If True, long queries are truncated instead of split in windows
+        timings: Union[dict[str, float], None] -> If provided, the seconds spent on each stage
+                                                ('tokenize', 'embed') are stored in it
+
+    Return:
+        list[np.ndarray] -> For each query, a matrix with the vectors of its windows
+    """
+    if not isinstance(queries, list) or len(queries) == 0:
+        raise TypeError("'queries' must be a not empty list of strings")
+
+    if timings is None:
+        timings = dict()
+
+    model = model_registry.get(embedding_model_name)
+
+    stage_start = time.perf_counter()
+    queries_windows = [
+        split_query(
+            query=query,
+            embedding_model=model,
+            chunk_overlap=chunk_overlap,
+            truncate=truncate,
+        )
+        for query in queries
+    ]
+
+    texts = [window for windows in queries_windows for window in windows]
+    timings["tokenize"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    vectors = cached_encode_texts(model, embedding_model_name, texts)
+    timings["embed"] = time.perf_counter() - stage_start
+
+    # Regroup the vectors by query
+    queries_vectors = list()
+    position = 0
+
+    for windows in queries_windows:
+        queries_vectors.append(vectors[position : position + len(windows)])
+        position += len(windows)
+
+    return queries_vectors
@@ -0,0 +1,288 @@
+from sentence_transformers import SentenceTransformer
+from collections import OrderedDict
+from threading import Lock
+from loguru import logger
+from typing import Union
+import gc
+import os
+
+from config import EmbeddingsConfig
+
+embeddings_config = EmbeddingsConfig()
+
+MODEL_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Directory of the embedding service, /embeddings in the container
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_model_backend(embedding_model_name: str) -> str:
+    """
+    Return the inference backend configured for a model in EmbeddingsConfig.MODEL_BACKENDS
+
+    Args:
+        embedding_model_name: str -> Name of the embedding model
+
+    Return:
+        str -> "torch", "onnx" or "onnx-int8"
+    """
+    backend = embeddings_config.MODEL_BACKENDS.get(embedding_model_name, "torch")
+
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(
+            f"The backend of {embedding_model_name} must be one of: {', '.join(MODEL_BACKENDS)}"
+        )
+
+    return backend
+
+
+def embedding_version(embedding_model_name: str) -> str:
+    """
+    Identify the model and the backend that generate the vectors of a model name, so the clients
+    can tell when the vectors of a text would change
+
+    Args:
+        embedding_model_name: str -> Name of the embedding model
+
+    Return:
+        str -> Ex: "sentence-transformers/LaBSE:onnx-int8"
+    """
+    return f"{embedding_model_name}:{get_model_backend(embedding_model_name)}"
+
+
+def onnx_model_dir(embedding_model_name: str) -> str:
+    """
+    Return the directory where onnx_export.py saves the ONNX version of a model
+
+    Args:
+        embedding_model_name: str -> Name of the embedding model
+
+    Return:
+        str -> Absolute path of the directory inside EmbeddingsConfig.ONNX_MODELS_DIR
+    """
+    models_dir = embeddings_config.ONNX_MODELS_DIR
+
+    # A relative directory is resolved against the directory of the service, not the working
+    # directory, so the models exported at build time (from /embeddings) are found by the
+    # service running from /embeddings/app
+    if not os.path.isabs(models_dir):
+        models_dir = os.path.join(SERVICE_DIR, models_dir)
+
+    return os.path.join(models_dir, embedding_model_name.replace("/", "__"))
+
+
+def onnx_file_name(backend: str) -> str:
+    """
+    Return the name of the ONNX file used by a backend, relative to the model directory
+
+    Args:
+        backend: str -> "onnx" or "onnx-int8"
+
+    Return:
+        str -> Name of the file written by sentence transformers when exporting the model
+    """
+    if backend == "onnx-int8":
+        return f"onnx/model_qint8_{embeddings_config.ONNX_QUANTIZATION_CONFIG}.onnx"
+
+    return "onnx/model.onnx"
+
+
+def model_memory_mb(model: SentenceTransformer) -> float:
+    """
+    Estimate the memory used by the weights of a model
+
+    Args:
+        model: SentenceTransformer -> Model loaded in memory
+
+    Return:
+        float -> Megabytes used by the parameters and buffers of the model
+    """
+    tensors = list(model.parameters()) + list(model.buffers())
+
+    total_bytes = sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+    # The weights of the ONNX models live in the ONNX Runtime session, not in torch tensors,
+    # the size of the ONNX file is used instead
+    if getattr(model, "backend", "torch") != "torch":
+        model_path = getattr(model[0].auto_model, "model_path", None)
+
+        if model_path is not None and os.path.exists(model_path):
+            total_bytes = os.path.getsize(model_path)
+
+    return total_bytes / (1024 * 1024)
+
+
+class ModelRegistry:
+    """
+    Keeps the embedding models loaded once per worker, so the requests reuse the same
+    SentenceTransformer instance instead of loading the weights on every call.
+
+    The least recently used models are evicted when more than max_models are resident
+    or when the memory used by the resident models exceeds max_memory_mb.
+    """
+
+    def __init__(self, max_models: int, max_memory_mb: Union[int, None] = None):
+        if not isinstance(max_models, int) or max_models < 1:
+            raise ValueError("max_models must be an integer greater or equal than 1")
+
+        if max_memory_mb is not None and (
+            not isinstance(max_memory_mb, int) or max_memory_mb < 1
+        ):
+            raise ValueError("max_memory_mb must be None or an integer greater than 0")
+
+        self.max_models = max_models
+        self.max_memory_mb = max_memory_mb
+
+        self._models: OrderedDict[str, SentenceTransformer] = OrderedDict()
+        self._models_memory: dict[str, float] = {}
+
+        # _lock protects the dictionaries, _loading_locks avoid loading the same model
+        # twice when concurrent requests ask for it
+        self._lock = Lock()
+        self._loading_locks: dict[str, Lock] = {}
+
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, embedding_model_name: str) -> SentenceTransformer:
+        """
+        Get a model from the registry, loading it if it is not resident yet
+
+        Args:
+            embedding_model_name: str -> Name of the embedding model. Must be available in sentence transformers
+
+        Return:
+            SentenceTransformer -> Instance shared by all the requests of the worker
+        """
+        if not isinstance(embedding_model_name, str) or embedding_model_name == "":
+            raise TypeError(
+                "The parameter 'embedding_model_name' must be a not null string"
+            )
+
+        model = self._get_resident(embedding_model_name)
+
+        if model is not None:
+            return model
+
+        with self._lock:
+            loading_lock = self._loading_locks.setdefault(embedding_model_name, Lock())
+
+        with loading_lock:
+            # Another request could have loaded the model while waiting for the lock
+            model = self._get_resident(embedding_model_name)
+
+            if model is not None:
+                return model
+
+            model = self._load(embedding_model_name)
+
+            with self._lock:
+                self._models[embedding_model_name] = model
+                self._models_memory[embedding_model_name] = model_memory_mb(model)
+                self._loading_locks.pop(embedding_model_name, None)
+                self.loads += 1
+
+                self._evict()
+
+        return model
+
+    def stats(self) -> dict:
+        """
+        Return the current state of the registry
+
+        Return:
+            dict -> Resident models, memory used and hit/load/eviction counters
+        """
+        with self._lock:
+            return {
+                "loaded_models": list(self._models.keys()),
+                "memory_mb": round(sum(self._models_memory.values()), 2),
+                "max_models": self.max_models,
+                "max_memory_mb": self.max_memory_mb,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+    def _get_resident(
+        self, embedding_model_name: str
+    ) -> Union[SentenceTransformer, None]:
+        with self._lock:
+            model = self._models.get(embedding_model_name)
+
+            if model is not None:
+                self._models.move_to_end(embedding_model_name)
+                self.hits += 1
+
+            return model
+
+    def _load(self, embedding_model_name: str) -> SentenceTransformer:
+        backend = get_model_backend(embedding_model_name)
+
+        logger.info(
+            f"Loading the embedding model: {embedding_model_name} ({backend} backend)"
+        )
+
+        model_kwargs = dict()
+
+        if backend == "torch":
+            model_path = embedding_model_name
+        else:
+            model_path = onnx_model_dir(embedding_model_name)
+            file_name = onnx_file_name(backend)
+
+            if os.path.exists(os.path.join(model_path, file_name)):
+                model_kwargs = {
+                    "backend": "onnx",
+                    "model_kwargs": {"file_name": file_name},
+                }
+            elif backend == "onnx":
+                # Without a local export, sentence transformers exports the model when loading it
+                model_path = embedding_model_name
+                model_kwargs = {"backend": "onnx"}
+            else:
+                raise ValueError(
+                    f"The quantized model {file_name} was not found in {model_path}. "
+                    f"Run onnx_export.py --model {embedding_model_name} --quantize first"
+                )
+
+        try:
+            model = SentenceTransformer(
+                model_path, trust_remote_code=True, **model_kwargs
+            )
+        except Exception as e:
+            raise ValueError(
+                f"Error loading the embedding model from sentence transformers: {e}"
+            )
+
+        logger.info(f"Embedding model {embedding_model_name} loaded")
+
+        return model
+
+    def _evict(self) -> None:
+        # The last model of the OrderedDict is the one that was just used, it is never evicted
+        evicted = False
+
+        while len(self._models) > 1 and (
+            len(self._models) > self.max_models
+            or (
+                self.max_memory_mb is not None
+                and sum(self._models_memory.values()) > self.max_memory_mb
+            )
+        ):
+            model_name, _ = self._models.popitem(last=False)
+            self._models_memory.pop(model_name, None)
+            self.evictions += 1
+            evicted = True
+
+            logger.info(f"Embedding model {model_name} evicted from the registry")
+
+        if evicted:
+            gc.collect()
+
+
+model_registry = ModelRegistry(
+    max_models=embeddings_config.MAX_LOADED_MODELS,
+    max_memory_mb=embeddings_config.MAX_MODELS_MEMORY_MB,
+)
@@ -0,0 +1,206 @@
+from sentence_transformers import (
+    SentenceTransformer,
+    export_dynamic_quantized_onnx_model,
+)
+from loguru import logger
+from typing import Union
+import numpy as np
+import argparse
+import time
+
+from config import EmbeddingsConfig
+from model_registry import onnx_model_dir, onnx_file_name
+
+embeddings_config = EmbeddingsConfig()
+
+# Used to verify the exported models when no sample corpus is provided
+DEFAULT_SAMPLE_TEXTS = [
+    "Renewable energy sources such as wind and solar are variable and require storage or flexible generation.",
+    "The levelized cost of electricity compares the lifetime costs of different generation technologies.",
+    "Transmission system operators balance supply and demand in real time to keep the grid frequency stable.",
+    "La eficiencia energética reduce el consumo sin disminuir el servicio que reciben los usuarios.",
+    "Los paneles fotovoltaicos convierten la radiación solar directamente en electricidad.",
+    "Natural gas combined cycle plants reach efficiencies above 60 percent.",
+    "Demand response programs pay consumers to shift their consumption away from peak hours.",
+    "# Energy Outlook\n\n## Electricity demand\n\nGlobal electricity demand grew by 2.2% in 2023.",
+]
+
+
+def export_onnx_model(
+    embedding_model_name: str,
+    quantize: bool = False,
+    output_dir: Union[str, None] = None,
+) -> str:
+    """
+    Export a sentence transformers model to ONNX, and optionally quantize it to int8
+
+    Args:
+        embedding_model_name: str -> Name of the embedding model. Must be available in sentence transformers
+        quantize: bool -> If True, an int8 dynamically quantized version is also saved
+        output_dir: Union[str, None] -> Directory where the model is saved. By default, the directory
+                                        where the model registry looks for it
+
+    Return:
+        str -> Directory where the model was saved
+    """
+    if not isinstance(embedding_model_name, str) or embedding_model_name == "":
+        raise TypeError("'embedding_model_name' must be a not null string")
+
+    if output_dir is None:
+        output_dir = onnx_model_dir(embedding_model_name)
+
+    logger.info(f"Exporting {embedding_model_name} to ONNX...")
+    model = SentenceTransformer(
+        embedding_model_name, backend="onnx", trust_remote_code=True
+    )
+    model.save_pretrained(output_dir)
+    logger.info(f"ONNX model saved in {output_dir}")
+
+    if quantize:
+        logger.info(
+            f"Quantizing the ONNX model to int8 ({embeddings_config.ONNX_QUANTIZATION_CONFIG})..."
+        )
+        export_dynamic_quantized_onnx_model(
+            model,
+            quantization_config=embeddings_config.ONNX_QUANTIZATION_CONFIG,
+            model_name_or_path=output_dir,
+        )
+        logger.info(f"Quantized model saved in {output_dir}")
+
+    return output_dir
+
+
+def timed_encode(
+    model: SentenceTransformer, texts: list[str]
+) -> tuple[np.ndarray, float]:
+    # Returns the normalized vectors and the mean milliseconds spent per text
+    model.encode(texts[:1])  # Warm up
+
+    start = time.perf_counter()
+    vectors = model.encode(texts, normalize_embeddings=True)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    return vectors, elapsed_ms / len(texts)
+
+
+def verify_onnx_model(
+    embedding_model_name: str,
+    backend: str,
+    sample_texts: list[str] = DEFAULT_SAMPLE_TEXTS,
+    model_dir: Union[str, None] = None,
+    min_cosine_similarity: float = embeddings_config.ONNX_MIN_COSINE_SIMILARITY,
+) -> dict:
+    """
+    Compare the vectors of an exported ONNX model with the ones of the PyTorch model
+
+    Args:
+        embedding_model_name: str -> Name of the embedding model. Must be available in sentence transformers
+        backend: str -> "onnx" or "onnx-int8"
+        sample_texts: list[str] -> Texts embedded by both models
+        model_dir: Union[str, None] -> Directory of the exported model. By default, the directory
+                                        where the model registry looks for it
+        min_cosine_similarity: float -> Min cosine similarity accepted for every text
+
+    Return:
+        dict -> Mean and min cosine similarity, and the ms per text of both models.
+                Raises ValueError if a text is below min_cosine_similarity
+    """
+    if backend not in ("onnx", "onnx-int8"):
+        raise ValueError("backend must be either 'onnx' or 'onnx-int8'")
+
+    if not isinstance(sample_texts, list) or len(sample_texts) == 0:
+        raise TypeError("'sample_texts' must be a not empty list of strings")
+
+    if model_dir is None:
+        model_dir = onnx_model_dir(embedding_model_name)
+
+    torch_model = SentenceTransformer(embedding_model_name, trust_remote_code=True)
+    onnx_model = SentenceTransformer(
+        model_dir,
+        backend="onnx",
+        model_kwargs={"file_name": onnx_file_name(backend)},
+        trust_remote_code=True,
+    )
+
+    torch_vectors, torch_ms = timed_encode(torch_model, sample_texts)
+    onnx_vectors, onnx_ms = timed_encode(onnx_model, sample_texts)
+
+    # The vectors are normalized, so the dot product is the cosine similarity
+    cosine_similarities = np.sum(torch_vectors * onnx_vectors, axis=1)
+
+    report = {
+        "embedding_model_name": embedding_model_name,
+        "backend": backend,
+        "sample_size": len(sample_texts),
+        "mean_cosine_similarity": round(float(cosine_similarities.mean()), 6),
+        "min_cosine_similarity": round(float(cosine_similarities.min()), 6),
+        "torch_ms_per_text": round(torch_ms, 2),
+        "onnx_ms_per_text": round(onnx_ms, 2),
+    }
+
+    logger.info(f"Verification report: {report}")
+
+    if report["min_cosine_similarity"] < min_cosine_similarity:
+        raise ValueError(
+            f"The {backend} model does not agree with the PyTorch model: min cosine "
+            f"similarity {report['min_cosine_similarity']} < {min_cosine_similarity}"
+        )
+
+    return report
+
+
+def read_sample_texts(sample_file: str) -> list[str]:
+    # One text per paragraph (texts separated by blank lines)
+    with open(sample_file, encoding="utf-8") as file:
+        paragraphs = file.read().split("\n\n")
+
+    return [paragraph.strip() for paragraph in paragraphs if paragraph.strip() != ""]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export an embedding model to ONNX (optionally quantized to int8) and verify it against the PyTorch model"
+    )
+
+    parser.add_argument(
+        "-m",
+        "--model",
+        required=False,
+        help="Name of the embedding model to export. Must be available on sentence-transformers.",
+        default=embeddings_config.EMBEDDING_MODEL,
+    )
+
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Also save an int8 dynamically quantized version of the model.",
+    )
+
+    parser.add_argument(
+        "--sample-file",
+        required=False,
+        help="Text file used to verify the exported model, one sample per paragraph. By default, a few built-in sentences.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--skip-verification",
+        action="store_true",
+        help="Don't compare the exported model with the PyTorch model.",
+    )
+
+    args = parser.parse_args()
+
+    model_dir = export_onnx_model(args.model, quantize=args.quantize)
+
+    if not args.skip_verification:
+        sample_texts = (
+            read_sample_texts(args.sample_file)
+            if args.sample_file is not None
+            else DEFAULT_SAMPLE_TEXTS
+        )
+
+        for backend in ["onnx", "onnx-int8"] if args.quantize else ["onnx"]:
+            verify_onnx_model(
+                args.model, backend, sample_texts=sample_texts, model_dir=model_dir
+            )
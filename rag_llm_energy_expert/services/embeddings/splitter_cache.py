@@ -0,0 +1,136 @@
+from langchain_text_splitters import MarkdownHeaderTextSplitter, MarkdownTextSplitter
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
+from collections import OrderedDict
+from threading import Lock
+from loguru import logger
+
+from config import EmbeddingsConfig
+
+embeddings_config = EmbeddingsConfig()
+
+# Headers used to split the markdown text before splitting it by tokens
+HEADERS_TO_SPLIT_ON = [
+    ("##", 2),
+    ("###", 3),
+    ("####", 4),
+    ("#####", 5),
+    ("######", 6),
+]
+
+
+class SplitterCache:
+    """
+    Keeps the tokenizers and text splitters used by chunk_text, so chunking a text only
+    runs the split instead of loading the tokenizer and building the splitters again.
+
+    The MarkdownTextSplitter instances are keyed by (embedding_model_name, max_seq_length, chunk_overlap),
+    and the tokenizers by embedding_model_name. Both are bounded to max_size entries (LRU).
+    """
+
+    def __init__(self, max_size: int):
+        if not isinstance(max_size, int) or max_size < 1:
+            raise ValueError("max_size must be an integer greater or equal than 1")
+
+        self.max_size = max_size
+
+        # The header splitter does not depend on the model, so only one instance is needed
+        self.markdown_header_splitter = MarkdownHeaderTextSplitter(
+            HEADERS_TO_SPLIT_ON, strip_headers=False
+        )
+
+        self._tokenizers: OrderedDict[str, PreTrainedTokenizerBase] = OrderedDict()
+        self._text_splitters: OrderedDict[
+            tuple[str, int, int], MarkdownTextSplitter
+        ] = OrderedDict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        embedding_model_name: str,
+        max_seq_length: int,
+        chunk_overlap: int,
+    ) -> tuple[MarkdownHeaderTextSplitter, MarkdownTextSplitter]:
+        """
+        Get the splitters needed to chunk a text for an embedding model
+
+        Args:
+            embedding_model_name: str -> Name of the embedding model, used to load its tokenizer
+            max_seq_length: int -> Max number of tokens of each chunk
+            chunk_overlap: int -> Number of tokens to overlap between chunks
+
+        Return:
+            tuple[MarkdownHeaderTextSplitter, MarkdownTextSplitter] -> Splitter by markdown headers and
+                                                                    splitter by number of tokens
+        """
+        key = (embedding_model_name, max_seq_length, chunk_overlap)
+
+        with self._lock:
+            text_splitter = self._text_splitters.get(key)
+
+            if text_splitter is not None:
+                self._text_splitters.move_to_end(key)
+                self.hits += 1
+                return self.markdown_header_splitter, text_splitter
+
+            self.misses += 1
+
+        # Building the splitter is done outside the lock, loading a tokenizer can take a while
+        logger.info("Initializing the MarkdownTextSplitter instance...")
+        text_splitter = MarkdownTextSplitter.from_huggingface_tokenizer(
+            tokenizer=self._get_tokenizer(embedding_model_name),
+            chunk_size=max_seq_length,
+            chunk_overlap=chunk_overlap,
+        )
+
+        with self._lock:
+            self._text_splitters[key] = text_splitter
+
+            while len(self._text_splitters) > self.max_size:
+                self._text_splitters.popitem(last=False)
+
+        return self.markdown_header_splitter, text_splitter
+
+    def stats(self) -> dict:
+        """
+        Return the current state of the cache
+
+        Return:
+            dict -> Number of entries, hits, misses and hit rate of the cache
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+
+            return {
+                "size": len(self._text_splitters),
+                "max_size": self.max_size,
+                "tokenizers": list(self._tokenizers.keys()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 4) if requests > 0 else 0.0,
+            }
+
+    def _get_tokenizer(self, embedding_model_name: str) -> PreTrainedTokenizerBase:
+        with self._lock:
+            tokenizer = self._tokenizers.get(embedding_model_name)
+
+            if tokenizer is not None:
+                self._tokenizers.move_to_end(embedding_model_name)
+                return tokenizer
+
+        # Generation of a tokenizer based on the embedding model selected
+        logger.info("Generating the tokenizer...")
+        tokenizer = AutoTokenizer.from_pretrained(embedding_model_name)
+
+        with self._lock:
+            self._tokenizers[embedding_model_name] = tokenizer
+
+            while len(self._tokenizers) > self.max_size:
+                self._tokenizers.popitem(last=False)
+
+        return tokenizer
+
+
+splitter_cache = SplitterCache(max_size=embeddings_config.SPLITTER_CACHE_SIZE)
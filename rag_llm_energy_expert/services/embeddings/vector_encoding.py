@@ -0,0 +1,75 @@
+from typing import Union
+import numpy as np
+import base64
+
+# Media type that the clients send in the Accept header to receive packed vectors.
+# Ex: "Accept: application/x-embeddings+json; dtype=float16"
+PACKED_VECTORS_MEDIA_TYPE = "application/x-embeddings+json"
+
+# Encodings of the vectors: "float" is a JSON list of floats, the others are base64
+# strings of the little-endian packed vector
+VECTOR_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+
+
+def negotiate_vector_encoding(accept_header: Union[str, None]) -> str:
+    """
+    Choose the encoding of the vectors based on the Accept header of the request
+
+    Args:
+        accept_header: Union[str, None] -> Value of the Accept header
+
+    Return:
+        str -> "float" (list of floats), "float32" or "float16" (base64 packed vectors)
+    """
+    if not accept_header:
+        return "float"
+
+    for media_range in accept_header.split(","):
+        media_type, *parameters = [part.strip() for part in media_range.split(";")]
+
+        if media_type.lower() != PACKED_VECTORS_MEDIA_TYPE:
+            continue
+
+        dtype = "float32"
+
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+
+            if key.strip().lower() == "dtype":
+                dtype = value.strip().strip('"').lower()
+
+        if dtype in VECTOR_DTYPES:
+            return dtype
+
+    return "float"
+
+
+def encode_vectors(
+    vectors: np.ndarray, vector_encoding: str
+) -> list[Union[list[float], str]]:
+    """
+    Convert a matrix of vectors into its wire format
+
+    Args:
+        vectors: np.ndarray -> Matrix with one vector per row
+        vector_encoding: str -> Encoding returned by negotiate_vector_encoding
+
+    Return:
+        list[Union[list[float], str]] -> One entry per vector, a list of floats or a base64 string
+    """
+    if vector_encoding == "float":
+        return np.asarray(vectors).tolist()
+
+    if vector_encoding not in VECTOR_DTYPES:
+        raise ValueError(
+            f"vector_encoding must be 'float' or one of: {', '.join(VECTOR_DTYPES)}"
+        )
+
+    packed_vectors = np.asarray(vectors, dtype=VECTOR_DTYPES[vector_encoding])
+
+    return [
+        base64.b64encode(vector.tobytes()).decode("ascii") for vector in packed_vectors
+    ]
@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+import asyncio
+import time
+
+
+class PoolOverloadedError(Exception):
+    """
+    Raised when the admission queue of the pool is full
+    """
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when a request waited more than the queue timeout for a free worker
+    """
+
+
+class WorkerPool:
+    """
+    Run the CPU bound work of the requests (tokenization and encode) in a bounded pool of threads,
+    so the event loop is never blocked and the service does not accept more work than it can process.
+
+    At most max_workers calls run at the same time, up to max_queued calls wait for a free worker,
+    and the rest are rejected (PoolOverloadedError). A call that waits more than queue_timeout_seconds
+    for a worker is also rejected (PoolTimeoutError).
+    """
+
+    def __init__(self, max_workers: int, max_queued: int, queue_timeout_seconds: float):
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError("max_workers must be an integer greater or equal than 1")
+
+        if not isinstance(max_queued, int) or max_queued < 0:
+            raise ValueError("max_queued must be an integer greater or equal than 0")
+
+        if (
+            not isinstance(queue_timeout_seconds, (int, float))
+            or queue_timeout_seconds <= 0
+        ):
+            raise ValueError("queue_timeout_seconds must be a number greater than 0")
+
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.queue_timeout_seconds = queue_timeout_seconds
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="embeddings-worker"
+        )
+        self._semaphore = asyncio.Semaphore(max_workers)
+
+        # All the counters are only modified from the event loop, so they don't need a lock
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected_overloaded = 0
+        self.rejected_timeout = 0
+        self.total_queue_seconds = 0.0
+
+    def check_capacity(self) -> None:
+        """
+        Raise PoolOverloadedError if the admission queue is full
+        """
+        if self.running >= self.max_workers and self.queued >= self.max_queued:
+            self.rejected_overloaded += 1
+            raise PoolOverloadedError(
+                f"The service is processing {self.running} requests and has "
+                f"{self.queued} requests waiting, try again later"
+            )
+
+    async def execute(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Wait for a free worker and run func on it, without checking the admission queue.
+        Used by the requests that were already admitted (ex. the batches of a stream).
+
+        Args:
+            func: Callable -> Function to run in the pool
+            *args, **kwargs -> Arguments of func
+
+        Return:
+            Any -> Value returned by func
+        """
+        self.queued += 1
+        queue_start = time.perf_counter()
+        acquired = False
+
+        try:
+            # Unlike asyncio.wait_for on python 3.11, a permit handed over while the timeout
+            # cancels the acquire is given back by the semaphore, so it is never leaked
+            async with asyncio.timeout(self.queue_timeout_seconds):
+                acquired = await self._semaphore.acquire()
+        except TimeoutError:
+            if not acquired:
+                self.rejected_timeout += 1
+                raise PoolTimeoutError(
+                    f"No worker was available after {self.queue_timeout_seconds} seconds"
+                )
+        finally:
+            self.queued -= 1
+            self.total_queue_seconds += time.perf_counter() - queue_start
+
+        self.running += 1
+
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(func, *args, **kwargs)
+
+        # The permit is released when the thread finishes, not when the request is cancelled (ex. the
+        # client disconnected), so no more than max_workers calls run at the same time
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._release_worker)
+        )
+
+        return await asyncio.wrap_future(future)
+
+    def _release_worker(self) -> None:
+        # Called in the event loop when a call finished or was cancelled before it started
+        self.running -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Admit a call in the pool and run it when a worker is free
+
+        Args:
+            func: Callable -> Function to run in the pool
+            *args, **kwargs -> Arguments of func
+
+        Return:
+            Any -> Value returned by func
+        """
+        self.check_capacity()
+
+        return await self.execute(func, *args, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Return the current state of the pool
+
+        Return:
+            dict -> Running and queued calls, and the number of calls completed and rejected
+        """
+        admitted = self.completed + self.running
+
+        return {
+            "max_workers": self.max_workers,
+            "max_queued": self.max_queued,
+            "running": self.running,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected_overloaded": self.rejected_overloaded,
+            "rejected_timeout": self.rejected_timeout,
+            "mean_queue_ms": (
+                round(self.total_queue_seconds / admitted * 1000, 2)
+                if admitted > 0
+                else 0.0
+            ),
+        }
@@ -0,0 +1,367 @@
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+from datetime import datetime
+from itertools import chain
+from threading import Lock
+from loguru import logger
+import multiprocessing
+import json
+import os
+import sys
+
+sys.path.append("../../..")
+
+from rag_llm_energy_expert.config import IngestionConfig
+from rag_llm_energy_expert.services.ingestion.ingestion_pipeline import (
+    ALLOWED_FORMATS,
+    stream_document_embeddings,
+    index_document_stream,
+)
+from rag_llm_energy_expert.utils.gcp.gcs import list_files
+from rag_llm_energy_expert.utils.vector_db.qdrant import create_collection
+
+ingestion_config = IngestionConfig()
+
+# Avoid two documents creating the same collection at the same time
+collection_lock = Lock()
+
+
+def list_input_files(source: str) -> list[str]:
+    """
+    List the files to ingest from a GCS prefix, a local directory or a manifest
+
+    Args:
+        source: str -> One of:
+                        - a GCS prefix (ex: 'gs://bucket_name/folder_name/')
+                        - a local directory, searched recursively (ex: 'local_folder/')
+                        - a manifest: text file with one gcs or local path per line. Empty lines
+                          and lines starting with '#' are ignored
+
+    Return:
+        list[str] -> Paths of the files to ingest
+    """
+    if not isinstance(source, str) or source == "":
+        raise ValueError("source must be a not null string")
+
+    if source.startswith("gs://"):
+        source_parts = source[5:].split("/", maxsplit=1)
+        bucket_name = source_parts[0]
+        prefix = source_parts[1] if len(source_parts) > 1 else ""
+
+        return [
+            f"gs://{bucket_name}/{file_name}"
+            for file_name in list_files(bucket_name=bucket_name, prefix=prefix)
+            if file_name.split(".")[-1] in ALLOWED_FORMATS
+        ]
+
+    if os.path.isdir(source):
+        file_paths = list()
+
+        for directory, _, file_names in os.walk(source):
+            file_paths += [
+                os.path.join(directory, file_name).replace("\\", "/")
+                for file_name in file_names
+                if file_name.split(".")[-1] in ALLOWED_FORMATS
+            ]
+
+        return sorted(file_paths)
+
+    if os.path.isfile(source):
+        with open(source, encoding="utf-8") as manifest:
+            lines = [line.strip() for line in manifest]
+
+        return [line for line in lines if line != "" and not line.startswith("#")]
+
+    raise ValueError(
+        f"{source} is not a GCS path, a local directory or a manifest file"
+    )
+
+
+def load_state(state_file: str) -> dict[str, dict]:
+    """
+    Load the status of the files processed by a previous batch
+
+    Args:
+        state_file: str -> Path of the JSON state file
+
+    Return:
+        dict[str, dict] -> Status of each file, empty if the state file does not exists
+    """
+    if not os.path.isfile(state_file):
+        return dict()
+
+    with open(state_file, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_state(state: dict[str, dict], state_file: str) -> None:
+    """
+    Save the status of the files, replacing the state file atomically so a crash while
+    writing never leaves it corrupted
+
+    Args:
+        state: dict[str, dict] -> Status of each file
+        state_file: str -> Path of the JSON state file
+
+    Return:
+        None
+    """
+    temporal_file = state_file + ".tmp"
+
+    with open(temporal_file, "w", encoding="utf-8") as file:
+        json.dump(state, file, indent=2)
+
+    os.replace(temporal_file, state_file)
+
+
+def parse_file(file_path: str) -> dict:
+    """
+    Parse a file with the parser of its extension. Runs in the processes of the parsing pool
+
+    Args:
+        file_path: str -> Either a gcs path or a local path
+
+    Return:
+        dict -> Dictionary returned by the parsers, with the keys "text" and "metadata"
+    """
+    extension = file_path.split(".")[-1]
+
+    if extension not in ALLOWED_FORMATS:
+        raise ValueError(
+            f"The file is in the format {extension}, which cannot be processed. Current allowed formats are: {', '.join(ALLOWED_FORMATS.keys())}"
+        )
+
+    # The files are already parsed in parallel, each one is parsed by a single process
+    return ALLOWED_FORMATS[extension](file_path, workers=1)
+
+
+def index_file(
+    file_data: dict,
+    collection_name: str,
+    embedding_model_name: str = None,
+    chunk_overlap: int = None,
+    create_db_collection: bool = False,
+) -> dict[str, int]:
+    """
+    Embed a parsed file with the streaming endpoint of the embedding service and upsert its
+    chunks in batches. Runs in the threads of the embedding pool
+
+    Args:
+        file_data: dict -> Dictionary returned by the parsers, with the keys "text" and "metadata"
+        collection_name: str -> Name of the vector db collection where the chunks will be indexed
+        embedding_model_name: str -> Name of the embedding model to use. Must be available in sentence transformers
+        chunk_overlap: int -> Number of tokens that will be overlapped on each chunk
+        create_db_collection: bool -> If the collection does not exists, creates it if create_db_collection == True
+
+    Return:
+        dict[str, int] -> Number of points 'added', 'updated', 'unchanged' and 'deleted'
+    """
+    chunks_batches = stream_document_embeddings(
+        file_data=file_data,
+        embedding_model_name=embedding_model_name,
+        chunk_overlap=chunk_overlap,
+    )
+
+    first_batch = next(chunks_batches, None)
+
+    # A document without chunks is still indexed, so the points of its previous version are deleted
+    if first_batch is not None:
+        if create_db_collection:
+            with collection_lock:
+                create_collection(
+                    collection_name=collection_name,
+                    vector_size=len(first_batch[0]["vector"]),
+                )
+
+        chunks_batches = chain([first_batch], chunks_batches)
+
+    # The collection was created under the lock, index_document_stream only checks if it exists
+    return index_document_stream(
+        chunks_batches=chunks_batches,
+        collection_name=collection_name,
+        document_title=file_data["metadata"]["title"],
+        create_db_collection=create_db_collection,
+    )
+
+
+def ingest_files(
+    file_paths: list[str],
+    collection_name: str,
+    embedding_model_name: str = None,
+    chunk_overlap: int = None,
+    create_db_collection: bool = False,
+    state_file: str = ingestion_config.BATCH_STATE_FILE,
+    parse_workers: int = ingestion_config.PARSE_WORKERS,
+    embedding_concurrency: int = ingestion_config.EMBEDDING_CONCURRENCY,
+) -> dict[str, dict]:
+    """
+    Ingest several files into a vector DB as a pipeline: the files are parsed in a pool of processes
+    while the files already parsed are embedded and upserted in a pool of threads.
+    The status of each file is saved in state_file after each step, and the files indexed by a
+    previous run with the same state_file are skipped, so an interrupted batch can be resumed.
+
+    Args:
+        file_paths: list[str] -> Gcs or local paths of the files to ingest
+        collection_name: str -> Name of the vector db collection where the chunks will be indexed
+        embedding_model_name: str -> Name of the embedding model to use. Must be available in sentence transformers
+        chunk_overlap: int -> Number of tokens that will be overlapped on each chunk
+        create_db_collection: bool -> If the collection does not exists, creates it if create_db_collection == True
+        state_file: str -> JSON file where the status of each file is stored
+        parse_workers: int -> Number of processes parsing files at the same time
+        embedding_concurrency: int -> Max number of files being embedded and indexed at the same time
+
+    Return:
+        dict[str, dict] -> Status of each file: 'status' ("indexed" or "failed"), 'points'
+                            (number of points 'added', 'updated', 'unchanged' and 'deleted') and 'error'
+    """
+    if not isinstance(file_paths, list) or not all(
+        [isinstance(x, str) and x != "" for x in file_paths]
+    ):
+        raise TypeError("file_paths must be a list of not null strings")
+
+    for name, value in [
+        ("parse_workers", parse_workers),
+        ("embedding_concurrency", embedding_concurrency),
+    ]:
+        if not isinstance(value, int) or value < 1:
+            raise ValueError(f"{name} must be an integer greater or equal than 1")
+
+    state = load_state(state_file)
+
+    pending_files = [
+        file_path
+        for file_path in dict.fromkeys(file_paths)
+        if state.get(file_path, {}).get("status") != "indexed"
+    ]
+
+    skipped = len(set(file_paths)) - len(pending_files)
+    if skipped > 0:
+        logger.info(f"{skipped} files were already indexed by a previous run")
+
+    def update_state(file_path: str, status: str, **info) -> None:
+        state[file_path] = {
+            "status": status,
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            **info,
+        }
+        save_state(state, state_file)
+
+    # Each file in the pipeline is either being parsed or being indexed, at most
+    # max_in_flight parsed texts are held in memory
+    max_in_flight = parse_workers + embedding_concurrency
+    files_to_parse = iter(pending_files)
+    running: dict[Future, tuple[str, str]] = dict()
+    completed = 0
+
+    # The processes are spawned, so they don't inherit the threads of the embedding pool
+    with (
+        ProcessPoolExecutor(
+            max_workers=parse_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as parse_pool,
+        ThreadPoolExecutor(max_workers=embedding_concurrency) as index_pool,
+    ):
+
+        def submit_next_parse() -> None:
+            file_path = next(files_to_parse, None)
+
+            if file_path is not None:
+                running[parse_pool.submit(parse_file, file_path)] = (
+                    "parsing",
+                    file_path,
+                )
+
+        for _ in range(max_in_flight):
+            submit_next_parse()
+
+        while len(running) > 0:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                stage, file_path = running.pop(future)
+
+                try:
+                    result = future.result()
+
+                except Exception as e:
+                    completed += 1
+                    logger.error(
+                        f"[{completed}/{len(pending_files)}] {file_path} failed while {stage}: {e}"
+                    )
+                    update_state(file_path, "failed", points=None, error=str(e))
+                    submit_next_parse()
+                    continue
+
+                if stage == "parsing":
+                    update_state(file_path, "parsed")
+                    index_future = index_pool.submit(
+                        index_file,
+                        file_data=result,
+                        collection_name=collection_name,
+                        embedding_model_name=embedding_model_name,
+                        chunk_overlap=chunk_overlap,
+                        create_db_collection=create_db_collection,
+                    )
+                    running[index_future] = ("indexing", file_path)
+
+                else:
+                    completed += 1
+                    logger.info(
+                        f"[{completed}/{len(pending_files)}] {file_path} indexed {result}"
+                    )
+                    update_state(file_path, "indexed", points=result, error=None)
+                    submit_next_parse()
+
+    statuses = [state[file_path]["status"] for file_path in pending_files]
+    logger.info(
+        f"Batch finished: {statuses.count('indexed')} files indexed, "
+        f"{statuses.count('failed')} failed, {skipped} skipped. State saved in {state_file}"
+    )
+
+    return {file_path: state[file_path] for file_path in file_paths}
+
+
+def main(
+    source: str,
+    collection_name: str,
+    embedding_model_name: str = None,
+    chunk_overlap: int = None,
+    create_db_collection: bool = False,
+    state_file: str = ingestion_config.BATCH_STATE_FILE,
+    parse_workers: int = ingestion_config.PARSE_WORKERS,
+    embedding_concurrency: int = ingestion_config.EMBEDDING_CONCURRENCY,
+) -> dict[str, dict]:
+    """
+    Ingest all the files of a GCS prefix, a local directory or a manifest into a vector DB
+
+    Args:
+        source: str -> GCS prefix, local directory or manifest file, see list_input_files
+        collection_name: str -> Name of the vector db collection where the chunks will be indexed
+        embedding_model_name: str -> Name of the embedding model to use. Must be available in sentence transformers
+        chunk_overlap: int -> Number of tokens that will be overlapped on each chunk
+        create_db_collection: bool -> If the collection does not exists, creates it if create_db_collection == True
+        state_file: str -> JSON file where the status of each file is stored
+        parse_workers: int -> Number of processes parsing files at the same time
+        embedding_concurrency: int -> Max number of files being embedded and indexed at the same time
+
+    Return:
+        dict[str, dict] -> Status of each file
+    """
+    file_paths = list_input_files(source)
+
+    logger.info(f"{len(file_paths)} files found in {source}")
+
+    return ingest_files(
+        file_paths=file_paths,
+        collection_name=collection_name,
+        embedding_model_name=embedding_model_name,
+        chunk_overlap=chunk_overlap,
+        create_db_collection=create_db_collection,
+        state_file=state_file,
+        parse_workers=parse_workers,
+        embedding_concurrency=embedding_concurrency,
+    )
@@ -1,18 +1,425 @@
+from collections import Counter
+from threading import Event, Thread
 from loguru import logger
-import requests
+from typing import Iterable, Iterator
+import queue
+import json
 import sys
 
 sys.path.append("../../..")
 
+from rag_llm_energy_expert.config import QdrantConfig, IngestionConfig
 from rag_llm_energy_expert.credentials import get_gcp_config
-from rag_llm_energy_expert.services.ingestion.parsers.pdf_parser import parse_pdf_file
+from rag_llm_energy_expert.services.ingestion.markdown_sections import (
+    iter_markdown_sections,
+    iter_section_blocks,
+)
+from rag_llm_energy_expert.services.ingestion.parsers.pdf_parser import (
+    parse_pdf_file,
+    parse_pdf_pages,
+)
+from rag_llm_energy_expert.utils.embedding_service.client import (
+    get_embedding_service_client,
+)
+from rag_llm_energy_expert.utils.embedding_service.vector_encoding import (
+    decode_vectors,
+)
 from rag_llm_energy_expert.utils.vector_db.qdrant import (
     create_points,
     create_collection,
     update_points,
+    upsert_points,
+    get_document_points_metadata,
+    update_metadata,
+    delete_points,
+    get_client as get_qdrant_client,
 )
 
 gcp_config = get_gcp_config()
+qdrant_config = QdrantConfig()
+ingestion_config = IngestionConfig()
+
+# Parser of each file extension that can be ingested
+ALLOWED_FORMATS = {"pdf": parse_pdf_file}
+# Parser of each file extension that yields the markdown of the pages while they are parsed
+STREAMING_FORMATS = {"pdf": parse_pdf_pages}
+# Seconds the prefetch thread waits for a free slot before checking if the consumer stopped
+PREFETCH_PUT_TIMEOUT = 0.5
+
+
+def decode_chunks(chunks: list[dict], vector_encoding: str) -> list[dict]:
+    """
+    Decode the vectors of the chunks returned by the embedding service into lists of floats,
+    which is the format expected by Qdrant
+
+    Args:
+        chunks: list[dict] -> Chunks returned by the embedding service
+        vector_encoding: str -> Encoding of the vectors returned by the embedding service
+
+    Return:
+        list[dict] -> The same chunks, with the vectors as lists of floats, and the key 'embedding_version'
+                      with the model, backend and precision of the vectors, part of the ids of the points
+    """
+    vectors = decode_vectors([chunk["vector"] for chunk in chunks], vector_encoding)
+
+    # JSON floats and float32 packed vectors are the same vectors, float16 ones lose precision
+    precision = "float16" if vector_encoding == "float16" else "float32"
+
+    for chunk, vector in zip(chunks, vectors):
+        chunk["vector"] = vector.tolist()
+        chunk["embedding_version"] = (
+            f"{chunk.get('embedding_version') or 'unknown'}:{precision}"
+        )
+
+    return chunks
+
+
+def embed_document(
+    file_data: dict,
+    embedding_model_name: str = None,
+    chunk_overlap: int = None,
+) -> list[dict]:
+    """
+    Chunk and embed the text of a document with the embedding service, in a single request
+
+    Args:
+        file_data: dict -> Dictionary returned by the parsers, with the keys "text" and "metadata"
+        embedding_model_name: str -> Name of the embedding model to use. Must be available in sentence transformers
+        chunk_overlap: int -> Number of tokens that will be overlapped on each chunk
+
+    Return:
+        list[dict] -> List of chunks, each one with the keys 'vector_id', 'vector' and 'payload'
+    """
+    logger.info("Generating embeddings...")
+
+    payload = {
+        "text": file_data["text"],
+        "metadata": file_data["metadata"],
+        "chunk_overlap": chunk_overlap,
+        "embedding_model_name": embedding_model_name,
+    }
+
+    try:
+        embeddings_response = get_embedding_service_client().post(
+            gcp_config.EMBED_TEXT_ENDPOINT, payload
+        )
+    except Exception as e:
+        raise ValueError(f"There was an error during the embeddings generation: {e}")
+
+    if embeddings_response.status_code != 200:
+        raise ValueError(
+            "There was an error during the embeddings generation. "
+            f"Status code: {embeddings_response.status_code}. "
+            f"Response: {embeddings_response.text}"
+        )
+
+    # The embed-text endpoint returns a dictionary with the key chunks, which value is a list
+    # of dictionaries
+    logger.info("Embeddings generated")
+    response_data = embeddings_response.json()
+
+    # The vectors can be packed, they are decoded into lists of floats for Qdrant
+    return decode_chunks(
+        response_data["chunks"], response_data.get("vector_encoding", "float")
+    )
+
+
+def stream_document_embeddings(
+    file_data: dict,
+    embedding_model_name: str = None,
+    chunk_overlap: int = None,
+    batch_size: int = qdrant_config.UPSERT_BATCH_SIZE,
+) -> Iterator[list[dict]]:
+    """
+    Chunk and embed the text of a document with the streaming endpoint of the embedding service,
+    yielding the chunks in batches while the service is still embedding the rest of the document
+
+    Args:
+        file_data: dict -> Dictionary returned by the parsers, with the keys "text" and "metadata"
+        embedding_model_name: str -> Name of the embedding model to use. Must be available in sentence transformers
+        chunk_overlap: int -> Number of tokens that will be overlapped on each chunk
+        batch_size: int -> Number of chunks yielded at a time
+
+    Return:
+        Iterator[list[dict]] -> Batches of chunks, each one with the keys 'vector_id', 'vector' and 'payload'
+    """
+    logger.info("Generating embeddings (streaming)...")
+
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise ValueError("batch_size must be an integer greater or equal than 1")
+
+    payload = {
+        "text": file_data["text"],
+        "metadata": file_data["metadata"],
+        "chunk_overlap": chunk_overlap,
+        "embedding_model_name": embedding_model_name,
+    }
+
+    try:
+        embeddings_response = get_embedding_service_client().post(
+            gcp_config.EMBED_TEXT_STREAM_ENDPOINT, payload, stream=True
+        )
+    except Exception as e:
+        raise ValueError(f"There was an error during the embeddings generation: {e}")
+
+    try:
+        if embeddings_response.status_code != 200:
+            embeddings_response.read()
+            raise ValueError(
+                "There was an error during the embeddings generation. "
+                f"Status code: {embeddings_response.status_code}. "
+                f"Response: {embeddings_response.text}"
+            )
+
+        vector_encoding = embeddings_response.headers.get("X-Vector-Encoding", "float")
+
+        chunks = list()
+
+        # Each line of the response is a chunk, or an error if the service failed after
+        # the stream started
+        for line in embeddings_response.iter_lines():
+            if not line:
+                continue
+
+            chunk = json.loads(line)
+
+            if "error" in chunk:
+                raise ValueError(
+                    f"There was an error during the embeddings generation: {chunk['error']}"
+                )
+
+            chunks.append(chunk)
+
+            if len(chunks) == batch_size:
+                yield decode_chunks(chunks, vector_encoding)
+                chunks = list()
+
+        if len(chunks) > 0:
+            yield decode_chunks(chunks, vector_encoding)
+
+    finally:
+        # Give the connection back to the pool of the client
+        embeddings_response.close()
+
+    logger.info("Embeddings generated")
+
+
+def prefetch(items: Iterable, size: int) -> Iterator:
+    """
+    Consume an iterable in a background thread, keeping up to size items ready, so the items are
+    produced (ex. pages parsed) while the previous ones are being processed. If the consumer stops
+    early (an exception, a break or close()), the thread stops after the item it is producing and
+    closes the iterable, so its resources (ex. the pdf and its temporary file) are released
+
+    Args:
+        items: Iterable -> Items to prefetch
+        size: int -> Max number of items produced ahead
+
+    Return:
+        Iterator -> The same items, in the same order
+    """
+    buffer = queue.Queue(maxsize=size)
+    stop = Event()
+    end = object()
+
+    def put(entry: tuple) -> bool:
+        # Wait for a free slot in the buffer, returns False if the consumer stopped
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=PREFETCH_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((end, e))
+            return
+        finally:
+            # A generator can only be closed from the thread that runs it
+            if hasattr(items, "close"):
+                items.close()
+
+        put((end, None))
+
+    producer = Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item, error = buffer.get()
+
+            if error is not None:
+                raise error
+
+            if item is end:
+                return
+
+            yield item
+
+    finally:
+        stop.set()
+        producer.join()
+
+
+def stream_pages_embeddings(
+    pages: Iterable[str],
+    metadata: dict,
+    embedding_model_name: str = None,
+    chunk_overlap: int = None,
+    block_chars: int = ingestion_config.STREAM_BLOCK_CHARS,
+) -> Iterator[list[dict]]:
+    """
+    Chunk and embed a document while its pages are being parsed. The markdown of the pages is regrouped
+    into blocks of whole sections, and each block is sent to the streaming endpoint of the embedding service,
+    so only a few blocks of the document are in memory at a time.
+
+    Args:
+        pages: Iterable[str] -> Markdown of the pages, in order
+        metadata: dict -> Metadata of the document, inserted in each chunk
+        embedding_model_name: str -> Name of the embedding model to use. Must be available in sentence transformers
+        chunk_overlap: int -> Number of tokens that will be overlapped on each chunk
+        block_chars: int -> Max number of characters of each block sent to the embedding service
+
+    Return:
+        Iterator[list[dict]] -> Batches of chunks, each one with the keys 'vector_id', 'vector' and 'payload'
+    """
+    blocks = iter_section_blocks(
+        iter_markdown_sections(pages, max_section_chars=block_chars),
+        max_block_chars=block_chars,
+    )
+
+    # The next blocks are parsed while the current one is embedded and indexed
+    prefetched_blocks = prefetch(blocks, size=ingestion_config.STREAM_PREFETCH_BLOCKS)
+
+    try:
+        for block in prefetched_blocks:
+            yield from stream_document_embeddings(
+                file_data={"text": block, "metadata": metadata},
+                embedding_model_name=embedding_model_name,
+                chunk_overlap=chunk_overlap,
+            )
+
+    finally:
+        # Stop the parsing thread if the consumer stopped early
+        prefetched_blocks.close()
+
+
+def index_document(
+    chunks: list[dict],
+    collection_name: str,
+    create_db_collection: bool = False,
+) -> dict[str, int]:
+    """
+    Index all the chunks of a document into the vector DB, replacing the previous version of the document.
+    Only the chunks that changed are written.
+
+    Args:
+        chunks: list[dict] -> Chunks returned by the embedding service
+        collection_name: str -> Name of the vector db collection where the chunks will be indexed
+        create_db_collection: bool -> If the collection does not exists, creates it if create_db_collection == True
+
+    Return:
+        dict[str, int] -> Number of points 'added', 'updated', 'unchanged' and 'deleted'
+    """
+    # Prepare chunks to be indexed in the Qdrant vector DB
+    qdrant_points = create_points(chunks=chunks)
+
+    # Create the vector DB collection if needed
+    if create_db_collection:
+        create_collection(
+            collection_name=collection_name, vector_size=len(chunks[0]["vector"])
+        )
+
+    # Upload the new qdrant points into the qdrant collection and delete the removed ones
+    return update_points(collection_name=collection_name, points=qdrant_points)
+
+
+def index_document_stream(
+    chunks_batches: Iterator[list[dict]],
+    collection_name: str,
+    document_title: str,
+    create_db_collection: bool = False,
+) -> dict[str, int]:
+    """
+    Index the batches of chunks of a document into the vector DB as they are received.
+    Only the chunks that are not already in the collection are upserted, and the points of the
+    previous version of the document that are no longer part of it are deleted once all the
+    batches were indexed, so the document is always available for search.
+
+    Args:
+        chunks_batches: Iterator[list[dict]] -> Batches of chunks returned by stream_document_embeddings
+        collection_name: str -> Name of the vector db collection where the chunks will be indexed
+        document_title: str -> Title of the document, used to find the points of its previous version
+        create_db_collection: bool -> If the collection does not exists, creates it if create_db_collection == True
+
+    Return:
+        dict[str, int] -> Number of points 'added', 'updated' (only their metadata), 'unchanged' and 'deleted'
+    """
+    counts = {"added": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    occurrences = Counter()
+    document_ids = set()
+
+    # The points of the previous version are loaded before the first batch, so they are deleted
+    # even if the document doesn't produce any chunk now. A collection that is created with the
+    # first batch has no previous points
+    if create_db_collection and not get_qdrant_client().collection_exists(
+        collection_name
+    ):
+        existing_metadata = dict()
+    else:
+        existing_metadata = get_document_points_metadata(
+            collection_name, document_title
+        )
+
+    collection_ready = not create_db_collection
+
+    try:
+        for chunks in chunks_batches:
+            qdrant_points = create_points(chunks=chunks, occurrences=occurrences)
+
+            if not collection_ready:
+                create_collection(
+                    collection_name=collection_name,
+                    vector_size=len(chunks[0]["vector"]),
+                )
+                collection_ready = True
+
+            document_ids.update(str(point.id) for point in qdrant_points)
+            new_points = [
+                point
+                for point in qdrant_points
+                if str(point.id) not in existing_metadata
+            ]
+
+            if len(new_points) > 0:
+                upsert_points(collection_name=collection_name, points=new_points)
+
+            # The chunks already indexed keep their vectors, only their metadata is updated
+            updated = update_metadata(collection_name, qdrant_points, existing_metadata)
+
+            counts["added"] += len(new_points)
+            counts["updated"] += updated
+            counts["unchanged"] += len(qdrant_points) - len(new_points) - updated
+
+    finally:
+        # Stop the parsing and the embedding of the document if the indexing failed
+        if hasattr(chunks_batches, "close"):
+            chunks_batches.close()
+
+    removed_ids = list(existing_metadata.keys() - document_ids)
+    delete_points(collection_name=collection_name, point_ids=removed_ids)
+    counts["deleted"] = len(removed_ids)
+
+    logger.info(f"Document indexed in the collection {collection_name}: {counts}")
+
+    return counts
 
 
 def main(
@@ -21,6 +428,7 @@ def main(
     embedding_model_name: str = None,
     chunk_overlap: int = None,
     create_db_collection: bool = False,
+    stream_embeddings: bool = True,
 ) -> None:
     """
     Ingest a PDF into a vector DB
@@ -32,71 +440,58 @@ def main(
         chunk_overlap: int -> Number of tokens that will be overlapped on each chunk
         collection_name: str -> Name of the vector db collection where the chunks will be indexed
         create_collection: bool -> If the collection does not exists, creates it if create_collection == True
+        stream_embeddings: bool -> If True, the pages are parsed, embedded and upserted incrementally,
+                                    instead of waiting for the whole document on each step
 
     Return:
         None
     """
     logger.info("Parsing file...")
-    allowed_formats = {"pdf": parse_pdf_file}
 
     if not isinstance(file_path, str) or file_path == "":
         raise ValueError("file_path must be a not null string")
 
     extension = file_path.split(".")[-1]
 
-    if extension not in allowed_formats:
+    if extension not in ALLOWED_FORMATS:
         raise ValueError(
-            f"The file is in the format {extension}, which cannot be processed. Current allowed formats are: {', '.join(allowed_formats.keys())}"
+            f"The file is in the format {extension}, which cannot be processed. Current allowed formats are: {', '.join(ALLOWED_FORMATS.keys())}"
         )
 
-    # Step 1: Extract the data and save it into a dictionary
-    file_data = allowed_formats[extension](file_path)
-
-    # Step 2: Generate embeddings from the PDF text
-    logger.info("Generating embeddings...")
+    if stream_embeddings:
+        # Step 1, 2 and 3: Parse the pages, and embed and index them while the next ones are parsed
+        file_data = STREAMING_FORMATS[extension](file_path)
 
-    headers = {
-        "Authorization": f"Bearer {gcp_config.EMBEDDING_SERVICE_IDTOKEN.get_secret_value()}"
-    }
-
-    payload = {
-        "text": file_data["text"],
-        "metadata": file_data["metadata"],
-        "chunk_overlap": chunk_overlap,
-        "embedding_model_name": embedding_model_name,
-    }
-
-    embed_text_url = gcp_config.EMBEDDING_SERVICE_URL + gcp_config.EMBED_TEXT_ENDPOINT
-
-    try:
-        embeddings_response = requests.post(
-            url=embed_text_url, json=payload, headers=headers
+        chunks_batches = stream_pages_embeddings(
+            pages=file_data["pages"],
+            metadata=file_data["metadata"],
+            embedding_model_name=embedding_model_name,
+            chunk_overlap=chunk_overlap,
         )
-    except Exception as e:
-        raise ValueError(f"There was an error during the embeddings generation: {e}")
-
-    if embeddings_response.status_code != 200:
-        raise ValueError(
-            "There was an error during the embeddings generation. "
-            f"Status code: {embeddings_response.status_code}. "
-            f"Response: {embeddings_response.text}"
+        index_document_stream(
+            chunks_batches=chunks_batches,
+            collection_name=collection_name,
+            document_title=file_data["metadata"]["title"],
+            create_db_collection=create_db_collection,
         )
-    else:
-        # The embed-text endpoint returns a dictionary with the key chunks, which value is a list
-        # of dictionaries
-        logger.info("Embeddings generated")
-        chunks = embeddings_response.json()["chunks"]
-        vector_dimension = len(chunks[0]["vector"])
+        return
 
-    # Step 3: Prepare chunks to be indexed in the Qdrant vector DB
-    qdrant_points = create_points(chunks=chunks)
+    # Step 1: Extract the data and save it into a dictionary
+    file_data = ALLOWED_FORMATS[extension](file_path)
 
-    # Step 4: Create the vector DB collection if needed
-    if create_db_collection:
-        create_collection(collection_name=collection_name, vector_size=vector_dimension)
+    # Step 2: Generate embeddings from the PDF text
+    chunks = embed_document(
+        file_data=file_data,
+        embedding_model_name=embedding_model_name,
+        chunk_overlap=chunk_overlap,
+    )
 
-    # Step 5: Upload the qdrant points into the qdrant collection
-    update_points(collection_name=collection_name, points=qdrant_points)
+    # Step 3: Index the chunks into the vector DB
+    index_document(
+        chunks=chunks,
+        collection_name=collection_name,
+        create_db_collection=create_db_collection,
+    )
 
 
 if __name__ == "__main__":
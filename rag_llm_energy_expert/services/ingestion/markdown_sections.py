@@ -0,0 +1,111 @@
+from typing import Iterable, Iterator
+import re
+
+# Headers used by the embedding service to split the text (its HEADERS_TO_SPLIT_ON). Cutting the
+# text before these headers keeps the chunks the same as sending the whole document, except for
+# the sections longer than max_section_chars (see iter_markdown_sections)
+SECTION_HEADER_PATTERN = re.compile(r"^\s*#{2,6}(\s|$)")
+CODE_FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+
+
+def iter_markdown_sections(
+    pages: Iterable[str], max_section_chars: int
+) -> Iterator[str]:
+    """
+    Regroup the markdown of consecutive pages into sections, each one starting at a header
+    (## to ######). The headers inside code blocks are ignored, as the markdown splitter does.
+    A section longer than max_section_chars is cut at its last blank line, so a document
+    without headers is still yielded in parts. The chunks of such a section are not the same as
+    those of the whole document: the cut forces a chunk boundary, the chunks at both sides of it
+    don't overlap, and the continuation doesn't start with the header of the section.
+
+    Args:
+        pages: Iterable[str] -> Markdown of each page (or range of pages), in order
+        max_section_chars: int -> Max number of characters held before yielding a section
+
+    Return:
+        Iterator[str] -> Markdown of each section
+    """
+    if not isinstance(max_section_chars, int) or max_section_chars < 1:
+        raise ValueError("max_section_chars must be an integer greater or equal than 1")
+
+    section_lines = list()
+    section_chars = 0
+    in_code_block = False
+    # Last line of a page that does not end with a line break, completed by the next page
+    partial_line = ""
+
+    def lines_of(pages: Iterable[str]) -> Iterator[str]:
+        nonlocal partial_line
+
+        for page in pages:
+            lines = (partial_line + page).split("\n")
+            partial_line = lines.pop()
+
+            yield from lines
+
+        if partial_line != "":
+            yield partial_line
+
+    for line in lines_of(pages):
+        if CODE_FENCE_PATTERN.match(line):
+            in_code_block = not in_code_block
+
+        elif (
+            not in_code_block
+            and SECTION_HEADER_PATTERN.match(line)
+            and section_chars > 0
+        ):
+            yield "\n".join(section_lines)
+            section_lines = list()
+            section_chars = 0
+
+        section_lines.append(line)
+        section_chars += len(line) + 1
+
+        if section_chars > max_section_chars:
+            # Cut at the last blank line, or at the current line if there is none
+            blank_lines = [
+                position
+                for position, section_line in enumerate(section_lines)
+                if section_line.strip() == ""
+            ]
+            cut = blank_lines[-1] if len(blank_lines) > 0 else len(section_lines) - 1
+
+            yield "\n".join(section_lines[: cut + 1])
+            section_lines = section_lines[cut + 1 :]
+            section_chars = sum(len(section_line) + 1 for section_line in section_lines)
+
+    if any(section_line.strip() != "" for section_line in section_lines):
+        yield "\n".join(section_lines)
+
+
+def iter_section_blocks(sections: Iterable[str], max_block_chars: int) -> Iterator[str]:
+    """
+    Group consecutive sections into blocks of up to max_block_chars characters, so each request
+    to the embedding service carries several sections
+
+    Args:
+        sections: Iterable[str] -> Markdown sections returned by iter_markdown_sections
+        max_block_chars: int -> Max number of characters of a block. A longer section is yielded alone
+
+    Return:
+        Iterator[str] -> Markdown of each block
+    """
+    if not isinstance(max_block_chars, int) or max_block_chars < 1:
+        raise ValueError("max_block_chars must be an integer greater or equal than 1")
+
+    block = list()
+    block_chars = 0
+
+    for section in sections:
+        if len(block) > 0 and block_chars + len(section) + 1 > max_block_chars:
+            yield "\n".join(block)
+            block = list()
+            block_chars = 0
+
+        block.append(section)
+        block_chars += len(section) + 1
+
+    if len(block) > 0:
+        yield "\n".join(block)
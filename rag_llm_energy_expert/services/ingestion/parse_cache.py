@@ -0,0 +1,196 @@
+from typing import Iterable, Iterator, Optional
+from loguru import logger
+import tempfile
+import hashlib
+import gzip
+import json
+import os
+import sys
+
+sys.path.append("../../..")
+
+from rag_llm_energy_expert.config import IngestionConfig
+from rag_llm_energy_expert.utils.gcp.gcs import (
+    get_client as get_gcs_client,
+    get_file_checksum,
+    upload_file,
+)
+
+ingestion_config = IngestionConfig()
+
+
+def split_gcs_path(gcs_path: str) -> tuple[str, str]:
+    # 'gs://bucket_name/path/to/file' -> ('bucket_name', 'path/to/file')
+    path_parts = gcs_path[5:].split("/", maxsplit=1)
+
+    return path_parts[0], path_parts[1] if len(path_parts) > 1 else ""
+
+
+def file_checksum(file_path: str) -> str:
+    """
+    Get the checksum of the content of a file. For GCS files, the checksum computed by GCS is used,
+    so the file is not downloaded
+
+    Args:
+        file_path: str -> Either a gcs path (ex: 'gs://bucket_name/folder_name/pdf_name.pdf') or a local path
+
+    Return:
+        str -> Checksum prefixed by its algorithm. Ex: "sha256:9f86d08..."
+    """
+    if file_path.startswith("gs://"):
+        bucket_name, blob_name = split_gcs_path(file_path)
+
+        return get_file_checksum(gcs_file_path=blob_name, bucket_name=bucket_name)
+
+    if not os.path.isfile(file_path):
+        raise ValueError(f"The file {file_path} does not exists")
+
+    file_hash = hashlib.sha256()
+
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            file_hash.update(block)
+
+    return f"sha256:{file_hash.hexdigest()}"
+
+
+def cache_key(file_path: str, parser_version: str) -> str:
+    """
+    Key of the parsed document in the cache. It only depends on the content of the file and on the
+    parser version, so a file renamed or moved is not parsed again, and a new parser version
+    invalidates the previous entries
+
+    Args:
+        file_path: str -> Either a gcs path or a local path
+        parser_version: str -> Version of the parser that produces the markdown
+
+    Return:
+        str -> Hex digest identifying the parsed document
+    """
+    return hashlib.sha256(
+        f"{file_checksum(file_path)}|{parser_version}".encode("utf-8")
+    ).hexdigest()
+
+
+def entry_path(key: str) -> str:
+    # Path of the cache entry, either local or in GCS
+    return f"{ingestion_config.PARSE_CACHE_LOCATION.rstrip('/')}/{key}.jsonl.gz"
+
+
+def iter_entry_lines(local_path: str, remove: bool = False) -> Iterator[dict]:
+    # Read the entry one line at a time, so the document is never loaded in memory at once
+    try:
+        with gzip.open(local_path, "rt", encoding="utf-8") as entry:
+            for line in entry:
+                yield json.loads(line)
+
+    finally:
+        if remove:
+            os.remove(local_path)
+
+
+def read_pages(key: str) -> Optional[Iterator[str]]:
+    """
+    Get the markdown of a document already parsed
+
+    Args:
+        key: str -> Key returned by cache_key
+
+    Return:
+        Optional[Iterator[str]] -> Markdown of each range of pages, in order. None if the
+                                    document is not in the cache
+    """
+    path = entry_path(key)
+
+    if path.startswith("gs://"):
+        bucket_name, blob_name = split_gcs_path(path)
+        blob = get_gcs_client().bucket(bucket_name).get_blob(blob_name)
+
+        if blob is None:
+            return None
+
+        file_descriptor, local_path = tempfile.mkstemp(suffix=".jsonl.gz")
+        os.close(file_descriptor)
+        blob.download_to_filename(local_path)
+        lines = iter_entry_lines(local_path, remove=True)
+
+    elif os.path.isfile(path):
+        lines = iter_entry_lines(path)
+
+    else:
+        return None
+
+    header = next(lines)
+    logger.info(
+        f"Parsed document found in the cache ({header['parser_version']}, {header['page_count']} pages)"
+    )
+
+    return (line["markdown"] for line in lines)
+
+
+def write_pages(
+    key: str,
+    pages: Iterable[str],
+    page_ranges: list[list[int]],
+    parser_version: str,
+) -> Iterator[str]:
+    """
+    Store the markdown of a document in the cache while it is consumed. The entry is only saved
+    once all the pages were consumed, so an interrupted parse never leaves a partial entry
+
+    Args:
+        key: str -> Key returned by cache_key
+        pages: Iterable[str] -> Markdown of each range of pages, in order
+        page_ranges: list[list[int]] -> Pages of each element of pages, stored as the page mapping of the entry
+        parser_version: str -> Version of the parser that produced the markdown
+
+    Return:
+        Iterator[str] -> The same markdown of pages
+    """
+    path = entry_path(key)
+
+    if path.startswith("gs://"):
+        temp_dir = None
+    else:
+        temp_dir = os.path.dirname(path)
+        os.makedirs(temp_dir, exist_ok=True)
+
+    # Written next to the final path, so os.replace is atomic
+    file_descriptor, local_path = tempfile.mkstemp(suffix=".jsonl.gz", dir=temp_dir)
+    os.close(file_descriptor)
+
+    try:
+        with gzip.open(local_path, "wt", encoding="utf-8") as entry:
+            header = {
+                "parser_version": parser_version,
+                "page_count": sum(len(page_range) for page_range in page_ranges),
+            }
+            entry.write(json.dumps(header) + "\n")
+
+            for page_range, markdown in zip(page_ranges, pages, strict=True):
+                entry.write(
+                    json.dumps({"pages": page_range, "markdown": markdown}) + "\n"
+                )
+
+                yield markdown
+
+        # The document is already parsed, failing to cache it must not fail the ingestion
+        try:
+            if path.startswith("gs://"):
+                bucket_name, blob_name = split_gcs_path(path)
+                upload_file(
+                    origin_file_path=local_path,
+                    bucket_name=bucket_name,
+                    destination_file_path=blob_name,
+                )
+            else:
+                os.replace(local_path, path)
+
+            logger.info(f"Parsed document stored in the cache as {path}")
+
+        except Exception as e:
+            logger.warning(f"The parsed document could not be cached: {e}")
+
+    finally:
+        if os.path.isfile(local_path):
+            os.remove(local_path)
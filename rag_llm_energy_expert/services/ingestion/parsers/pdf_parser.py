@@ -1,32 +1,158 @@
 import pymupdf
 import pymupdf4llm
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from collections import deque
 from datetime import datetime
+from itertools import islice
 from loguru import logger
-from typing import Union
+from typing import Iterator, Union
+import multiprocessing
 import os
 
 import sys
 
 sys.path.append("../../../..")
 
-from rag_llm_energy_expert.utils.gcp.gcs import get_file
+from rag_llm_energy_expert.config import IngestionConfig
+from rag_llm_energy_expert.services.ingestion import parse_cache
+from rag_llm_energy_expert.utils.gcp.gcs import download_to_temp_file
 
+ingestion_config = IngestionConfig()
 
-def parse_pdf_file(
-    pdf_path: str,
-) -> dict[str, Union[str | dict]]:
+# Part of the key of the parse cache, must change whenever the markdown produced for the same PDF changes
+PARSER_VERSION = f"pymupdf4llm-{pymupdf4llm.version}"
+
+# Document opened once by each process of the page pool
+worker_document: pymupdf.Document = None
+
+
+def open_worker_document(pdf_file_path: str) -> None:
+    # Initializer of the processes of the page pool
+    global worker_document
+
+    worker_document = pymupdf.Document(pdf_file_path)
+
+
+def pages_to_markdown(pages: list[int], hdr_info: pymupdf4llm.IdentifyHeaders) -> str:
+    # Runs in the processes of the page pool
+    return pymupdf4llm.to_markdown(worker_document, pages=pages, hdr_info=hdr_info)
+
+
+def page_ranges(page_count: int) -> list[list[int]]:
+    # Consecutive pages converted together, PDF_PAGES_PER_TASK at a time
+    pages_per_task = ingestion_config.PDF_PAGES_PER_TASK
+
+    return [
+        list(range(start, min(start + pages_per_task, page_count)))
+        for start in range(0, page_count, pages_per_task)
+    ]
+
+
+def iter_pdf_markdown(
+    pdf_document: pymupdf.Document,
+    pdf_file_path: str,
+    workers: int = ingestion_config.PDF_PAGE_WORKERS,
+) -> Iterator[str]:
     """
-    Parse a pdf that is stored in Google Cloud Storage (GCS) or in the local
+    Convert a PDF to markdown a few pages at a time, yielding the markdown of each range of pages
+    in order. With several workers, the ranges are converted by a pool of processes, keeping at most
+    two ranges per process in flight, so the markdown of the whole document is never held in memory.
+    The header levels are computed once over the whole document and shared by all the ranges, so the
+    concatenation of the ranges is identical to converting the whole document at once.
+
+    Args:
+        pdf_document: pymupdf.Document -> Document already opened
+        pdf_file_path: str -> Local path of the PDF, used by the processes to open it
+        workers: int -> Number of processes. With 1 process, or with less than PDF_PARALLEL_MIN_PAGES pages,
+                        the pages are converted in the current process
+
+    Return:
+        Iterator[str] -> Markdown of each range of pages
+    """
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError("workers must be an integer greater or equal than 1")
+
+    page_count = pdf_document.page_count
+
+    # Computed from all the pages, as to_markdown does when hdr_info is not provided
+    hdr_info = pymupdf4llm.IdentifyHeaders(pdf_document)
+
+    pages_ranges = page_ranges(page_count)
+
+    if workers == 1 or page_count < ingestion_config.PDF_PARALLEL_MIN_PAGES:
+        for pages in pages_ranges:
+            yield pymupdf4llm.to_markdown(pdf_document, pages=pages, hdr_info=hdr_info)
+        return
+
+    workers = min(workers, len(pages_ranges))
+    logger.info(f"Converting {page_count} pages to markdown in {workers} processes...")
+
+    # The processes are spawned, so they don't inherit the threads of the caller
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=open_worker_document,
+        initargs=(pdf_file_path,),
+    ) as executor:
+        remaining_ranges = iter(pages_ranges)
+        in_flight = deque(
+            executor.submit(pages_to_markdown, pages, hdr_info)
+            for pages in islice(remaining_ranges, 2 * workers)
+        )
+
+        while len(in_flight) > 0:
+            pages_markdown = in_flight.popleft().result()
+
+            next_pages = next(remaining_ranges, None)
+            if next_pages is not None:
+                in_flight.append(
+                    executor.submit(pages_to_markdown, next_pages, hdr_info)
+                )
+
+            yield pages_markdown
+
+
+def pdf_to_markdown(
+    pdf_document: pymupdf.Document,
+    pdf_file_path: str,
+    workers: int = ingestion_config.PDF_PAGE_WORKERS,
+) -> str:
+    """
+    Convert a PDF to markdown, converting its pages in parallel when the document is big enough (see iter_pdf_markdown)
+
+    Args:
+        pdf_document: pymupdf.Document -> Document already opened
+        pdf_file_path: str -> Local path of the PDF, used by the processes to open it
+        workers: int -> Number of processes converting the pages at the same time
+
+    Return:
+        str -> Markdown text of the PDF
+    """
+    if (
+        workers == 1
+        or pdf_document.page_count < ingestion_config.PDF_PARALLEL_MIN_PAGES
+    ):
+        return pymupdf4llm.to_markdown(pdf_document)
+
+    return "".join(iter_pdf_markdown(pdf_document, pdf_file_path, workers=workers))
+
+
+@contextmanager
+def open_pdf_file(pdf_path: str) -> Iterator[tuple[pymupdf.Document, str]]:
+    """
+    Open a pdf that is stored in Google Cloud Storage (GCS) or in the local. A pdf stored in GCS is
+    streamed into a temporary file, removed when the context exits, instead of being downloaded in
+    memory: PyMuPDF reads the pages it needs from the file, and the processes of the page pool open
+    the same file instead of receiving a copy of the bytes
 
     Args:
         pdf_path: str -> Either a gcs path: (ex: 'gs://bucket_name/folder_name/pdf_name.pdf') or
                         a local path (can be a relative path or a full path ex: 'local_folder/pdf_file.pdf' or 'C:Users/folder/pdf_file.pdf')
 
     Return:
-        file_data: Union[str | dict] -> Dictionary with all the text parsed and metadata, it has the format:
-                                            {"text": "string with all the PDF text", "metadata": {"key": "value"}}
+        Iterator[tuple[pymupdf.Document, str]] -> Document opened, and its local path, used by the processes to open it again
     """
-    logger.info("Extracting PDF content...")
     # Datatype Check
     if not isinstance(pdf_path, str):
         raise ValueError(
@@ -59,34 +185,143 @@ def parse_pdf_file(
                 f" use the following format: 'gs://bucket_name/path/to/file.pdf'. {e}"
             )
 
-        # Download in memory the pdf from GCS
-        pdf_bytes = get_file(gcs_file_path=blob_name, bucket_name=bucket_name)
+        # Download the pdf from GCS into a temporary file
+        pdf_file_path = download_to_temp_file(
+            gcs_file_path=blob_name, bucket_name=bucket_name, suffix=".pdf"
+        )
 
-        # Load the PDF content into a Document object, each entry of the Document is a page
-        pdf_document = pymupdf.Document(stream=pdf_bytes)
+        try:
+            # The document is closed before removing its file
+            with pymupdf.Document(pdf_file_path) as pdf_document:
+                yield pdf_document, pdf_file_path
+
+        finally:
+            os.remove(pdf_file_path)
+
+        return
 
     # If the path seems to be a local path
-    else:
-        logger.info("Local path detected")
-        if not os.path.isfile(pdf_path):
-            raise ValueError(f"The file {pdf_path} does not exists")
+    logger.info("Local path detected")
+    if not os.path.isfile(pdf_path):
+        raise ValueError(f"The file {pdf_path} does not exists")
+
+    # load the pdf into a Document object, each entry of the Document is a page
+    with pymupdf.Document(pdf_path) as pdf_document:
+        yield pdf_document, pdf_path
 
-        # load the pdf into a Document object, each entry of the Document is a page
-        pdf_document = pymupdf.Document(pdf_path)
 
-    file_title = pdf_path.split("/")[-1].split(".")[0]
+def iter_pdf_file_markdown(
+    pdf_path: str,
+    workers: int = ingestion_config.PDF_PAGE_WORKERS,
+) -> Iterator[str]:
+    # The pdf is opened when the first range of pages is requested, and closed after the last one
+    with open_pdf_file(pdf_path) as (pdf_document, pdf_file_path):
+        yield from iter_pdf_markdown(pdf_document, pdf_file_path, workers=workers)
 
-    pdf_text = pymupdf4llm.to_markdown(pdf_document)
 
-    file_data = {
-        "text": pdf_text,
-        "metadata": {
-            "title": file_title,
-            "storage_path": pdf_path,
-            "upload_date": datetime.now().strftime(r"%Y-%m-%d"),
-        },
+def pdf_metadata(pdf_path: str) -> dict[str, str]:
+    # Metadata stored with each chunk of the pdf
+    return {
+        "title": pdf_path.split("/")[-1].split(".")[0],
+        "storage_path": pdf_path,
+        "upload_date": datetime.now().strftime(r"%Y-%m-%d"),
     }
 
+
+def cached_pdf_markdown(
+    pdf_path: str,
+    workers: int = ingestion_config.PDF_PAGE_WORKERS,
+) -> Iterator[str]:
+    """
+    Get the markdown of a pdf from the parse cache, keyed by the checksum of the file and PARSER_VERSION.
+    If the pdf was not parsed before, it is parsed page by page and stored in the cache while it is consumed
+
+    Args:
+        pdf_path: str -> Either a gcs path: (ex: 'gs://bucket_name/folder_name/pdf_name.pdf') or
+                        a local path (can be a relative path or a full path ex: 'local_folder/pdf_file.pdf' or 'C:Users/folder/pdf_file.pdf')
+        workers: int -> Number of processes converting the pages of the PDF to markdown at the same time
+
+    Return:
+        Iterator[str] -> Markdown of each range of pages
+    """
+    key = parse_cache.cache_key(pdf_path, PARSER_VERSION)
+
+    cached_pages = parse_cache.read_pages(key)
+
+    if cached_pages is not None:
+        return cached_pages
+
+    def parse_and_cache() -> Iterator[str]:
+        with open_pdf_file(pdf_path) as (pdf_document, pdf_file_path):
+            yield from parse_cache.write_pages(
+                key=key,
+                pages=iter_pdf_markdown(pdf_document, pdf_file_path, workers=workers),
+                page_ranges=page_ranges(pdf_document.page_count),
+                parser_version=PARSER_VERSION,
+            )
+
+    return parse_and_cache()
+
+
+def parse_pdf_file(
+    pdf_path: str,
+    workers: int = ingestion_config.PDF_PAGE_WORKERS,
+    use_cache: bool = ingestion_config.PARSE_CACHE_ENABLED,
+) -> dict[str, Union[str | dict]]:
+    """
+    Parse a pdf that is stored in Google Cloud Storage (GCS) or in the local
+
+    Args:
+        pdf_path: str -> Either a gcs path: (ex: 'gs://bucket_name/folder_name/pdf_name.pdf') or
+                        a local path (can be a relative path or a full path ex: 'local_folder/pdf_file.pdf' or 'C:Users/folder/pdf_file.pdf')
+        workers: int -> Number of processes converting the pages of the PDF to markdown at the same time
+        use_cache: bool -> If True, the markdown is read from (or stored in) the parse cache
+
+    Return:
+        file_data: Union[str | dict] -> Dictionary with all the text parsed and metadata, it has the format:
+                                            {"text": "string with all the PDF text", "metadata": {"key": "value"}}
+    """
+    logger.info("Extracting PDF content...")
+
+    if use_cache:
+        text = "".join(cached_pdf_markdown(pdf_path, workers=workers))
+
+    else:
+        with open_pdf_file(pdf_path) as (pdf_document, pdf_file_path):
+            text = pdf_to_markdown(pdf_document, pdf_file_path, workers=workers)
+
+    file_data = {"text": text, "metadata": pdf_metadata(pdf_path)}
+
     logger.info("PDF content successfully extracted")
 
     return file_data
+
+
+def parse_pdf_pages(
+    pdf_path: str,
+    workers: int = ingestion_config.PDF_PAGE_WORKERS,
+    use_cache: bool = ingestion_config.PARSE_CACHE_ENABLED,
+) -> dict[str, Union[Iterator[str] | dict]]:
+    """
+    Parse a pdf that is stored in Google Cloud Storage (GCS) or in the local lazily: the pages are
+    converted to markdown while they are consumed, instead of materializing the text of the whole document
+
+    Args:
+        pdf_path: str -> Either a gcs path: (ex: 'gs://bucket_name/folder_name/pdf_name.pdf') or
+                        a local path (can be a relative path or a full path ex: 'local_folder/pdf_file.pdf' or 'C:Users/folder/pdf_file.pdf')
+        workers: int -> Number of processes converting the pages of the PDF to markdown at the same time
+        use_cache: bool -> If True, the markdown is read from (or stored in) the parse cache
+
+    Return:
+        file_data: Union[Iterator[str] | dict] -> Dictionary with the markdown of the pages and metadata, it has the format:
+                                                {"pages": iterator of markdown strings, "metadata": {"key": "value"}}
+    """
+    logger.info("Extracting PDF content page by page...")
+
+    if use_cache:
+        pages = cached_pdf_markdown(pdf_path, workers=workers)
+
+    else:
+        pages = iter_pdf_file_markdown(pdf_path, workers=workers)
+
+    return {"pages": pages, "metadata": pdf_metadata(pdf_path)}
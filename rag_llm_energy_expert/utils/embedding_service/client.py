@@ -0,0 +1,332 @@
+from importlib.util import find_spec
+from threading import Lock
+from typing import Union
+from loguru import logger
+import asyncio
+import random
+import httpx
+import time
+import sys
+
+sys.path.append("../../..")
+
+from rag_llm_energy_expert.config import GCPConfig
+from rag_llm_energy_expert.credentials import get_embedding_service_token
+from rag_llm_energy_expert.utils.embedding_service.vector_encoding import (
+    get_accept_header,
+)
+from rag_llm_energy_expert.utils.lazy_init import lazy_singleton
+
+gcp_config = GCPConfig()
+
+# Responses of Cloud Run while an instance starts or when it is overloaded, worth retrying
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+# HTTP/2 needs the h2 package (httpx[http2]), without it the clients use HTTP/1.1
+HTTP2_AVAILABLE = find_spec("h2") is not None
+
+
+class CircuitOpenError(ValueError):
+    """
+    Raised without sending the request when the embedding service failed several times in a row
+    """
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a service after failure_threshold consecutive failures, so the callers
+    fail fast instead of waiting for all the retries of every request. After reset_seconds, a single
+    request is let through: if it succeeds the circuit closes again, otherwise it stays open.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        if not isinstance(failure_threshold, int) or failure_threshold < 1:
+            raise ValueError(
+                "failure_threshold must be an integer greater or equal than 1"
+            )
+
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = Lock()
+
+    def before_request(self) -> None:
+        # Raise CircuitOpenError if the request must not be sent
+        with self._lock:
+            if self._opened_at is None:
+                return
+
+            if (
+                time.monotonic() - self._opened_at < self.reset_seconds
+                or self._trial_running
+            ):
+                raise CircuitOpenError(
+                    f"The embedding service failed {self._failures} times in a row, "
+                    f"requests are paused for {self.reset_seconds} seconds"
+                )
+
+            # Half open: this request decides if the circuit closes
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(
+                        f"The embedding service failed {self._failures} times in a row, "
+                        f"pausing the requests for {self.reset_seconds} seconds"
+                    )
+
+                self._opened_at = time.monotonic()
+
+    def state(self) -> str:
+        # "closed", "open" or "half-open"
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                return "open"
+
+            return "half-open"
+
+
+def retry_delay(attempt: int, response: Union[httpx.Response, None]) -> float:
+    """
+    Seconds to wait before retrying a request: exponential backoff with jitter, or the
+    Retry-After header of the response if the service sent one, capped at
+    EMBEDDING_SERVICE_MAX_RETRY_AFTER so a large value doesn't block the caller
+
+    Args:
+        attempt: int -> Number of the attempt that failed, starting at 0
+        response: Union[httpx.Response, None] -> Response of the failed attempt, None if the request
+                                                could not be sent
+
+    Return:
+        float -> Seconds to wait
+    """
+    retry_after = None if response is None else response.headers.get("Retry-After")
+
+    if retry_after is not None and retry_after.isdigit():
+        return min(float(retry_after), gcp_config.EMBEDDING_SERVICE_MAX_RETRY_AFTER)
+
+    return 0.5 * 2**attempt * random.uniform(0.5, 1.5)
+
+
+def request_headers() -> dict[str, str]:
+    # The token is read on each request, the provider refreshes it in the background
+    return {
+        "Authorization": f"Bearer {get_embedding_service_token()}",
+        "Accept": get_accept_header(gcp_config.EMBEDDING_VECTOR_DTYPE),
+    }
+
+
+def client_options() -> dict:
+    # Options shared by the sync and the async clients
+    return {
+        "base_url": gcp_config.EMBEDDING_SERVICE_URL,
+        "http2": gcp_config.EMBEDDING_SERVICE_HTTP2 and HTTP2_AVAILABLE,
+        "timeout": httpx.Timeout(
+            gcp_config.EMBEDDING_SERVICE_TIMEOUT,
+            connect=gcp_config.EMBEDDING_SERVICE_CONNECT_TIMEOUT,
+        ),
+        "limits": httpx.Limits(
+            max_connections=gcp_config.EMBEDDING_SERVICE_MAX_CONNECTIONS,
+            max_keepalive_connections=gcp_config.EMBEDDING_SERVICE_MAX_CONNECTIONS,
+        ),
+    }
+
+
+class EmbeddingServiceClient:
+    """
+    Client of the embedding service shared by the search and the ingestion. The connections are kept
+    alive and reused between requests (with HTTP/2 when available), the requests that fail because of
+    the network or a RETRY_STATUS_CODES response are retried with backoff, and a circuit breaker
+    stops sending requests while the service keeps failing.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = gcp_config.EMBEDDING_SERVICE_MAX_RETRIES,
+        circuit_breaker: CircuitBreaker = None,
+    ):
+        if not isinstance(max_retries, int) or max_retries < 0:
+            raise ValueError("max_retries must be an integer greater or equal than 0")
+
+        self.max_retries = max_retries
+        self.circuit_breaker = circuit_breaker or get_circuit_breaker()
+        self.http_client = httpx.Client(**client_options())
+
+    def post(
+        self, endpoint: str, payload: dict, stream: bool = False
+    ) -> httpx.Response:
+        """
+        Send a POST request to an endpoint of the embedding service, with retries
+
+        Args:
+            endpoint: str -> Endpoint of the service. Ex: "/embed-query"
+            payload: dict -> Body of the request
+            stream: bool -> If True, the body of the response is read while it is received (ex. with
+                            iter_lines), and the response must be closed (with response: ...). Only
+                            the attempts that fail before the body is received are retried
+
+        Return:
+            httpx.Response -> Response of the last attempt. Its status code is not checked, except to retry
+        """
+        self.circuit_breaker.before_request()
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+
+            try:
+                request = self.http_client.build_request(
+                    "POST", endpoint, json=payload, headers=request_headers()
+                )
+                response = self.http_client.send(request, stream=stream)
+
+                if response.status_code < 500 and response.status_code != 429:
+                    self.circuit_breaker.record_success()
+                    return response
+
+                if response.status_code not in RETRY_STATUS_CODES:
+                    # Ex. a 500 of the service: not worth retrying, but it's a failure of the service
+                    self.circuit_breaker.record_failure()
+                    return response
+
+                error = f"status code {response.status_code}"
+
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+
+                if attempt == self.max_retries:
+                    self.circuit_breaker.record_failure()
+                    raise
+
+            except Exception:
+                # Ex. the token could not be generated, don't leave a trial request of the
+                # circuit breaker running forever
+                self.circuit_breaker.record_failure()
+                raise
+
+            if attempt == self.max_retries:
+                self.circuit_breaker.record_failure()
+                return response
+
+            delay = retry_delay(attempt, response)
+            logger.warning(
+                f"Request to {endpoint} failed ({error}), retrying in {delay:.1f} seconds..."
+            )
+
+            if response is not None:
+                response.close()
+
+            time.sleep(delay)
+
+
+class AsyncEmbeddingServiceClient:
+    """
+    Asynchronous version of EmbeddingServiceClient, for the callers running in an event loop. It shares
+    the circuit breaker of the sync client, as both send requests to the same service. Its connections
+    belong to the event loop where they were opened, so it must be used from a single event loop.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = gcp_config.EMBEDDING_SERVICE_MAX_RETRIES,
+        circuit_breaker: CircuitBreaker = None,
+    ):
+        if not isinstance(max_retries, int) or max_retries < 0:
+            raise ValueError("max_retries must be an integer greater or equal than 0")
+
+        self.max_retries = max_retries
+        self.circuit_breaker = circuit_breaker or get_circuit_breaker()
+        self.http_client = httpx.AsyncClient(**client_options())
+
+    async def post(self, endpoint: str, payload: dict) -> httpx.Response:
+        """
+        Send a POST request to an endpoint of the embedding service, with retries
+
+        Args:
+            endpoint: str -> Endpoint of the service. Ex: "/embed-query"
+            payload: dict -> Body of the request
+
+        Return:
+            httpx.Response -> Response of the last attempt. Its status code is not checked, except to retry
+        """
+        self.circuit_breaker.before_request()
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+
+            try:
+                response = await self.http_client.post(
+                    endpoint, json=payload, headers=request_headers()
+                )
+
+                if response.status_code < 500 and response.status_code != 429:
+                    self.circuit_breaker.record_success()
+                    return response
+
+                if response.status_code not in RETRY_STATUS_CODES:
+                    # Ex. a 500 of the service: not worth retrying, but it's a failure of the service
+                    self.circuit_breaker.record_failure()
+                    return response
+
+                error = f"status code {response.status_code}"
+
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+
+                if attempt == self.max_retries:
+                    self.circuit_breaker.record_failure()
+                    raise
+
+            except Exception:
+                # Ex. the token could not be generated, don't leave a trial request of the
+                # circuit breaker running forever
+                self.circuit_breaker.record_failure()
+                raise
+
+            if attempt == self.max_retries:
+                self.circuit_breaker.record_failure()
+                return response
+
+            delay = retry_delay(attempt, response)
+            logger.warning(
+                f"Request to {endpoint} failed ({error}), retrying in {delay:.1f} seconds..."
+            )
+
+            await asyncio.sleep(delay)
+
+
+@lazy_singleton
+def get_circuit_breaker() -> CircuitBreaker:
+    # Circuit breaker of the embedding service, shared by the sync and the async clients
+    return CircuitBreaker(
+        gcp_config.EMBEDDING_SERVICE_CIRCUIT_FAILURES,
+        gcp_config.EMBEDDING_SERVICE_CIRCUIT_RESET_SECONDS,
+    )
+
+
+@lazy_singleton
+def get_embedding_service_client() -> EmbeddingServiceClient:
+    # Client shared by all the threads of the process
+    return EmbeddingServiceClient(circuit_breaker=get_circuit_breaker())
+
+
+@lazy_singleton
+def get_async_embedding_service_client() -> AsyncEmbeddingServiceClient:
+    # Client shared by all the coroutines of the process
+    return AsyncEmbeddingServiceClient(circuit_breaker=get_circuit_breaker())
@@ -0,0 +1,77 @@
+from typing import Union
+import numpy as np
+import base64
+
+# Media type accepted by the embedding service to return packed vectors instead of
+# lists of floats
+PACKED_VECTORS_MEDIA_TYPE = "application/x-embeddings+json"
+
+VECTOR_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+
+
+def get_accept_header(vector_dtype: Union[str, None]) -> str:
+    """
+    Build the Accept header to request the vectors to the embedding service in a given format
+
+    Args:
+        vector_dtype: Union[str, None] -> "float32" or "float16" to receive base64 packed vectors,
+                                        "float" or None to receive lists of floats
+
+    Return:
+        str -> Value of the Accept header
+    """
+    if vector_dtype is None or vector_dtype == "float":
+        return "application/json"
+
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(
+            f"vector_dtype must be None, 'float' or one of: {', '.join(VECTOR_DTYPES)}"
+        )
+
+    return f"{PACKED_VECTORS_MEDIA_TYPE}; dtype={vector_dtype}, application/json"
+
+
+def decode_vector(vector: Union[list[float], str], vector_encoding: str) -> np.ndarray:
+    """
+    Convert a vector returned by the embedding service into a NumPy array
+
+    Args:
+        vector: Union[list[float], str] -> List of floats or base64 string of the packed vector
+        vector_encoding: str -> 'vector_encoding' value of the embedding service response
+
+    Return:
+        np.ndarray -> float32 vector
+    """
+    if vector_encoding == "float":
+        return np.asarray(vector, dtype=np.float32)
+
+    if vector_encoding not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown vector encoding: {vector_encoding}")
+
+    packed_vector = np.frombuffer(
+        base64.b64decode(vector), dtype=VECTOR_DTYPES[vector_encoding]
+    )
+
+    return packed_vector.astype(np.float32)
+
+
+def decode_vectors(
+    vectors: list[Union[list[float], str]], vector_encoding: str
+) -> np.ndarray:
+    """
+    Convert a list of vectors returned by the embedding service into a NumPy matrix
+
+    Args:
+        vectors: list[Union[list[float], str]] -> Vectors as lists of floats or base64 strings
+        vector_encoding: str -> 'vector_encoding' value of the embedding service response
+
+    Return:
+        np.ndarray -> float32 matrix with one vector per row
+    """
+    if vector_encoding == "float" or len(vectors) == 0:
+        return np.asarray(vectors, dtype=np.float32)
+
+    return np.stack([decode_vector(vector, vector_encoding) for vector in vectors])
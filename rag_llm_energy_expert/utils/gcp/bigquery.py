@@ -1,8 +1,17 @@
 from google.cloud import bigquery
 from loguru import logger
 
+import sys
 
-client = bigquery.Client()
+sys.path.append("../../..")
+
+from rag_llm_energy_expert.utils.lazy_init import lazy_singleton
+
+
+@lazy_singleton
+def get_client() -> bigquery.Client:
+    # BigQuery client, created on its first use
+    return bigquery.Client()
 
 
 def dataset_exists(dataset_name: str, project_id: str) -> bool:
@@ -27,7 +36,7 @@ def dataset_exists(dataset_name: str, project_id: str) -> bool:
     dataset_id = f"{project_id}.{dataset_name}"
 
     try:
-        client.get_dataset(dataset_id)
+        get_client().get_dataset(dataset_id)
         return True
     except Exception as e:
         if "Not found" in str(e):
@@ -63,7 +72,7 @@ def table_exists(table_name: str, dataset_name: str, project_id: str) -> bool:
     table_id = f"{project_id}.{dataset_name}.{table_name}"
 
     try:
-        client.get_table(table_id)
+        get_client().get_table(table_id)
         return True
     except Exception as e:
         if "Not found" in str(e):
@@ -96,7 +105,7 @@ def create_dataset(dataset_name: str, dataset_location: str, project_id: str) ->
     dataset.location = dataset_location
 
     try:
-        client.create_dataset(dataset)
+        get_client().create_dataset(dataset)
         logger.info(f"Dataset {dataset_name} created.")
     except Exception as e:
         logger.info(f"Error creating the dataset: {e}")
@@ -143,7 +152,7 @@ def create_table(
     table = bigquery.Table(table_id, schema=schema)
 
     try:
-        client.create_table(table)
+        get_client().create_table(table)
         logger.info(f"Table {table_name} created.")
     except Exception as e:
         logger.info(f"Error creating the table: {e}")
@@ -169,7 +178,7 @@ def delete_dataset(dataset_name: str, project_id: str) -> None:
     dataset_id = f"{project_id}.{dataset_name}"
 
     try:
-        client.delete_dataset(dataset_id, delete_contents=True)
+        get_client().delete_dataset(dataset_id, delete_contents=True)
         logger.info(f"Dataset {dataset_name} deleted.")
     except Exception as e:
         raise ValueError(f"Error deleting the dataset: {e}")
@@ -196,7 +205,7 @@ def delete_table(table_name: str, dataset_name: str, project_id: str) -> None:
     table_id = f"{project_id}.{dataset_name}.{table_name}"
 
     try:
-        client.delete_table(table_id)
+        get_client().delete_table(table_id)
         logger.info(f"Table {table_name} deleted.")
     except Exception as e:
         raise ValueError(f"Error deleting the table: {e}")
@@ -216,7 +225,7 @@ def query_data(query: str) -> list:
         raise ValueError("The query must be a non-empty string.")
 
     try:
-        query_job = client.query(query)
+        query_job = get_client().query(query)
         results = query_job.result()
         return results
 
@@ -263,7 +272,7 @@ def insert_rows(
     table_id = f"{project_id}.{dataset_name}.{table_name}"
 
     try:
-        errors = client.insert_rows_json(table_id, rows)
+        errors = get_client().insert_rows_json(table_id, rows)
         if errors:
             raise ValueError(f"Errors occurred while inserting rows: {errors}")
         logger.info(f"Rows inserted into {table_name}.")
@@ -314,7 +323,7 @@ def update_row(
             SET {", ".join([f"{key} = '{value}'" for key, value in update_data.items()])}
             WHERE {primary_key_column_name} = '{row_id}'
         """
-        client.query(query).result()
+        get_client().query(query).result()
         logger.info(f"Row with ID {row_id} updated in {table_name}.")
     except Exception as e:
         raise ValueError(f"Error updating row: {e}")
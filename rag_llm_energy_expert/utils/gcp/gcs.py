@@ -1,10 +1,25 @@
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
+from typing import Callable, Union
+import tempfile
+import time
 import os
+import sys
 
+sys.path.append("../../..")
 
-# Create a general storage client
-client = storage.Client()
+from rag_llm_energy_expert.config import GCPConfig
+from rag_llm_energy_expert.utils.lazy_init import lazy_singleton
+
+gcp_config = GCPConfig()
+
+
+@lazy_singleton
+def get_client() -> storage.Client:
+    # General storage client, created on its first use
+    return storage.Client()
 
 
 def bucket_exists(bucket_name: str) -> bool:
@@ -20,7 +35,7 @@ def bucket_exists(bucket_name: str) -> bool:
     if not isinstance(bucket_name, str) or bucket_name == "":
         raise TypeError("The parameter bucket_name must be a not null string")
 
-    return client.bucket(bucket_name).exists()
+    return get_client().bucket(bucket_name).exists()
 
 
 def blob_exists(blob_name: str, bucket_name: str) -> bool:
@@ -47,7 +62,7 @@ def blob_exists(blob_name: str, bucket_name: str) -> bool:
         raise ValueError(f"The bucket {bucket_name} does not exists")
 
     # Get a list of objects inside the bucket
-    blobs = client.list_blobs(bucket_name)
+    blobs = get_client().list_blobs(bucket_name)
 
     blobs_name = [blob.name for blob in blobs]
 
@@ -57,6 +72,58 @@ def blob_exists(blob_name: str, bucket_name: str) -> bool:
     return False
 
 
+def get_file_checksum(gcs_file_path: str, bucket_name: str) -> str:
+    """
+    Get the checksum computed by GCS for a file, without downloading it. Composite objects
+    have no md5, their crc32c is used instead
+
+    Args:
+        gcs_file_path: str -> Path to the file. ex: "my_folder/file.pdf"
+        bucket_name: str -> The GCS bucket where the file is stored. ex: "my_bucket"
+
+    Return:
+        str -> Checksum prefixed by its algorithm. Ex: "md5:1B2M2Y8AsgTpgAmY7PhCfg=="
+    """
+    if not isinstance(gcs_file_path, str) or gcs_file_path == "":
+        raise TypeError("The parameter gcs_file_path must be a not null string")
+
+    # Only requests the metadata of the file
+    blob = get_client().bucket(bucket_name).get_blob(gcs_file_path)
+
+    if blob is None:
+        raise ValueError(
+            f"{gcs_file_path} does not exists. Check the path and try again"
+        )
+
+    if blob.md5_hash is not None:
+        return f"md5:{blob.md5_hash}"
+
+    return f"crc32c:{blob.crc32c}"
+
+
+def list_files(bucket_name: str, prefix: str = "") -> list[str]:
+    """
+    List the names of the files stored in a bucket under a prefix
+
+    Args:
+        bucket_name: str -> Name of the bucket. Ex: "my_bucket"
+        prefix: str -> Only the files whose name starts with prefix are listed. Ex: "gcs_folder/"
+
+    Return:
+        list[str] -> Names of the files. Ex: ["gcs_folder/file.pdf"]
+    """
+    if not isinstance(prefix, str):
+        raise TypeError("The parameter prefix must be a string")
+
+    if not bucket_exists(bucket_name):
+        raise ValueError(f"The bucket {bucket_name} does not exists")
+
+    blobs = get_client().list_blobs(bucket_name, prefix=prefix)
+
+    # The "folders" created from the console are empty blobs ending with "/"
+    return [blob.name for blob in blobs if not blob.name.endswith("/")]
+
+
 def create_bucket(bucket_name: str, location: str) -> storage.Client.bucket:
     """
     Create a new bucket on GCP
@@ -70,7 +137,7 @@ def create_bucket(bucket_name: str, location: str) -> storage.Client.bucket:
     if bucket_exists(bucket_name):
         raise ValueError(f"The bucket {bucket_name} already exists")
 
-    bucket = client.create_bucket(bucket_name, location=location)
+    bucket = get_client().create_bucket(bucket_name, location=location)
     logger.info(f"Bucket {bucket_name} successfully created!")
 
     return bucket
@@ -89,7 +156,7 @@ def delete_bucket(bucket_name: str) -> None:
     if not bucket_exists(bucket_name):
         raise ValueError(f"The bucket {bucket_name} does not exists")
 
-    bucket = client.get_bucket(bucket_name)
+    bucket = get_client().get_bucket(bucket_name)
     bucket.delete()
 
     logger.info(f"Bucket {bucket_name} deleted")
@@ -140,7 +207,7 @@ def upload_file(
         raise ValueError(f"The bucket {bucket_name} does not exists")
 
     # Get the bucket
-    bucket = client.bucket(bucket_name)
+    bucket = get_client().bucket(bucket_name)
 
     # Upload file in the bucket
     blob = bucket.blob(destination_file_path)
@@ -175,7 +242,7 @@ def upload_file_from_memory(
             "The parameters string_data and blob_name must be string types"
         )
 
-    bucket = client.bucket(bucket_name)
+    bucket = get_client().bucket(bucket_name)
     blob = bucket.blob(blob_name)
     blob.upload_from_string(string_data)
 
@@ -198,7 +265,7 @@ def delete_file(file_name: str, bucket_name: str) -> None:
             f"The file {file_name} does not exist in the bucket {bucket_name}"
         )
 
-    bucket = client.bucket(bucket_name)
+    bucket = get_client().bucket(bucket_name)
     blob = bucket.blob(file_name)
     blob.delete()
     logger.info(f"The file {file_name} was deleted successfully")
@@ -228,7 +295,7 @@ def download_file(gcs_file_path: str, local_file_path: str, bucket_name: str) ->
         raise ValueError(f"The path {file_path} does not exists")
 
     # Get the bucket and the file
-    bucket = client.bucket(bucket_name)
+    bucket = get_client().bucket(bucket_name)
     blob = bucket.blob(gcs_file_path)
 
     # Download the file
@@ -250,15 +317,261 @@ def get_file(
     Return:
         bytes -> Bytes of the file
     """
-    # blob_exists already has error handlers
-    if not blob_exists(gcs_file_path, bucket_name):
+    bucket = get_client().bucket(bucket_name)
+    blob = bucket.blob(gcs_file_path)
+
+    # A missing file is reported by the download itself, without listing the bucket first
+    try:
+        memory_blob = blob.download_as_bytes()
+
+    except NotFound:
         raise ValueError(
             f"{gcs_file_path} does not exists. Check the path and try again"
         )
 
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(gcs_file_path)
+    return memory_blob
 
-    memory_blob = blob.download_as_bytes()
 
-    return memory_blob
+def download_to_temp_file(
+    gcs_file_path: str,
+    bucket_name: str,
+    suffix: str = "",
+    chunk_size: int = None,
+) -> str:
+    """
+    Download a file stored in GCS into a temporary local file, writing it while it is received,
+    so the file is never held in memory. The caller must remove the file once it is processed.
+
+    Args:
+        gcs_file_path: str -> Path to the file. ex: "my_folder/file.pdf"
+        bucket_name: str -> The GCS bucket where the file is stored. ex: "my_bucket"
+        suffix: str -> Suffix of the name of the temporary file. ex: ".pdf"
+        chunk_size: int -> If set, the file is downloaded with range requests of chunk_size bytes
+                            (multiple of 256 KB) instead of a single request
+
+    Return:
+        str -> Path of the temporary file
+    """
+    if not isinstance(gcs_file_path, str) or gcs_file_path == "":
+        raise TypeError("The parameter gcs_file_path must be a not null string")
+
+    bucket = get_client().bucket(bucket_name)
+    blob = bucket.blob(gcs_file_path, chunk_size=chunk_size)
+
+    file_descriptor, local_file_path = tempfile.mkstemp(suffix=suffix)
+
+    try:
+        with os.fdopen(file_descriptor, "wb") as local_file:
+            blob.download_to_file(local_file)
+
+    except NotFound:
+        os.remove(local_file_path)
+        raise ValueError(
+            f"{gcs_file_path} does not exists. Check the path and try again"
+        )
+
+    except Exception:
+        os.remove(local_file_path)
+        raise
+
+    return local_file_path
+
+
+def transfer_many(
+    transfers: list[tuple[str, str]],
+    transfer_fn: Callable[[str, str], None],
+    max_workers: int,
+) -> list[dict]:
+    """
+    Run several file transfers in a pool of threads. A failed transfer does not stop the others,
+    its error is reported in the summary
+
+    Args:
+        transfers: list[tuple[str, str]] -> (origin, destination) of each file
+        transfer_fn: Callable[[str, str], None] -> Function that transfers a single file from origin to destination
+        max_workers: int -> Number of files transferred at the same time
+
+    Return:
+        list[dict] -> One entry per file, in the same order as transfers, with the keys
+                        'origin', 'destination', 'status' ('ok' or 'failed'), 'seconds' and 'error'
+    """
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ValueError("max_workers must be an integer greater or equal than 1")
+
+    def run_transfer(origin: str, destination: str) -> dict:
+        start = time.perf_counter()
+
+        try:
+            transfer_fn(origin, destination)
+            status, error = "ok", None
+
+        except Exception as e:
+            status, error = "failed", str(e)
+            logger.warning(f"{origin} could not be transferred: {e}")
+
+        return {
+            "origin": origin,
+            "destination": destination,
+            "status": status,
+            "seconds": round(time.perf_counter() - start, 3),
+            "error": error,
+        }
+
+    start = time.perf_counter()
+
+    # The client is shared by the threads, each one waits for its own transfer
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summary = list(
+            executor.map(lambda transfer: run_transfer(*transfer), transfers)
+        )
+
+    failed = sum(1 for result in summary if result["status"] == "failed")
+    logger.info(
+        f"{len(summary) - failed} of {len(summary)} files transferred in "
+        f"{time.perf_counter() - start:.2f}s ({failed} failed)"
+    )
+
+    return summary
+
+
+def upload_files(
+    origin_paths: Union[list[str], str],
+    bucket_name: str,
+    destination_prefix: str = "",
+    max_workers: int = gcp_config.GCS_TRANSFER_WORKERS,
+    chunk_size: int = gcp_config.GCS_TRANSFER_CHUNK_SIZE,
+) -> list[dict]:
+    """
+    Upload several local files into a GCS bucket at the same time. The files are sent with
+    resumable uploads of chunk_size bytes, so an interrupted request only resends its chunk
+
+    Args:
+        origin_paths: Union[list[str], str] -> Local paths of the files, or a local directory whose files
+                                                (searched recursively) are uploaded keeping their relative path
+        bucket_name: str -> Name of the bucket. Ex: "my_bucket"
+        destination_prefix: str -> Prefix added to the name of each file in GCS. Ex: "gcs_folder/"
+        max_workers: int -> Number of files uploaded at the same time
+        chunk_size: int -> Size in bytes of each chunk, multiple of 256 KB
+
+    Return:
+        list[dict] -> Summary of each file (see transfer_many), the destination is the name of the file in GCS
+    """
+    if not isinstance(destination_prefix, str):
+        raise TypeError("The parameter destination_prefix must be a string")
+
+    if isinstance(origin_paths, str):
+        if not os.path.isdir(origin_paths):
+            raise ValueError(f"The directory {origin_paths} does not exists")
+
+        directory = origin_paths
+        origin_paths = list()
+
+        for folder, _, file_names in os.walk(directory):
+            origin_paths += [
+                os.path.join(folder, file_name) for file_name in file_names
+            ]
+
+        destinations = [
+            os.path.relpath(origin_path, directory).replace("\\", "/")
+            for origin_path in origin_paths
+        ]
+
+    elif isinstance(origin_paths, list) and all(
+        isinstance(origin_path, str) for origin_path in origin_paths
+    ):
+        destinations = [
+            origin_path.replace("\\", "/").split("/")[-1]
+            for origin_path in origin_paths
+        ]
+
+    else:
+        raise TypeError(
+            "The parameter origin_paths must be a list of local paths or a local directory"
+        )
+
+    # The bucket is only checked once, not on each file
+    if not bucket_exists(bucket_name):
+        raise ValueError(f"The bucket {bucket_name} does not exists")
+
+    bucket = get_client().bucket(bucket_name)
+
+    def upload(origin_path: str, destination: str) -> None:
+        bucket.blob(destination, chunk_size=chunk_size).upload_from_filename(
+            origin_path
+        )
+
+    return transfer_many(
+        transfers=[
+            (origin_path, destination_prefix + destination)
+            for origin_path, destination in zip(origin_paths, destinations)
+        ],
+        transfer_fn=upload,
+        max_workers=max_workers,
+    )
+
+
+def download_files(
+    gcs_file_paths: Union[list[str], str],
+    local_directory: str,
+    bucket_name: str,
+    max_workers: int = gcp_config.GCS_TRANSFER_WORKERS,
+    chunk_size: int = gcp_config.GCS_TRANSFER_CHUNK_SIZE,
+) -> list[dict]:
+    """
+    Download several files of a GCS bucket into a local directory at the same time. Each file
+    is downloaded with range requests of chunk_size bytes and written while it is received
+
+    Args:
+        gcs_file_paths: Union[list[str], str] -> Paths of the files in the bucket, or a prefix whose files are
+                                                    downloaded. Ex: ["gcs_folder/file.pdf"] or "gcs_folder/"
+        local_directory: str -> Directory where the files are stored, keeping their path in the bucket
+        bucket_name: str -> Name of the bucket. Ex: "my_bucket"
+        max_workers: int -> Number of files downloaded at the same time
+        chunk_size: int -> Size in bytes of each range request, multiple of 256 KB
+
+    Return:
+        list[dict] -> Summary of each file (see transfer_many), the destination is the local path of the file
+    """
+    if not isinstance(local_directory, str) or not os.path.isdir(local_directory):
+        raise ValueError(f"The directory {local_directory} does not exists")
+
+    if isinstance(gcs_file_paths, str):
+        # list_files already checks the bucket
+        gcs_file_paths = list_files(bucket_name=bucket_name, prefix=gcs_file_paths)
+
+    elif isinstance(gcs_file_paths, list) and all(
+        isinstance(gcs_file_path, str) for gcs_file_path in gcs_file_paths
+    ):
+        if not bucket_exists(bucket_name):
+            raise ValueError(f"The bucket {bucket_name} does not exists")
+
+    else:
+        raise TypeError(
+            "The parameter gcs_file_paths must be a list of GCS paths or a prefix"
+        )
+
+    bucket = get_client().bucket(bucket_name)
+
+    def download(gcs_file_path: str, local_file_path: str) -> None:
+        os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+
+        try:
+            bucket.blob(gcs_file_path, chunk_size=chunk_size).download_to_filename(
+                local_file_path
+            )
+
+        except NotFound:
+            # Don't leave an empty file behind
+            if os.path.isfile(local_file_path):
+                os.remove(local_file_path)
+
+            raise ValueError(f"The file: {gcs_file_path} does not exists")
+
+    return transfer_many(
+        transfers=[
+            (gcs_file_path, os.path.join(local_directory, gcs_file_path))
+            for gcs_file_path in gcs_file_paths
+        ],
+        transfer_fn=download,
+        max_workers=max_workers,
+    )
@@ -3,8 +3,17 @@ from typing import Union
 from pydantic import SecretStr
 from loguru import logger
 
-# Create a SecretManager Client
-client = secretmanager.SecretManagerServiceClient()
+import sys
+
+sys.path.append("../../..")
+
+from rag_llm_energy_expert.utils.lazy_init import lazy_singleton
+
+
+@lazy_singleton
+def get_client() -> secretmanager.SecretManagerServiceClient:
+    # SecretManager client, created on its first use
+    return secretmanager.SecretManagerServiceClient()
 
 
 def secret_exists(secret_id: str, project_id: str) -> None:
@@ -27,7 +36,7 @@ def secret_exists(secret_id: str, project_id: str) -> None:
     parent = f"projects/{project_id}"
 
     # Get secret objects and names
-    secret_objects = client.list_secrets(request={"parent": parent})
+    secret_objects = get_client().list_secrets(request={"parent": parent})
 
     # secret.name is in the form: "projects/project_id/secrets/secret_id"
     secret_names = [secret.name.split("/")[-1] for secret in secret_objects]
@@ -58,9 +67,9 @@ def secret_version_exists(
     if not isinstance(version_id, Union[str, int]) or version_id == "":
         raise TypeError("version_id is not a string or an integer")
 
-    parent = client.secret_path(project_id, secret_id)
+    parent = get_client().secret_path(project_id, secret_id)
 
-    versions = client.list_secret_versions(request={"parent": parent})
+    versions = get_client().list_secret_versions(request={"parent": parent})
 
     # version.name is in the form:
     # "projects/project_id/secrets/secret_id/versions/version_id"
@@ -104,7 +113,7 @@ def create_secret(
         )
 
     # Create the parent secret
-    secret = client.create_secret(
+    secret = get_client().create_secret(
         request={
             "parent": f"projects/{project_id}",
             "secret_id": secret_id,
@@ -113,7 +122,7 @@ def create_secret(
     )
 
     # Add the secret version
-    client.add_secret_version(
+    get_client().add_secret_version(
         request={"parent": secret.name, "payload": {"data": secret_value}}
     )
 
@@ -145,7 +154,7 @@ def get_secret(
     name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
 
     # Access the secret version
-    response = client.access_secret_version(request={"name": name})
+    response = get_client().access_secret_version(request={"name": name})
 
     # Get the payload of the response
     payload = SecretStr(response.payload.data.decode("UTF-8"))
@@ -177,7 +186,7 @@ def destroy_secret_version(
     name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
 
     # Destroy the secret version
-    response = client.destroy_secret_version(request={"name": name})
+    response = get_client().destroy_secret_version(request={"name": name})
 
     logger.info(f"Secret version destroyed: {response.name}")
 
@@ -201,9 +210,9 @@ def delete_secret(
     if not secret_exists(secret_id, project_id):
         raise ValueError("The secret_id does not exists")
 
-    name = client.secret_path(project_id, secret_id)
+    name = get_client().secret_path(project_id, secret_id)
 
-    client.delete_secret(request={"name": name})
+    get_client().delete_secret(request={"name": name})
 
     logger.info("Secret deleted")
 
@@ -231,13 +240,13 @@ def add_secret_version(
             "The secret_id does not exists, use the function 'create_secret' instead"
         )
 
-    parent = client.secret_path(project_id, secret_id)
+    parent = get_client().secret_path(project_id, secret_id)
 
     # Encode the secret using UTF-8
     secret_value_bytes = secret_value.encode("UTF-8")
 
     # Add the secret version
-    client.add_secret_version(
+    get_client().add_secret_version(
         request={
             "parent": parent,
             "payload": {"data": secret_value_bytes},
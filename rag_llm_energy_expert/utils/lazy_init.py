@@ -0,0 +1,40 @@
+from functools import wraps
+from threading import Lock
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+
+def lazy_singleton(factory: Callable[[], T]) -> Callable[[], T]:
+    """
+    Decorate a function without arguments that creates an object (a client, a config with secrets),
+    so the object is created on the first call instead of when the module is imported. Unlike
+    functools.lru_cache, the factory runs only once even if several threads call it at the same time.
+
+    Args:
+        factory: Callable[[], T] -> Function that creates the object
+
+    Return:
+        Callable[[], T] -> Function returning the same object on every call. Its cache_clear
+                            method forgets the object, so the next call creates it again
+    """
+    lock = Lock()
+    instance = list()
+
+    @wraps(factory)
+    def get_instance() -> T:
+        if len(instance) == 0:
+            with lock:
+                # Another thread may have created it while this one was waiting
+                if len(instance) == 0:
+                    instance.append(factory())
+
+        return instance[0]
+
+    def cache_clear() -> None:
+        with lock:
+            instance.clear()
+
+    get_instance.cache_clear = cache_clear
+
+    return get_instance
@@ -1,4 +1,4 @@
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.models import (
     Distance,
     VectorParams,
@@ -7,19 +7,103 @@ from qdrant_client.models import (
     FieldCondition,
     MatchValue,
     FilterSelector,
+    PointIdsList,
 )
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
 from loguru import logger
+from typing import Callable, Union
+import hashlib
+import json
+import random
+import time
+import uuid
 import sys
 
 sys.path.append("../../..")
 
+from rag_llm_energy_expert.config import QdrantConfig
 from rag_llm_energy_expert.credentials import get_qdrant_config
+from rag_llm_energy_expert.utils.lazy_init import lazy_singleton
 
-# Initialize a QDRANT_CONFIG class
-config = get_qdrant_config()
+# Config without secrets, used for the default values
+config = QdrantConfig()
 
-# Initialize a general Qdrant client
-client = QdrantClient(url=config.URL, api_key=config.API_KEY.get_secret_value())
+
+@lazy_singleton
+def get_client() -> QdrantClient:
+    # General Qdrant client, created on its first use, when the api key is requested
+    qdrant_config = get_qdrant_config()
+
+    return QdrantClient(
+        url=qdrant_config.URL, api_key=qdrant_config.API_KEY.get_secret_value()
+    )
+
+
+@lazy_singleton
+def get_async_client() -> AsyncQdrantClient:
+    # Asynchronous Qdrant client, for the searches done from an event loop. Its connections
+    # belong to the event loop where they were opened, so it must be used from a single event loop
+    qdrant_config = get_qdrant_config()
+
+    return AsyncQdrantClient(
+        url=qdrant_config.URL, api_key=qdrant_config.API_KEY.get_secret_value()
+    )
+
+
+# Functions called with the name of a collection after its points were upserted or deleted,
+# ex. to remove the cached searches of the collection
+collection_update_callbacks: list[Callable[[str], None]] = list()
+
+
+def notify_collection_update(collection_name: str) -> None:
+    """
+    Call the collection_update_callbacks. A callback that fails doesn't stop the update
+
+    Args:
+        collection_name: str -> Name of the collection whose points changed
+
+    Return:
+        None
+    """
+    for callback in collection_update_callbacks:
+        try:
+            callback(collection_name)
+
+        except Exception as e:
+            logger.warning(f"Collection update callback failed: {e}")
+
+
+# Namespace of the uuid5 ids of the chunks
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c3a52-0d4e-4a8f-9a57-3b6f2f1de8c4")
+
+
+def chunk_id(
+    document_title: str, text: str, occurrence: int = 0, embedding_version: str = ""
+) -> str:
+    """
+    Return a deterministic id for a chunk, so the same chunk of a document always gets the same
+    id across ingestions. The id changes when the vector of the chunk would change (another model,
+    backend or precision), so the chunk is embedded and upserted again instead of kept as unchanged
+
+    Args:
+        document_title: str -> Title of the document of the chunk
+        text: str -> Text of the chunk
+        occurrence: int -> Number of times the same text appeared before in the document
+        embedding_version: str -> Model, backend and precision of the vector of the chunk.
+                                  Ex: "sentence-transformers/LaBSE:torch:float32"
+
+    Return:
+        str -> uuid5 derived from the title, the hash of the text, the occurrence and the embedding version
+    """
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    return str(
+        uuid.uuid5(
+            CHUNK_ID_NAMESPACE,
+            f"{document_title}/{text_hash}/{occurrence}/{embedding_version}",
+        )
+    )
 
 
 def document_in_collection(collection_name: str, document_title: str) -> bool:
@@ -41,7 +125,7 @@ def document_in_collection(collection_name: str, document_title: str) -> bool:
             "The parameters collection_name and document_title must be not null strings"
         )
 
-    if not client.collection_exists(collection_name):
+    if not get_client().collection_exists(collection_name):
         raise ValueError(
             f"The collection {collection_name} does not exists. To create it, please"
             " use the create_collection function"
@@ -55,7 +139,7 @@ def document_in_collection(collection_name: str, document_title: str) -> bool:
     )
 
     # Scroll through all matching vectors
-    scroll_result = client.scroll(
+    scroll_result = get_client().scroll(
         collection_name=collection_name,
         scroll_filter=title_filter,
         limit=1,  # In this case, I only need 1 vector to know if the document is already indexed
@@ -90,7 +174,7 @@ def delete_document(collection_name: str, document_title: str) -> None:
         )
 
     # Delete document
-    client.delete(
+    get_client().delete(
         collection_name=collection_name,
         points_selector=FilterSelector(
             filter=Filter(
@@ -102,9 +186,132 @@ def delete_document(collection_name: str, document_title: str) -> None:
         ),
     )
 
+    notify_collection_update(collection_name)
     logger.info(f"Document {document_title} deleted")
 
 
+def get_document_points_metadata(
+    collection_name: str, document_title: str
+) -> dict[str, dict]:
+    """
+    Return the ids of all the points of a document, with the metadata stored in their payloads
+
+    Args:
+        collection_name: str -> Name of the vector db collection
+        document_title: str -> Title of the document
+
+    Return:
+        dict[str, dict] -> Metadata of each point id of the document, empty if the document is not in the collection
+    """
+    # document_in_collection already has error handlers for its parameters
+    if not document_in_collection(collection_name, document_title):
+        return dict()
+
+    title_filter = Filter(
+        must=[
+            FieldCondition(key="metadata.title", match=MatchValue(value=document_title))
+        ]
+    )
+
+    points_metadata = dict()
+    offset = None
+
+    # Only the metadata is retrieved, without the vectors and the texts
+    while True:
+        points, offset = get_client().scroll(
+            collection_name=collection_name,
+            scroll_filter=title_filter,
+            limit=1000,
+            offset=offset,
+            with_payload=["metadata"],
+            with_vectors=False,
+        )
+
+        points_metadata.update(
+            {str(point.id): point.payload.get("metadata") for point in points}
+        )
+
+        if offset is None:
+            return points_metadata
+
+
+def update_metadata(
+    collection_name: str,
+    points: list[PointStruct],
+    points_metadata: dict[str, dict],
+) -> int:
+    """
+    Write the metadata of the points already in the collection whose stored metadata is different,
+    ex. the upload_date or the storage_path of a document uploaded again with the same text.
+    Their vectors are not upserted again
+
+    Args:
+        collection_name: str -> Name of the vector db collection
+        points: list[PointStruct] -> Points of the document
+        points_metadata: dict[str, dict] -> Metadata stored for each point id, returned by get_document_points_metadata
+
+    Return:
+        int -> Number of points whose metadata was updated
+    """
+    # Points with the same new metadata are updated with a single request
+    stale_points = dict()
+
+    for point in points:
+        point_id = str(point.id)
+        metadata = point.payload["metadata"]
+
+        if point_id in points_metadata and points_metadata[point_id] != metadata:
+            key = json.dumps(metadata, sort_keys=True, default=str)
+            stale_points.setdefault(key, (metadata, list()))[1].append(point_id)
+
+    for metadata, point_ids in stale_points.values():
+        get_client().set_payload(
+            collection_name=collection_name,
+            payload={"metadata": metadata},
+            points=point_ids,
+            wait=True,
+        )
+
+    updated = sum(len(point_ids) for _, point_ids in stale_points.values())
+
+    if updated > 0:
+        logger.info(f"Metadata of {updated} points updated")
+        notify_collection_update(collection_name)
+
+    return updated
+
+
+def delete_points(collection_name: str, point_ids: list[str]) -> None:
+    """
+    Delete points from a collection by their ids
+
+    Args:
+        collection_name: str -> Name of the collection
+        point_ids: list[str] -> Ids of the points to delete
+
+    Return:
+        None
+    """
+    if not isinstance(collection_name, str) or collection_name == "":
+        raise TypeError("The collection_name parameter must be a string")
+
+    if not isinstance(point_ids, list):
+        raise TypeError("The parameter point_ids must be a list of ids")
+
+    if len(point_ids) == 0:
+        return
+
+    get_client().delete(
+        collection_name=collection_name,
+        points_selector=PointIdsList(points=point_ids),
+        wait=True,
+    )
+    notify_collection_update(collection_name)
+    logger.info(
+        f"{len(point_ids)} points deleted from the collection {collection_name}"
+    )
+
+
 def upload_points(collection_name: str, points: list[PointStruct]) -> None:
     """
     Upload the points generated when parsing and chunking a document to the vector db collection
@@ -138,31 +345,153 @@ def upload_points(collection_name: str, points: list[PointStruct]) -> None:
             " update_points function"
         )
 
-    client.upsert(
-        collection_name=collection_name,
-        wait=True,
-        points=points,
-    )
+    upsert_points(collection_name, points)
     logger.info(f"Points uploaded into the collection {collection_name}")
 
 
-def update_points(collection_name: str, points: list[PointStruct]) -> None:
+def upsert_batch(
+    collection_name: str, points: list[PointStruct], max_retries: int
+) -> None:
+    """
+    Upsert a batch of points, retrying with exponential backoff and jitter when the request fails
+
+    Args:
+        collection_name: str -> Name of the collection
+        points: list[PointStruct] -> Points of the batch
+        max_retries: int -> Number of retries before raising the error
+
+    Return:
+        None
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            get_client().upsert(
+                collection_name=collection_name, wait=True, points=points
+            )
+            return
+
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+
+            delay = 0.5 * 2**attempt * random.uniform(0.5, 1.5)
+            logger.warning(
+                f"Upsert of {len(points)} points failed ({e}), retrying in {delay:.1f} seconds..."
+            )
+            time.sleep(delay)
+
+
+def upsert_points(
+    collection_name: str,
+    points: list[PointStruct],
+    batch_size: int = config.UPSERT_BATCH_SIZE,
+    parallel_workers: int = config.UPSERT_PARALLEL_WORKERS,
+    max_retries: int = config.UPSERT_MAX_RETRIES,
+) -> dict:
+    """
+    Upsert points into the vector db collection, without checking if the document was previously uploaded.
+    The points are sent in batches by several threads at the same time, and each batch is retried
+    independently, so a failed request only resends its batch.
+
+    Args:
+        collection_name: str -> Name of the collection
+        points: list[PointStruct] -> List of PointStruct objects, each PointStruct is a chunk of a document
+        batch_size: int -> Number of points sent on each request
+        parallel_workers: int -> Number of batches sent at the same time
+        max_retries: int -> Number of retries of each batch before failing
+
+    Return:
+        dict -> Number of points and batches sent, seconds spent and points per second
+    """
+    # Error handlers for parameters
+    if not isinstance(collection_name, str) or collection_name == "":
+        raise TypeError("The collection_name parameter must be a string")
+
+    if not isinstance(points, list) or not all(
+        [isinstance(x, PointStruct) for x in points]
+    ):
+        raise TypeError("The parameter points must be a list of PointStruct objects")
+
+    for name, value in [
+        ("batch_size", batch_size),
+        ("parallel_workers", parallel_workers),
+    ]:
+        if not isinstance(value, int) or value < 1:
+            raise ValueError(f"{name} must be an integer greater or equal than 1")
+
+    if not isinstance(max_retries, int) or max_retries < 0:
+        raise ValueError("max_retries must be an integer greater or equal than 0")
+
+    batches = [points[i : i + batch_size] for i in range(0, len(points), batch_size)]
+
+    start = time.perf_counter()
+
+    try:
+        if len(batches) <= 1 or parallel_workers == 1:
+            for batch in batches:
+                upsert_batch(collection_name, batch, max_retries)
+
+        else:
+            # The client is shared by the threads, each one waits for the response of its own request
+            with ThreadPoolExecutor(
+                max_workers=min(parallel_workers, len(batches))
+            ) as executor:
+                futures = [
+                    executor.submit(upsert_batch, collection_name, batch, max_retries)
+                    for batch in batches
+                ]
+
+            errors = [future.exception() for future in futures if future.exception()]
+
+            if len(errors) > 0:
+                raise ValueError(
+                    f"{len(errors)} of {len(batches)} batches could not be upserted into the "
+                    f"collection {collection_name}: {errors[0]}"
+                )
+
+    finally:
+        # Some batches may have been upserted even if others failed
+        notify_collection_update(collection_name)
+
+    seconds = time.perf_counter() - start
+
+    report = {
+        "points": len(points),
+        "batches": len(batches),
+        "seconds": round(seconds, 3),
+        "points_per_second": round(len(points) / seconds, 1) if seconds > 0 else 0.0,
+    }
+
+    logger.info(
+        f"{report['points']} points upserted into the collection {collection_name} in "
+        f"{report['batches']} batches ({report['points_per_second']} points/sec)"
+    )
+
+    return report
+
+
+def update_points(collection_name: str, points: list[PointStruct]) -> dict[str, int]:
     """
-    Update the information of points already uploaded into a vector database collection
+    Update the points of a document already uploaded into a vector database collection.
+    As the ids of the points are derived from their content (see create_points), only the points
+    whose id is not in the collection are upserted, the points already in the collection only get their
+    metadata updated if it changed, and only the previous points whose id is no longer part of the
+    document are deleted. The new points are upserted before deleting the old ones, so the document
+    is always available for search.
 
     Args:
         collection_name: str -> Name of the vector db colleciton
         points: list[PointStruct] -> List of PointStruct objects, each entry of the list is a chunk of a document
 
     Return:
-        None
+        dict[str, int] -> Number of points 'added', 'updated' (only their metadata), 'unchanged' and 'deleted'
     """
     logger.info("Updating points...")
     # Error handlers for parameters
     if not isinstance(collection_name, str) or collection_name == "":
         raise TypeError("The collection_name parameter must be a string")
 
-    if not isinstance(points, list):
+    if not isinstance(points, list) or len(points) == 0:
         raise TypeError("The parameter points must be a list of PointStruct objects")
     else:
         if not all([isinstance(x, PointStruct) for x in points]):
@@ -172,18 +501,33 @@ def update_points(collection_name: str, points: list[PointStruct]) -> None:
 
     document_title = points[0].payload["metadata"]["title"]
 
-    if not document_in_collection(collection_name, document_title):
+    existing_metadata = get_document_points_metadata(collection_name, document_title)
+
+    if len(existing_metadata) == 0:
         logger.info(
             f"The document {document_title} has not been uploaded in the collection before"
         )
 
-    else:
-        # Delete all the points related to the previous uploaded document
-        delete_document(collection_name, document_title)
+    new_points = [point for point in points if str(point.id) not in existing_metadata]
+    removed_ids = existing_metadata.keys() - {str(point.id) for point in points}
+
+    if len(new_points) > 0:
+        upsert_points(collection_name, new_points)
+
+    updated = update_metadata(collection_name, points, existing_metadata)
+
+    delete_points(collection_name, list(removed_ids))
 
-    # In both cases, when the points has not been uploaded before, and when the points has been uplodaded,
-    # It is needed to upload the points again
-    upload_points(collection_name, points)
+    counts = {
+        "added": len(new_points),
+        "updated": updated,
+        "unchanged": len(points) - len(new_points) - updated,
+        "deleted": len(removed_ids),
+    }
+
+    logger.info(f"Document {document_title} updated: {counts}")
+
+    return counts
 
 
 def create_collection(collection_name: str, vector_size: int) -> None:
@@ -208,11 +552,11 @@ def create_collection(collection_name: str, vector_size: int) -> None:
         raise ValueError("vector_size must be greater than 1")
 
     # Check that the collection has not been created before
-    if client.collection_exists(collection_name):
+    if get_client().collection_exists(collection_name):
         logger.info("The collection already exists")
         return
 
-    client.create_collection(
+    get_client().create_collection(
         collection_name=collection_name,
         vectors_config=VectorParams(size=vector_size, distance=Distance.DOT),
     )
@@ -221,15 +565,22 @@ def create_collection(collection_name: str, vector_size: int) -> None:
 
 def create_points(
     chunks: list[dict],
+    occurrences: Union[Counter, None] = None,
 ) -> list[PointStruct]:
     """
-    From the chunks created (list of dictionaries), create a list of PointStruct objects ready to be indexed into the Qdrant vector database
+    From the chunks created (list of dictionaries), create a list of PointStruct objects ready to be indexed into the Qdrant vector database.
+    The id of each point is derived from the title of the document, the text of the chunk and the
+    embedding version (see chunk_id), so re-ingesting a document produces the same ids for the chunks
+    that did not change, and new ids when the model, backend or precision of the vectors changed.
 
     Args:
         chunks: list[dict] -> list of Dictionaries, where each dictionary is a chunk. Each dictionary contains the keys:
-                            'vector_id' -> Id of the PointStruct, is a uuid string
+                            'vector_id' -> Id returned by the embedding service, replaced by the deterministic id
                             'vector' -> vector of n dimensions
                             'payload' -> dictionary with two keys: "text" and "metadata"
+                            'embedding_version' -> Optional, set by decode_chunks
+        occurrences: Union[Counter, None] -> Number of times each (title, text) was seen before. Must be shared
+                                            between the calls when a document is processed in batches
     Returns:
         list[PointStruct] -> Returns a list of PointStruct, which is ready to be indexed into the vector database
     """
@@ -248,15 +599,31 @@ def create_points(
             f"All the chunks must contains the following keys: {', '.join(mandatory_keys)}"
         )
 
+    if occurrences is None:
+        occurrences = Counter()
+
     # Create a list of PointStruct objects, each PointStruct object is a chunk
-    points = [
-        PointStruct(
-            id=chunk_info["vector_id"],
-            vector=chunk_info["vector"],
-            payload=chunk_info["payload"],
+    points = list()
+
+    for chunk_info in chunks:
+        key = (
+            chunk_info["payload"]["metadata"]["title"],
+            chunk_info["payload"]["text"],
         )
-        for chunk_info in chunks
-    ]
+
+        points.append(
+            PointStruct(
+                id=chunk_id(
+                    *key,
+                    occurrence=occurrences[key],
+                    embedding_version=chunk_info.get("embedding_version", ""),
+                ),
+                vector=chunk_info["vector"],
+                payload=chunk_info["payload"],
+            )
+        )
+
+        occurrences[key] += 1
 
     logger.info("Points created")
 
@@ -276,9 +643,9 @@ def delete_collection(collection_name: str):
     if not isinstance(collection_name, str) or collection_name == "":
         raise TypeError("The parameter collection_name must be a not null string")
 
-    if not client.collection_exists(collection_name):
+    if not get_client().collection_exists(collection_name):
         raise ValueError("The collection does not exists")
 
-    client.delete_collection(collection_name=collection_name)
+    get_client().delete_collection(collection_name=collection_name)
 
     logger.info("Collection deleted")
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from loguru import logger
+import time
+import sys
+
+sys.path.append("..")
+
+from rag_llm_energy_expert.credentials import (
+    get_qdrant_config,
+    get_llm_config,
+    get_embedding_service_token,
+)
+from rag_llm_energy_expert.llm.chat_auxiliars import get_genai_client
+from rag_llm_energy_expert.utils.embedding_service.client import (
+    get_async_embedding_service_client,
+    get_embedding_service_client,
+)
+from rag_llm_energy_expert.utils.vector_db.qdrant import (
+    get_async_client as get_async_qdrant_client,
+    get_client as get_qdrant_client,
+)
+from rag_llm_energy_expert.utils.gcp.bigquery import get_client as get_bigquery_client
+from rag_llm_energy_expert.utils.gcp.gcs import get_client as get_gcs_client
+
+# Secrets, tokens and clients that are created on their first use. The clients that depend on a
+# secret wait for it, so listing both is safe
+WARM_UP_COMPONENTS: dict[str, Callable] = {
+    "qdrant_api_key": get_qdrant_config,
+    "llm_api_key": get_llm_config,
+    "embedding_service_token": get_embedding_service_token,
+    "embedding_service_client": get_embedding_service_client,
+    "async_embedding_service_client": get_async_embedding_service_client,
+    "qdrant_client": get_qdrant_client,
+    "async_qdrant_client": get_async_qdrant_client,
+    "genai_client": get_genai_client,
+    "bigquery_client": get_bigquery_client,
+    "gcs_client": get_gcs_client,
+}
+
+
+def warm_up(components: list[str] = None) -> dict[str, dict]:
+    """
+    Initialize the secrets, the ID token and the clients at the same time, instead of one after
+    the other on the first requests. A component that fails is reported, and will be initialized
+    again on its first use
+
+    Args:
+        components: list[str] -> Names of the components to initialize (keys of WARM_UP_COMPONENTS).
+                                 By default, all of them
+
+    Return:
+        dict[str, dict] -> For each component, the seconds it took and the error, if any
+    """
+    if components is None:
+        components = list(WARM_UP_COMPONENTS.keys())
+
+    unknown_components = set(components) - set(WARM_UP_COMPONENTS.keys())
+
+    if len(unknown_components) > 0:
+        raise ValueError(
+            f"Unknown components: {', '.join(sorted(unknown_components))}. "
+            f"Available components: {', '.join(WARM_UP_COMPONENTS.keys())}"
+        )
+
+    def initialize(component: str) -> dict:
+        start = time.perf_counter()
+
+        try:
+            WARM_UP_COMPONENTS[component]()
+            error = None
+
+        except Exception as e:
+            error = str(e)
+            logger.warning(f"{component} could not be initialized: {e}")
+
+        return {"seconds": round(time.perf_counter() - start, 3), "error": error}
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(len(components), 1)) as executor:
+        report = dict(zip(components, executor.map(initialize, components)))
+
+    logger.info(
+        f"{len(components)} components initialized in {time.perf_counter() - start:.2f}s"
+    )
+
+    return report
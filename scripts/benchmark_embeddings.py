@@ -0,0 +1,130 @@
+import argparse
+import time
+import sys
+
+sys.path.append("..")
+sys.path.append("../rag_llm_energy_expert/services/embeddings")
+
+from rag_llm_energy_expert.services.ingestion.parsers.pdf_parser import parse_pdf_file
+from embedding_pipeline import chunk_text, encode_length_bucketed, length_buckets
+from model_registry import model_registry
+from config import EmbeddingsConfig
+
+embeddings_config = EmbeddingsConfig()
+
+
+def padded_tokens(batches_lengths: list[list[int]]) -> int:
+    # Tokens processed by the model, each batch is padded to its longest text
+    return sum(len(lengths) * max(lengths) for lengths in batches_lengths)
+
+
+def benchmark(encode_fn, model, chunks: list[str], repeats: int) -> float:
+    # Returns the best time (seconds) of the repeats
+    encode_fn(model, chunks[:8])  # Warm up
+
+    times = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        encode_fn(model, chunks)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+parser = argparse.ArgumentParser(
+    description="Compare the throughput of embedding the chunks of PDFs with SentenceTransformer.encode and bucketed by token length"
+)
+
+parser.add_argument(
+    "-f",
+    "--file-paths",
+    nargs="+",
+    required=True,
+    help="PDFs to chunk and embed. Either gcs paths (ex: 'gs://bucket_name/folder_name/pdf_name.pdf') or local paths",
+)
+
+parser.add_argument(
+    "-m",
+    "--embedding-model-name",
+    required=False,
+    help="Name of the embedding model to use. Must be available on sentence-transformers.",
+    default=embeddings_config.EMBEDDING_MODEL,
+)
+
+parser.add_argument(
+    "--chunk-overlap",
+    type=int,
+    required=False,
+    help="Number of tokens to overlap between chunks.",
+    default=embeddings_config.CHUNK_OVERLAP,
+)
+
+parser.add_argument(
+    "--repeats",
+    type=int,
+    required=False,
+    help="Number of times each strategy is run, the best time is reported.",
+    default=3,
+)
+
+args = parser.parse_args()
+
+model = model_registry.get(args.embedding_model_name)
+
+chunks = list()
+for file_path in args.file_paths:
+    chunks += chunk_text(
+        text=parse_pdf_file(file_path)["text"],
+        embedding_model=model,
+        embedding_model_name=args.embedding_model_name,
+        chunk_overlap=args.chunk_overlap,
+    )
+
+tokenize_start = time.perf_counter()
+lengths = [
+    len(ids)
+    for ids in model.tokenizer(
+        chunks, truncation=True, max_length=model.max_seq_length
+    )["input_ids"]
+]
+# Extra pass of the tokenizer made by encode_length_bucketed to measure the chunks
+tokenize_seconds = time.perf_counter() - tokenize_start
+total_tokens = sum(lengths)
+
+# Before: SentenceTransformer.encode sorts the texts by their number of characters (longest first)
+# and splits them in batches of its default size, 32
+encode_order = sorted(range(len(chunks)), key=lambda position: -len(chunks[position]))
+encode_batches = [
+    [lengths[position] for position in encode_order[i : i + 32]]
+    for i in range(0, len(encode_order), 32)
+]
+# After: chunks bucketed by token length with an adaptive batch size
+bucketed_batches = [
+    [lengths[position] for position in bucket]
+    for bucket in length_buckets(
+        lengths,
+        embeddings_config.ENCODE_TOKEN_BUDGET,
+        embeddings_config.ENCODE_MAX_BATCH_SIZE,
+    )
+]
+
+encode_seconds = benchmark(
+    lambda model, texts: model.encode(texts), model, chunks, args.repeats
+)
+bucketed_seconds = benchmark(encode_length_bucketed, model, chunks, args.repeats)
+
+print(
+    f"Documents: {len(args.file_paths)}, chunks: {len(chunks)}, tokens: {total_tokens}"
+)
+print(f"{'strategy':<16}{'padded tokens':>16}{'seconds':>10}{'tokens/sec':>14}")
+
+for strategy, batches, seconds in [
+    ("encode", encode_batches, encode_seconds),
+    ("length bucketed", bucketed_batches, bucketed_seconds),
+]:
+    print(
+        f"{strategy:<16}{padded_tokens(batches):>16}{seconds:>10.2f}{total_tokens / seconds:>14.1f}"
+    )
+
+print(f"Tokenization to bucket the chunks: {tokenize_seconds:.3f} seconds")
+print(f"Speedup: {encode_seconds / bucketed_seconds:.2f}x")
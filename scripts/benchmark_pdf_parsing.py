@@ -0,0 +1,58 @@
+import argparse
+import time
+import sys
+
+sys.path.append("..")
+
+from rag_llm_energy_expert.services.ingestion.parsers.pdf_parser import parse_pdf_file
+from rag_llm_energy_expert.config import IngestionConfig
+
+ingestion_config = IngestionConfig()
+
+
+def timed_parse(file_path: str, workers: int) -> tuple[str, float]:
+    # Returns the markdown text and the seconds spent parsing the file. The parse cache is not used,
+    # its key ignores the workers, so the second run would only read the markdown of the first one
+    start = time.perf_counter()
+    text = parse_pdf_file(file_path, workers=workers, use_cache=False)["text"]
+
+    return text, time.perf_counter() - start
+
+
+# The page pool spawns processes that import this script again, it must only run once
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the wall time of parsing PDFs in a single process and with page-parallel parsing"
+    )
+
+    parser.add_argument(
+        "-f",
+        "--file-paths",
+        nargs="+",
+        required=True,
+        help="PDFs to parse. Either gcs paths (ex: 'gs://bucket_name/folder_name/pdf_name.pdf') or local paths",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        required=False,
+        help="Number of processes of the page-parallel parsing.",
+        default=ingestion_config.PDF_PAGE_WORKERS,
+    )
+
+    args = parser.parse_args()
+
+    print(
+        f"{'file':<40}{'sequential (s)':>16}{'parallel (s)':>14}{'speedup':>10}{'identical':>11}"
+    )
+
+    for file_path in args.file_paths:
+        sequential_text, sequential_seconds = timed_parse(file_path, workers=1)
+        parallel_text, parallel_seconds = timed_parse(file_path, workers=args.workers)
+
+        print(
+            f"{file_path.split('/')[-1][-40:]:<40}{sequential_seconds:>16.2f}{parallel_seconds:>14.2f}"
+            f"{sequential_seconds / parallel_seconds:>9.2f}x{str(sequential_text == parallel_text):>11}"
+        )
@@ -0,0 +1,107 @@
+import argparse
+import subprocess
+import sys
+
+sys.path.append("..")
+
+DEFAULT_MODULES = [
+    "rag_llm_energy_expert.llm.chat_auxiliars",
+    "rag_llm_energy_expert.llm.db_auxiliars",
+    "rag_llm_energy_expert.search.searchers",
+    "rag_llm_energy_expert.utils.vector_db.qdrant",
+    "rag_llm_energy_expert.services.ingestion.ingestion_pipeline",
+]
+
+
+def import_times(module: str) -> list[tuple[str, float, float]]:
+    """
+    Import a module in a new interpreter with -X importtime
+
+    Args:
+        module: str -> Module to import. Ex: "rag_llm_energy_expert.search.searchers"
+
+    Return:
+        list[tuple[str, float, float]] -> (module, self seconds, cumulative seconds) of each module imported
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd="..",
+        capture_output=True,
+        text=True,
+    )
+
+    if result.returncode != 0:
+        raise ValueError(f"{module} could not be imported: {result.stderr[-2000:]}")
+
+    times = list()
+
+    # Lines in the format: "import time:   self [us] |  cumulative | imported package"
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times.append(
+            (name.strip(), int(self_us) / 1_000_000, int(cumulative_us) / 1_000_000)
+        )
+
+    return times
+
+
+# Create parser
+parser = argparse.ArgumentParser(
+    description="Report the import time of the modules of the project, and optionally the time to initialize their secrets and clients"
+)
+
+parser.add_argument(
+    "-m",
+    "--modules",
+    nargs="+",
+    required=False,
+    help="Modules to import, each one in a new interpreter.",
+    default=DEFAULT_MODULES,
+)
+
+parser.add_argument(
+    "-n",
+    "--top",
+    type=int,
+    required=False,
+    help="Number of slowest dependencies reported for each module.",
+    default=10,
+)
+
+parser.add_argument(
+    "--warm-up",
+    action="store_true",
+    help="Also run the warm up (secrets, ID token and clients, requires access to GCP) and report each component.",
+)
+
+args = parser.parse_args()
+
+for module in args.modules:
+    times = import_times(module)
+    total = next(cumulative for name, _, cumulative in times if name == module)
+
+    print(f"\n{module}: {total:.3f}s")
+    print(f"    {'dependency':<60}{'self (s)':>10}{'cumulative (s)':>16}")
+
+    # Only the top level packages, the cumulative time already includes their submodules
+    top_level = [
+        entry
+        for entry in times
+        if "." not in entry[0] and not module.startswith(entry[0])
+    ]
+
+    for name, self_seconds, cumulative in sorted(
+        top_level, key=lambda entry: entry[2], reverse=True
+    )[: args.top]:
+        print(f"    {name[-60:]:<60}{self_seconds:>10.3f}{cumulative:>16.3f}")
+
+if args.warm_up:
+    from rag_llm_energy_expert.warm_up import warm_up
+
+    print(f"\n{'component':<30}{'seconds':>10}  error")
+
+    for component, result in warm_up().items():
+        print(f"{component:<30}{result['seconds']:>10.3f}  {result['error'] or ''}")
@@ -0,0 +1,105 @@
+import argparse
+import sys
+import os
+
+sys.path.append("..")
+
+from rag_llm_energy_expert.utils.gcp.gcs import upload_files, download_files
+from rag_llm_energy_expert.config import GCPConfig
+
+gcp_config = GCPConfig()
+
+
+def split_gcs_path(gcs_path: str) -> tuple[str, str]:
+    # 'gs://bucket_name/folder_name/' -> ('bucket_name', 'folder_name/')
+    if not gcs_path.startswith("gs://"):
+        raise ValueError(
+            f"{gcs_path} is not a gcs path (ex: 'gs://bucket_name/folder_name/')"
+        )
+
+    path_parts = gcs_path[5:].split("/", maxsplit=1)
+
+    return path_parts[0], path_parts[1] if len(path_parts) > 1 else ""
+
+
+# Create parser
+parser = argparse.ArgumentParser(
+    description="This script uploads a corpus of files into GCS, or downloads it to re-index it from the local, transferring several files at the same time"
+)
+
+parser.add_argument(
+    "action",
+    choices=["upload", "download"],
+    help="'upload' to send local files to GCS, 'download' to get files from GCS",
+)
+
+parser.add_argument(
+    "-s",
+    "--source",
+    nargs="+",
+    required=True,
+    help="upload: a local directory or several local files. download: a gcs prefix ending with '/' (ex: 'gs://bucket_name/folder_name/') or several gcs paths of the same bucket",
+)
+
+parser.add_argument(
+    "-d",
+    "--destination",
+    required=True,
+    help="upload: a gcs prefix (ex: 'gs://bucket_name/folder_name/'). download: a local directory",
+)
+
+parser.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    required=False,
+    help="Number of files transferred at the same time.",
+    default=gcp_config.GCS_TRANSFER_WORKERS,
+)
+
+args = parser.parse_args()
+
+if args.action == "upload":
+    bucket_name, prefix = split_gcs_path(args.destination)
+
+    summary = upload_files(
+        # A single directory is uploaded keeping the relative path of its files
+        origin_paths=args.source[0]
+        if len(args.source) == 1 and os.path.isdir(args.source[0])
+        else args.source,
+        bucket_name=bucket_name,
+        destination_prefix=prefix,
+        max_workers=args.workers,
+    )
+
+else:
+    gcs_paths = [split_gcs_path(source) for source in args.source]
+    bucket_name = gcs_paths[0][0]
+
+    if any(gcs_path[0] != bucket_name for gcs_path in gcs_paths):
+        raise ValueError("All the gcs paths must be in the same bucket")
+
+    # A single path ending with '/' is a prefix, all its files are downloaded
+    summary = download_files(
+        gcs_file_paths=gcs_paths[0][1]
+        if len(gcs_paths) == 1
+        and (gcs_paths[0][1] == "" or gcs_paths[0][1].endswith("/"))
+        else [gcs_path[1] for gcs_path in gcs_paths],
+        local_directory=args.destination,
+        bucket_name=bucket_name,
+        max_workers=args.workers,
+    )
+
+print(f"{'file':<60}{'status':>8}{'seconds':>10}")
+
+for result in summary:
+    print(
+        f"{result['origin'][-60:]:<60}{result['status']:>8}{result['seconds']:>10.2f}"
+    )
+
+    if result["error"] is not None:
+        print(f"    {result['error']}")
+
+# A non zero exit code lets a pipeline know that some files were not transferred
+if any(result["status"] == "failed" for result in summary):
+    sys.exit(1)
@@ -4,24 +4,33 @@ import sys
 sys.path.append("..")
 
 from rag_llm_energy_expert.services.ingestion.ingestion_pipeline import main
-from rag_llm_energy_expert.config import QdrantConfig
+from rag_llm_energy_expert.services.ingestion import batch_ingestion
+from rag_llm_energy_expert.config import QdrantConfig, IngestionConfig
 
 qdrant_config = QdrantConfig()
+ingestion_config = IngestionConfig()
 
 
 # Create parser
 parser = argparse.ArgumentParser(
-    description="This script loads a raw PDF stored either in Google Cloud Storage or in the local into a vector DB"
+    description="This script loads raw PDFs stored either in Google Cloud Storage or in the local into a vector DB"
 )
 
 # Add args
-parser.add_argument(
+input_group = parser.add_mutually_exclusive_group(required=True)
+
+input_group.add_argument(
     "-f",
     "--file_path",
-    required=True,
     help="Either a gcs path: (ex: 'gs://bucket_name/folder_name/pdf_name.pdf') or a local path (can be a relative path or a full path ex: 'local_folder/pdf_file.pdf' or 'C:Users/folder/pdf_file.pdf')",
 )
 
+input_group.add_argument(
+    "-s",
+    "--source",
+    help="Batch mode. Either a gcs prefix (ex: 'gs://bucket_name/folder_name/'), a local directory or a manifest (text file with one path per line).",
+)
+
 parser.add_argument(
     "--chunk-overlap",
     required=False,
@@ -52,13 +61,58 @@ parser.add_argument(
     help="Wheter to create a new vector DB if it doesn't exist.",
 )
 
-# Parse args
-args = parser.parse_args()
+parser.add_argument(
+    "--no-stream",
+    action="store_true",
+    help="Wait for all the document's embeddings before indexing them, instead of indexing them while they are streamed.",
+)
+
+parser.add_argument(
+    "--state-file",
+    required=False,
+    help="Batch mode. JSON file with the status of each file, the files already indexed are skipped when running the batch again.",
+    default=ingestion_config.BATCH_STATE_FILE,
+)
+
+parser.add_argument(
+    "--parse-workers",
+    type=int,
+    required=False,
+    help="Batch mode. Number of processes parsing files at the same time.",
+    default=ingestion_config.PARSE_WORKERS,
+)
 
-main(
-    file_path=args.file_path,
-    embedding_model_name=args.embedding_model_name,
-    chunk_overlap=args.chunk_overlap,
-    collection_name=args.vectordb_collection,
-    create_db_collection=args.create_collection,
+parser.add_argument(
+    "--embedding-concurrency",
+    type=int,
+    required=False,
+    help="Batch mode. Max number of files being embedded and indexed at the same time.",
+    default=ingestion_config.EMBEDDING_CONCURRENCY,
 )
+
+# The parsing processes of the batch mode import this script again, it must only run once
+if __name__ == "__main__":
+    # Parse args
+    args = parser.parse_args()
+
+    if args.source is not None:
+        batch_ingestion.main(
+            source=args.source,
+            embedding_model_name=args.embedding_model_name,
+            chunk_overlap=args.chunk_overlap,
+            collection_name=args.vectordb_collection,
+            create_db_collection=args.create_collection,
+            state_file=args.state_file,
+            parse_workers=args.parse_workers,
+            embedding_concurrency=args.embedding_concurrency,
+        )
+
+    else:
+        main(
+            file_path=args.file_path,
+            embedding_model_name=args.embedding_model_name,
+            chunk_overlap=args.chunk_overlap,
+            collection_name=args.vectordb_collection,
+            create_db_collection=args.create_collection,
+            stream_embeddings=not args.no_stream,
+        )
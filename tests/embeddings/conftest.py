@@ -0,0 +1,15 @@
+import os
+import sys
+
+# The modules of the embedding service import each other by their names, as it runs from its directory
+SERVICE_DIR = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "..",
+    "rag_llm_energy_expert",
+    "services",
+    "embeddings",
+)
+
+sys.path.insert(0, os.path.abspath(SERVICE_DIR))
+sys.path.insert(0, os.path.abspath(os.path.join(SERVICE_DIR, "app")))
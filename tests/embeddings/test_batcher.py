@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+
+from batcher import MicroBatcher
+
+
+class RecordingEncoder:
+    # Encode each text as [len(text)], recording the texts of each call
+    def __init__(self, failing_text: str = None):
+        self.calls = list()
+        self.failing_text = failing_text
+
+    def __call__(self, embedding_model, texts: list[str]) -> np.ndarray:
+        self.calls.append(list(texts))
+
+        if self.failing_text in texts:
+            raise ValueError(f"Cannot encode {self.failing_text}")
+
+        return np.asarray([[len(text)] for text in texts], dtype=np.float32)
+
+
+def encode_concurrently(batcher: MicroBatcher, requests: list[list[str]]) -> list:
+    # Send the requests at the same time, returning the vectors or the exception of each one
+    def encode(texts: list[str]):
+        try:
+            return batcher.encode("model", texts)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+        return list(executor.map(encode, requests))
+
+
+def test_vectors_are_scattered_back_to_each_request():
+    encoder = RecordingEncoder()
+    batcher = MicroBatcher(encoder, window_ms=200, max_batch_size=100)
+
+    requests = [["a"], ["bb", "ccc"], ["dddd"]]
+    results = encode_concurrently(batcher, requests)
+
+    for texts, vectors in zip(requests, results):
+        assert vectors.ravel().tolist() == [len(text) for text in texts]
+
+    assert len(encoder.calls) == 1
+    assert batcher.stats()["requests"] == 3
+
+
+def test_a_failing_request_does_not_fail_the_others():
+    encoder = RecordingEncoder(failing_text="bad")
+    batcher = MicroBatcher(encoder, window_ms=200, max_batch_size=100)
+
+    results = encode_concurrently(batcher, [["a"], ["bad"], ["ccc"]])
+    failed = [result for result in results if isinstance(result, Exception)]
+    encoded = [
+        result.ravel().tolist()
+        for result in results
+        if not isinstance(result, Exception)
+    ]
+
+    assert len(failed) == 1 and "bad" in str(failed[0])
+    assert sorted(encoded) == [[1.0], [3.0]]
+
+
+def test_max_batch_size_must_be_positive():
+    with pytest.raises(ValueError):
+        MicroBatcher(RecordingEncoder(), window_ms=10, max_batch_size=0)
@@ -0,0 +1,74 @@
+from fastapi import HTTPException
+import asyncio
+import threading
+import time
+import pytest
+
+import main
+from worker_pool import WorkerPool
+
+
+def run_concurrently(first_seconds: float) -> HTTPException:
+    # Occupy the only worker of the pool, then send a second request through run_in_pool
+    release = threading.Event()
+
+    def blocking(timings: dict) -> None:
+        release.wait(first_seconds)
+
+    async def requests() -> HTTPException:
+        first = asyncio.create_task(main.run_in_pool(blocking, timings=dict()))
+        await asyncio.sleep(0.05)
+
+        try:
+            with pytest.raises(HTTPException) as error:
+                await main.run_in_pool(lambda timings: None, timings=dict())
+        finally:
+            release.set()
+            await first
+
+        return error.value
+
+    return asyncio.run(requests())
+
+
+def test_full_queue_returns_429(monkeypatch):
+    monkeypatch.setattr(main, "worker_pool", WorkerPool(1, 0, 5))
+
+    error = run_concurrently(first_seconds=5)
+
+    assert error.status_code == 429
+    assert error.headers == {"Retry-After": "1"}
+    assert main.worker_pool.stats()["rejected_overloaded"] == 1
+
+
+def test_queue_timeout_returns_503(monkeypatch):
+    monkeypatch.setattr(main, "worker_pool", WorkerPool(1, 1, 0.1))
+
+    error = run_concurrently(first_seconds=5)
+
+    assert error.status_code == 503
+    assert main.worker_pool.stats()["rejected_timeout"] == 1
+
+
+def test_cancelled_requests_keep_their_worker_until_the_call_ends():
+    pool = WorkerPool(1, 5, 5)
+    running = list()
+
+    def work(seconds: float) -> None:
+        running.append(1)
+        assert len(running) == 1
+        time.sleep(seconds)
+        running.pop()
+
+    async def requests() -> None:
+        first = asyncio.create_task(pool.run(work, 0.2))
+        await asyncio.sleep(0.05)
+        first.cancel()
+
+        # The second call waits for the thread of the cancelled one
+        await pool.run(work, 0)
+
+    asyncio.run(requests())
+
+    assert pool.stats()["running"] == 0
+    assert pool.stats()["completed"] == 2
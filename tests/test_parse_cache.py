@@ -0,0 +1,63 @@
+import shutil
+import pytest
+
+from rag_llm_energy_expert.services.ingestion import parse_cache
+
+
+@pytest.fixture
+def pdf_file(tmp_path) -> str:
+    path = tmp_path / "ley.pdf"
+    path.write_bytes(b"%PDF-1.7 content")
+
+    return str(path)
+
+
+@pytest.fixture
+def cache_location(tmp_path, monkeypatch) -> str:
+    location = str(tmp_path / "parse_cache")
+    monkeypatch.setattr(parse_cache.ingestion_config, "PARSE_CACHE_LOCATION", location)
+
+    return location
+
+
+def test_cache_key_only_depends_on_the_content(pdf_file, tmp_path):
+    moved_file = str(tmp_path / "renamed.pdf")
+    shutil.copy(pdf_file, moved_file)
+
+    assert parse_cache.cache_key(pdf_file, "v1") == parse_cache.cache_key(
+        moved_file, "v1"
+    )
+
+
+def test_cache_key_changes_with_the_content(pdf_file, tmp_path):
+    other_file = tmp_path / "other.pdf"
+    other_file.write_bytes(b"%PDF-1.7 other content")
+
+    assert parse_cache.cache_key(pdf_file, "v1") != parse_cache.cache_key(
+        str(other_file), "v1"
+    )
+
+
+def test_cache_key_changes_with_the_parser_version(pdf_file):
+    assert parse_cache.cache_key(pdf_file, "v1") != parse_cache.cache_key(
+        pdf_file, "v2"
+    )
+
+
+def test_pages_are_read_back_after_being_written(pdf_file, cache_location):
+    key = parse_cache.cache_key(pdf_file, "v1")
+    pages = ["# Page 1\n", "## Page 2\n"]
+
+    assert parse_cache.read_pages(key) is None
+    assert list(parse_cache.write_pages(key, pages, [[0], [1]], "v1")) == pages
+    assert list(parse_cache.read_pages(key)) == pages
+
+
+def test_an_interrupted_write_leaves_no_entry(pdf_file, cache_location):
+    key = parse_cache.cache_key(pdf_file, "v1")
+    written_pages = parse_cache.write_pages(key, ["a", "b"], [[0], [1]], "v1")
+
+    next(written_pages)
+    written_pages.close()
+
+    assert parse_cache.read_pages(key) is None
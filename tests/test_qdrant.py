@@ -0,0 +1,112 @@
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
+from collections import Counter
+import pytest
+
+from rag_llm_energy_expert.utils.vector_db import qdrant
+
+COLLECTION_NAME = "test_collection"
+METADATA = {
+    "title": "ley",
+    "storage_path": "gs://bucket/ley.pdf",
+    "upload_date": "2025-01-01",
+}
+
+
+@pytest.fixture
+def client(monkeypatch) -> QdrantClient:
+    # In-memory Qdrant, used by all the functions of the module
+    client = QdrantClient(":memory:")
+    monkeypatch.setattr(qdrant, "get_client", lambda: client)
+    qdrant.create_collection(COLLECTION_NAME, vector_size=2)
+
+    return client
+
+
+def make_chunks(texts: list[str], metadata: dict = METADATA) -> list[dict]:
+    return [
+        {
+            "vector_id": "",
+            "vector": [1.0, float(position)],
+            "payload": {"text": text, "metadata": dict(metadata)},
+            "embedding_version": "model:torch:float32",
+        }
+        for position, text in enumerate(texts)
+    ]
+
+
+def test_chunk_id_is_deterministic():
+    assert qdrant.chunk_id("ley", "text") == qdrant.chunk_id("ley", "text")
+
+
+@pytest.mark.parametrize(
+    "other",
+    [
+        ("otra ley", "text", 0, ""),
+        ("ley", "other text", 0, ""),
+        ("ley", "text", 1, ""),
+        ("ley", "text", 0, "model:onnx-int8:float32"),
+    ],
+)
+def test_chunk_id_changes_with_each_part(other):
+    assert qdrant.chunk_id("ley", "text", 0, "") != qdrant.chunk_id(*other)
+
+
+def test_create_points_numbers_repeated_texts():
+    points = qdrant.create_points(make_chunks(["a", "a", "b"]))
+
+    assert len({point.id for point in points}) == 3
+
+
+def test_create_points_shares_occurrences_between_batches():
+    occurrences = Counter()
+    first = qdrant.create_points(make_chunks(["a"]), occurrences=occurrences)
+    second = qdrant.create_points(make_chunks(["a"]), occurrences=occurrences)
+
+    assert first[0].id != second[0].id
+    assert [first[0].id, second[0].id] == [
+        point.id for point in qdrant.create_points(make_chunks(["a", "a"]))
+    ]
+
+
+def test_update_points_only_writes_the_differences(client):
+    counts = qdrant.update_points(
+        COLLECTION_NAME, qdrant.create_points(make_chunks(["a", "b", "c"]))
+    )
+    assert counts == {"added": 3, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    counts = qdrant.update_points(
+        COLLECTION_NAME, qdrant.create_points(make_chunks(["a", "b", "d"]))
+    )
+    assert counts == {"added": 1, "updated": 0, "unchanged": 2, "deleted": 1}
+
+    texts = {
+        point.payload["text"] for point in client.scroll(COLLECTION_NAME, limit=10)[0]
+    }
+    assert texts == {"a", "b", "d"}
+
+
+def test_update_points_updates_the_changed_metadata(client):
+    qdrant.update_points(COLLECTION_NAME, qdrant.create_points(make_chunks(["a", "b"])))
+
+    new_metadata = dict(METADATA, upload_date="2025-02-01")
+    counts = qdrant.update_points(
+        COLLECTION_NAME, qdrant.create_points(make_chunks(["a", "b"], new_metadata))
+    )
+    assert counts == {"added": 0, "updated": 2, "unchanged": 0, "deleted": 0}
+
+    stored_metadata = [
+        point.payload["metadata"]
+        for point in client.scroll(COLLECTION_NAME, limit=10)[0]
+    ]
+    assert stored_metadata == [new_metadata, new_metadata]
+
+
+def test_update_points_rejects_invalid_points(client):
+    with pytest.raises(TypeError):
+        qdrant.update_points(COLLECTION_NAME, [])
+
+    with pytest.raises(ValueError):
+        qdrant.update_points(
+            COLLECTION_NAME, [PointStruct(id=1, vector=[1.0, 0.0])] + [1]
+        )
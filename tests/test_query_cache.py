@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+from rag_llm_energy_expert.search import query_cache
+from rag_llm_energy_expert.search.query_cache import QueryCache, normalize_query
+from rag_llm_energy_expert.utils.vector_db.qdrant import notify_collection_update
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list[float]:
+    # Time returned by time.monotonic in the module, moved forward by the tests
+    now = [1000.0]
+    monkeypatch.setattr(query_cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+
+    return now
+
+
+def unit_vector(*values: float) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+
+    return vector / np.linalg.norm(vector)
+
+
+def key(query: str, collection_name: str = "laws") -> tuple:
+    return QueryCache.key(query, collection_name, 5, "model", 50)
+
+
+def test_normalize_query():
+    assert normalize_query("  ¿Qué es   la CFE? ") == normalize_query("qué es la cfe")
+
+
+def test_get_returns_the_cached_result(clock):
+    cache = QueryCache(max_entries=10, ttl_seconds=60, similarity_threshold=None)
+    cache.put(key("¿Qué es la CFE?"), unit_vector(1, 0), "result")
+
+    assert cache.get(key("qué es la cfe")) == "result"
+    assert cache.get(key("qué es la cfe", "other")) is None
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = QueryCache(max_entries=10, ttl_seconds=60, similarity_threshold=None)
+    cache.put(key("query"), unit_vector(1, 0), "result")
+
+    clock[0] += 59
+    assert cache.get(key("query")) == "result"
+
+    clock[0] += 1
+    assert cache.get(key("query")) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = QueryCache(max_entries=2, ttl_seconds=60, similarity_threshold=None)
+    cache.put(key("a"), unit_vector(1, 0), "a")
+    cache.put(key("b"), unit_vector(1, 0), "b")
+    cache.get(key("a"))
+    cache.put(key("c"), unit_vector(1, 0), "c")
+
+    assert cache.get(key("b")) is None
+    assert cache.get(key("a")) == "a"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_only_removes_the_collection(clock):
+    cache = QueryCache(max_entries=10, ttl_seconds=60, similarity_threshold=None)
+    cache.put(key("a", "laws"), unit_vector(1, 0), "a")
+    cache.put(key("b", "reports"), unit_vector(1, 0), "b")
+
+    assert cache.invalidate("laws") == 1
+    assert cache.get(key("a", "laws")) is None
+    assert cache.get(key("b", "reports")) == "b"
+
+
+def test_collection_updates_invalidate_the_shared_cache(clock):
+    cache = query_cache.get_query_cache()
+    cache.put(key("a", "updated_collection"), unit_vector(1, 0), "a")
+
+    notify_collection_update("updated_collection")
+
+    assert cache.get(key("a", "updated_collection")) is None
+
+
+def test_get_similar_uses_the_threshold(clock):
+    cache = QueryCache(max_entries=10, ttl_seconds=60, similarity_threshold=0.95)
+    cache.put(key("a"), unit_vector(1, 0), "a")
+
+    assert cache.get_similar(key("b"), unit_vector(1, 0.1)) == "a"
+    assert cache.get_similar(key("c"), unit_vector(1, 1)) is None
+    # A similar query must share the search parameters
+    assert cache.get_similar(key("d", "other"), unit_vector(1, 0)) is None
+
+    # The similar query is cached under its own key
+    assert cache.get(key("b")) == "a"
+
+
+def test_get_similar_is_disabled_without_threshold(clock):
+    cache = QueryCache(max_entries=10, ttl_seconds=60, similarity_threshold=None)
+    cache.put(key("a"), unit_vector(1, 0), "a")
+
+    assert cache.get_similar(key("b"), unit_vector(1, 0)) is None
+    assert cache.stats()["misses"] == 1
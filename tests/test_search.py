@@ -0,0 +1,80 @@
+from qdrant_client import models
+import pytest
+
+from rag_llm_energy_expert.search.context_builder import build_context, estimate_tokens
+from rag_llm_energy_expert.search.searchers_auxiliars import fuse_query_results
+
+
+def point(
+    point_id: int, score: float, text: str = "", title: str = "ley"
+) -> models.ScoredPoint:
+    return models.ScoredPoint(
+        id=point_id,
+        version=0,
+        score=score,
+        payload={"text": text, "metadata": {"title": title}},
+    )
+
+
+def response(*points: models.ScoredPoint) -> models.models.QueryResponse:
+    return models.models.QueryResponse(points=list(points))
+
+
+def test_rrf_fusion_ranks_the_points_found_by_several_windows_first():
+    results = [
+        response(point(1, 0.9), point(2, 0.8)),
+        response(point(2, 0.7), point(3, 0.6)),
+    ]
+
+    fused = fuse_query_results(results, fusion="rrf", rrf_k=60)
+
+    assert [p.id for p in fused] == [2, 1, 3]
+    assert fused[0].score == pytest.approx(1 / 62 + 1 / 61)
+
+
+def test_max_fusion_keeps_the_highest_score():
+    results = [
+        response(point(1, 0.5), point(2, 0.4)),
+        response(point(2, 0.9)),
+    ]
+
+    fused = fuse_query_results(results, fusion="max")
+
+    assert [(p.id, p.score) for p in fused] == [(2, 0.9), (1, 0.5)]
+
+
+def test_fusion_rejects_unknown_methods():
+    with pytest.raises(ValueError):
+        fuse_query_results([], fusion="sum")
+
+
+def test_build_context_keeps_the_best_chunks_within_the_budget():
+    points = [
+        point(1, 0.5, "b" * 40),
+        point(2, 0.9, "a" * 40),
+        point(3, 0.7, "c" * 400),
+        point(4, 0.1, "d" * 40),
+    ]
+    budget = 2 * estimate_tokens("a" * 40) + estimate_tokens("\n\n") + 1
+
+    context = build_context(points, token_budget=budget, with_sources=False)
+
+    # The long chunk doesn't fit, the smaller ones with a lower score still do
+    assert context["text"] == "a" * 40 + "\n\n" + "b" * 40
+    assert context["chunks"] == 2
+    assert context["skipped_chunks"] == 2
+    assert context["tokens"] <= budget
+
+
+def test_build_context_without_budget_keeps_all_the_chunks():
+    points = [point(1, 0.2, "x"), point(2, 0.8, "y", title="reglamento")]
+
+    context = build_context(points, token_budget=None)
+
+    assert context["text"] == "[Source: reglamento]\ny\n\n[Source: ley]\nx"
+    assert context["skipped_chunks"] == 0
+
+
+def test_build_context_rejects_invalid_budgets():
+    with pytest.raises(ValueError):
+        build_context([], token_budget=0)